@@ -6,8 +6,11 @@ import warnings
 
 import numpy as np
 
+from scipy.sparse import csr_matrix
 from scipy.sparse import isspmatrix
+from scipy.sparse import csgraph
 from scipy.sparse.csgraph import laplacian
+from scipy.sparse.csgraph import shortest_path
 
 from grakel.tools import inv_dict
 from grakel.tools import nested_dict_add
@@ -59,7 +62,7 @@ class Graph(object):
         A labels dictionary corresponding to all edges of the graph
         with keys: index/symbol-tuples and value: labels.
 
-    graph_format : str, valid_values={"dictionary", "adjacency", "all", "auto"}, default=None
+    graph_format : str, valid_values={"dictionary", "adjacency", "all", "csr", "auto"}, default=None
         Defines the internal representation of the graph object which can be
         a dictionary as a matrix, or both:
             + for dictionary: "dictionary"
@@ -68,6 +71,9 @@ class Graph(object):
 
             + for both: "all"
 
+            + for a compact sparse storage (see :class:`CSRStorage`), where
+              the other formats are built only when asked: "csr"
+
             + for the current_format (if existent): "auto"
 
     Attributes
@@ -119,7 +125,11 @@ class Graph(object):
     laplacian_graph : np.array
         Holds the graph laplacian.
 
-    _format : str, valid_values={"adjacency", "dictionary", "all"}
+    csr_storage : CSRStorage
+        The compact storage of the graph, for the "csr" format. The adjacency
+        and dictionary attributes hold views of it, built lazily.
+
+    _format : str, valid_values={"adjacency", "dictionary", "all", "csr"}
         Private attribute that keeps the current format.
 
     """
@@ -142,6 +152,9 @@ class Graph(object):
     label_group = dict()
     laplacian_graph = None
 
+    # Compact Preset
+    csr_storage = None
+
     def __init__(
             self,
             initialization_object=None,
@@ -149,7 +162,7 @@ class Graph(object):
             graph_format="auto", construct_labels=False):
         """__init__ function of the graph object."""
         self.construct_label = construct_labels
-        if graph_format in ["adjacency", "dictionary", "auto", "all"]:
+        if graph_format in ["adjacency", "dictionary", "auto", "all", "csr"]:
             self._format = graph_format
             if (initialization_object is not None):
                 self.build_graph(initialization_object,
@@ -160,7 +173,7 @@ class Graph(object):
                                  '- format must not be auto')
         else:
             raise ValueError('Invalid graph format.\nValid graph formats' +
-                             ' are "all", "dictionary", "adjacency", "auto"')
+                             ' are "all", "dictionary", "adjacency", "csr", "auto"')
 
     def build_graph(self, g, node_labels=None, edge_labels=None):
         """Build a graph structure, given a supported graph representation.
@@ -222,7 +235,10 @@ class Graph(object):
             self.adjacency_matrix = None
 
         # Import the given input properly
-        if (case == 1):
+        if self._format == "csr":
+            if case != 0:
+                self._import_csr(g)
+        elif (case == 1):
             self._import_adjacency(g)
         elif (case == 2):
             self._import_dictionary(g)
@@ -232,7 +248,7 @@ class Graph(object):
 
         Parameters
         ----------
-        graph_format : str, valid_values={"dictionary", "adjacency", "all"}
+        graph_format : str, valid_values={"dictionary", "adjacency", "all", "csr"}
             Defines the internal representation of the graph object which can
             be a dictionary as a matrix, or both:
                 + for dictionary: "dictionary"
@@ -241,20 +257,26 @@ class Graph(object):
 
                 + for both: "all"
 
+                + for the compact storage: "csr"
+
         Returns
         -------
         None.
 
         """
-        if graph_format not in ["all", "dictionary", "adjacency"]:
+        if graph_format not in ["all", "dictionary", "adjacency", "csr"]:
             raise ValueError(
                 'Invalid graph format for function change format' +
-                '. Valid formats are "all", "dictionary", "adjacency"')
+                '. Valid formats are "all", "dictionary", "adjacency", "csr"')
         else:
             if (graph_format is not self._format):
                 past_format = self._format
                 self._format = graph_format
-                if past_format is "adjacency":
+                if past_format == "csr":
+                    self._export_csr()
+                elif graph_format == "csr":
+                    self._import_csr(source=past_format)
+                elif past_format is "adjacency":
                     self._import_adjacency()
                 elif past_format is "dictionary":
                     self._import_dictionary()
@@ -285,6 +307,9 @@ class Graph(object):
 
                 + for both: "all"
 
+            For the "csr" format the desired formats are built as views
+            and the compact storage is kept.
+
         warn : bool, default=False
             Warn the user if the format of the graph is being changed.
 
@@ -293,7 +318,10 @@ class Graph(object):
         None.
 
         """
-        if graph_format is "all":
+        if self._format == "csr":
+            # Build the views of the compact storage, without converting it
+            self._csr_views(graph_format)
+        elif graph_format is "all":
             self.change_format(graph_format)
         elif graph_format is "dictionary":
             if self._format not in ["all", "dictionary"]:
@@ -321,6 +349,10 @@ class Graph(object):
         None.
 
         """
+        if self._format == "csr" and (label_type == "edge" or purpose == "dictionary"):
+            # Labels are constructed on the views of the compact storage
+            self._csr_views(purpose)
+
         if (purpose == "adjacency"):
             nodes = list(range(0, self.n))
             if (label_type == "vertex"):
@@ -454,7 +486,7 @@ class Graph(object):
 
         """
         if purpose == "any":
-            if self._format == "all":
+            if self._format in ["all", "csr"]:
                 purpose = "adjacency"
             else:
                 purpose = self._format
@@ -520,6 +552,23 @@ class Graph(object):
 
         if new_labels is None or not bool(new_labels):
             warnings.warn('user must provide new labels, input is None')
+        elif self._format == "csr":
+            symbols = self.csr_storage.symbols
+            if purpose == "dictionary" and symbols is not None:
+                # Translate symbols to indexes
+                idx = dict(zip(symbols, range(self.n)))
+                if label_type == "vertex":
+                    new_labels = {idx[k]: l for (k, l) in iteritems(new_labels) if k in idx}
+                else:
+                    new_labels = {(idx[i], idx[j]): l for ((i, j), l) in iteritems(new_labels)
+                                  if i in idx and j in idx}
+            self.csr_storage.set_labels(new_labels, label_type)
+
+            # Rebuild the label views
+            self.index_node_labels, self.index_edge_labels = None, None
+            self.node_labels, self.edge_labels = None, None
+            self.label_group = None
+            self._csr_labels()
         elif label_type == "vertex":
             if purpose is "dictionary":
                 if self._format in ["dictionary", "all"]:
@@ -597,7 +646,9 @@ class Graph(object):
                   computation complexity: :math:`O(|V|(|E|+|V|)log(|V|))`
 
                 + "floyd_warshall" : choses the floyd-warshall algorithm
-                  (Matrix computation complexity: :math:`O(|V|^3)`
+                  (Matrix computation complexity: :math:`O(|V|^3)`, where a
+                  faster equivalent (breadth first search or dijkstra) is used
+                  for unweighted or sparse graphs)
 
                 + "auto" : choses the best possible algorithm for the current
                   format
@@ -638,7 +689,7 @@ class Graph(object):
         if algorithm_type is "auto":
             if self._format in ["all", "dictionary"]:
                 algorithm_type = "dijkstra"
-            elif self._format is "adjacency":
+            elif self._format in ["adjacency", "csr"]:
                 algorithm_type = "floyd_warshall"
 
         if algorithm_type is "dijkstra":
@@ -657,8 +708,11 @@ class Graph(object):
                     shortest_path_mat[indexes[k], indexes[s]] = dict_fd[s]
 
         elif algorithm_type is "floyd_warshall":
-            self.desired_format("adjacency", warn=True)
-            shortest_path_mat = floyd_warshall(self.adjacency_matrix)
+            if self._format == "csr":
+                shortest_path_mat = all_pairs_shortest_path(self.csr_storage.matrix())
+            else:
+                self.desired_format("adjacency", warn=True)
+                shortest_path_mat = all_pairs_shortest_path(self.adjacency_matrix)
 
         self.shortest_path_mat = shortest_path_mat
         if labels is "all":
@@ -700,15 +754,21 @@ class Graph(object):
         elif purpose == "dictionary":
             case = False
         elif purpose == "any":
-            if self._format in ['all', 'adjacency']:
+            if self._format in ['all', 'adjacency', 'csr']:
                 case = True
             else:
                 case = False
         else:
             raise ValueError('unsupported label purpose')
 
-        if case:
+        if self._format == "csr":
+            self._csr_labels()
+        elif case:
             self.desired_format("adjacency", warn=True)
+        else:
+            self.desired_format("dictionary", warn=True)
+
+        if case:
             if label_type == "vertex":
                 if not bool(self.index_node_labels):
                     if self.construct_label:
@@ -733,7 +793,6 @@ class Graph(object):
             else:
                 raise ValueError('label type can only be "vertex" or "edge"')
         else:
-            self.desired_format("dictionary", warn=True)
             if label_type == "vertex":
                 if not bool(self.node_labels):
                     if self.construct_label:
@@ -816,7 +875,21 @@ class Graph(object):
                   edge labels
 
         """
-        if purpose in ['adjacency', 'dictionary', "any"]:
+        if self._format == "csr":
+            if purpose not in ['adjacency', 'dictionary', "any"]:
+                raise ValueError('purpose is either "adjacency", ' +
+                                 '"dictionary" or "any"')
+            # Read the row of the compact storage
+            idx = self._csr_index(vertex, purpose)
+            indptr, indices, weights = (self.csr_storage.indptr, self.csr_storage.indices,
+                                        self.csr_storage.weights)
+            ns, ws = indices[indptr[idx]:indptr[idx + 1]], weights[indptr[idx]:indptr[idx + 1]]
+            ns = self._csr_symbols(ns[ws > 0], purpose)
+            if not with_weights:
+                return ns
+            else:
+                return dict(zip(ns, ws[ws > 0].tolist()))
+        elif purpose in ['adjacency', 'dictionary', "any"]:
             if purpose == 'dictionary':
                 self.desired_format('dictionary')
                 case = True
@@ -1039,6 +1112,158 @@ class Graph(object):
                 self.node_labels = None
                 self.edge_labels = None
 
+    def _import_csr(self, g=None, source="adjacency"):
+        """Create the compact storage of the graph.
+
+        Parameters
+        ----------
+        g : a valid graph format, default=None
+            Similar to intialization object (of ``__init__``). If None, imports
+            from the existing representation.
+
+        source : str, valid_values={"adjacency", "dictionary", "all"}, default="adjacency"
+            The existing representation, when g is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        if g is not None:
+            source = ("adjacency" if is_adjacency(g) else "dictionary")
+
+        symbols = None
+        if source == "dictionary":
+            if g is not None:
+                is_edge_dict, vertices, edge_dictionary = is_edge_dictionary(g, True)
+                if not is_edge_dict:
+                    raise ValueError('unsupported edge_dictionary format')
+            else:
+                vertices, edge_dictionary = self.vertices, self.edge_dictionary
+
+            # Enumerate the sorted vertices, as for the adjacency matrix
+            symbols = sorted(list(vertices))
+            n = len(symbols)
+            idx = dict(zip(symbols, range(n)))
+            rows, cols, weights = list(), list(), list()
+            for (i, ns) in iteritems(edge_dictionary):
+                rows += len(ns)*[idx[i]]
+                cols += [idx[j] for j in ns.keys()]
+                weights += list(ns.values())
+            adjacency_matrix = csr_matrix((weights, (rows, cols)), shape=(n, n))
+            node_labels = {idx[v]: l for (v, l) in iteritems(self.node_labels or dict())
+                           if v in idx}
+            edge_labels = {(idx[i], idx[j]): l for ((i, j), l) in iteritems(self.edge_labels or dict())
+                           if i in idx and j in idx}
+        else:
+            if g is not None:
+                adjacency_matrix = g
+            else:
+                adjacency_matrix = self.adjacency_matrix
+                if source == "all" and bool(self.edsamic):
+                    symbols = sorted(self.edsamic.keys(), key=self.edsamic.get)
+            node_labels, edge_labels = self.index_node_labels, self.index_edge_labels
+
+        if symbols is not None and symbols == list(range(len(symbols))):
+            symbols = None
+        self._set_csr_storage(CSRStorage(adjacency_matrix, node_labels, edge_labels, symbols))
+
+    def _set_csr_storage(self, csr_storage):
+        """Set the compact storage of the graph and prune all views."""
+        self.csr_storage = csr_storage
+        self.n = csr_storage.n
+        self.adjacency_matrix, self.edge_dictionary = None, None
+        self.vertices, self.edsamic = None, None
+        self.index_node_labels, self.index_edge_labels = None, None
+        self.node_labels, self.edge_labels = None, None
+
+    def _export_csr(self):
+        """Convert the compact storage to the current format and drop it."""
+        self._csr_views(self._format)
+        if self._format == "dictionary":
+            self.n = -1
+            self.adjacency_matrix = None
+            self.edsamic = None
+            self.index_node_labels = None
+            self.index_edge_labels = None
+        elif self._format == "adjacency":
+            self.vertices = None
+            self.node_labels = None
+            self.edge_labels = None
+            self.edge_dictionary = None
+        self.csr_storage = None
+
+    def _csr_views(self, graph_format):
+        """Build (once) the views of the compact storage, for a format.
+
+        Parameters
+        ----------
+        graph_format : str, valid_values={"dictionary", "adjacency", "all"}
+            The format of the views.
+
+        Returns
+        -------
+        None.
+
+        """
+        if graph_format in ["adjacency", "all"] and self.adjacency_matrix is None:
+            self.adjacency_matrix = self.csr_storage.matrix().toarray()
+        if graph_format in ["dictionary", "all"] and self.edge_dictionary is None:
+            vertices = self._csr_symbols(np.arange(self.n), "dictionary")
+            self.vertices = set(vertices)
+            self.edsamic = dict(zip(vertices, range(self.n)))
+            self.edge_dictionary = self._csr_edge_dictionary()
+        self._csr_labels()
+
+    def _csr_labels(self):
+        """Build (once) the label dictionaries of the compact storage."""
+        if self.index_node_labels is None:
+            self.index_node_labels = self.csr_storage.get_labels("vertex")
+            self.index_edge_labels = self.csr_storage.get_labels("edge")
+            symbols = self.csr_storage.symbols
+            if symbols is None:
+                self.node_labels, self.edge_labels = self.index_node_labels, self.index_edge_labels
+            else:
+                self.node_labels = {symbols[i]: l for (i, l) in iteritems(self.index_node_labels)}
+                self.edge_labels = {(symbols[i], symbols[j]): l
+                                    for ((i, j), l) in iteritems(self.index_edge_labels)}
+
+    def _csr_edge_dictionary(self):
+        """Build an edge dictionary from the compact storage."""
+        indptr, indices, weights = (self.csr_storage.indptr, self.csr_storage.indices,
+                                    self.csr_storage.weights)
+        vertices = self._csr_symbols(np.arange(self.n), "dictionary")
+        edge_dictionary = {v: dict() for v in vertices}
+        rows = np.repeat(np.arange(self.n), np.diff(indptr))[weights > 0]
+        for (i, j, w) in zip(self._csr_symbols(rows, "dictionary"),
+                             self._csr_symbols(indices[weights > 0], "dictionary"),
+                             weights[weights > 0]):
+            edge_dictionary[i][j] = w
+        return edge_dictionary
+
+    def _csr_index(self, vertex, purpose):
+        """Get the index of a vertex (a symbol for the "dictionary" purpose) in the compact storage."""
+        symbols = self.csr_storage.symbols
+        if purpose == "dictionary" and symbols is not None:
+            if not bool(self.edsamic):
+                self.edsamic = dict(zip(symbols, range(self.n)))
+            if vertex not in self.edsamic:
+                raise ValueError('vertex not inside edge dictionary')
+            return self.edsamic[vertex]
+        else:
+            idx = int(vertex)
+            if not 0 <= idx < self.n:
+                raise ValueError("item with index "+str(idx)+" does not exist")
+            return idx
+
+    def _csr_symbols(self, indices, purpose):
+        """Get the vertices (symbols for the "dictionary" purpose) of indices in the compact storage."""
+        symbols = self.csr_storage.symbols
+        if purpose == "dictionary" and symbols is not None:
+            return [symbols[i] for i in indices.tolist()]
+        else:
+            return indices.tolist()
+
     def laplacian(self, save=True):
         """Calculate the laplacian of the given graph.
 
@@ -1055,6 +1280,10 @@ class Graph(object):
         """
         if self.laplacian_graph is not None:
             laplacian_graph = self.laplacian_graph
+        elif self._format == "csr":
+            laplacian_graph = laplacian(self.csr_storage.matrix()).toarray()
+            if save:
+                self.laplacian_graph = laplacian_graph
         else:
             self.desired_format("adjacency", warn=True)
             laplacian_graph = laplacian(self.adjacency_matrix)
@@ -1084,11 +1313,17 @@ class Graph(object):
             raise ValueError('purpose is either "adjacency" of "dictionary"')
 
         if purpose == "any":
-            if self._format in ['all', 'adjacency']:
+            if self._format in ['all', 'adjacency', 'csr']:
                 purpose = "adjacency"
             else:
                 purpose = "dictionary"
 
+        if self._format == "csr":
+            if purpose == "adjacency":
+                return range(0, self.n)
+            else:
+                return set(self._csr_symbols(np.arange(self.n), purpose))
+
         if purpose == "adjacency":
             self.desired_format("adjacency", warn=True)
             return range(0, self.n)
@@ -1114,6 +1349,18 @@ class Graph(object):
         if purpose not in ["adjacency", "dictionary"]:
             raise ValueError('purpose is either "adjacency" of "dictionary"')
 
+        if self._format == "csr":
+            # Read the edges from the compact storage
+            indptr, indices, weights = (self.csr_storage.indptr, self.csr_storage.indices,
+                                        self.csr_storage.weights)
+            idx_i = np.repeat(np.arange(self.n), np.diff(indptr))[weights > 0]
+            edges = zip(self._csr_symbols(idx_i, purpose),
+                        self._csr_symbols(indices[weights > 0], purpose))
+            if with_weights:
+                return list(zip(edges, weights[weights > 0]))
+            else:
+                return list(edges)
+
         if purpose == "adjacency":
             self.desired_format("adjacency", warn=True)
             idx_i, idx_j = np.where(self.adjacency_matrix > 0)
@@ -1147,7 +1394,9 @@ class Graph(object):
             Returns the adjacency matrix of the current graph.
 
         """
-        if self._format is "dictionary":
+        if self._format == "csr" and self.adjacency_matrix is None:
+            return self.csr_storage.matrix().toarray()
+        elif self._format is "dictionary":
             A = np.zeros(shape=(len(self.vertices), len(self.vertices)))
             v_map = {v: i for (i, v) in enumerate(sorted(list(self.vertices)))}
             for (k, v) in iteritems(self.edge_dictionary):
@@ -1173,7 +1422,9 @@ class Graph(object):
             Returns the edge_dictionary of the current graph.
 
         """
-        if self._format != "dictionary":
+        if self._format == "csr" and self.edge_dictionary is None:
+            return self._csr_edge_dictionary()
+        elif self._format not in ["dictionary", "csr"]:
             idx_i, idx_j = np.where(self.adjacency_matrix > 0)
             edge_dictionary = {i: dict() for i in range(0, self.n)}
             for (i, j) in zip(idx_i, idx_j):
@@ -1195,7 +1446,7 @@ class Graph(object):
             Returns the number of vertices.
 
         """
-        if self._format in ['all', 'adjacency']:
+        if self._format in ['all', 'adjacency', 'csr']:
             return self.n
         else:
             return len(self.vertices)
@@ -1231,7 +1482,10 @@ class Graph(object):
         -------
         N : dict
             A level, vertex nested dictionary of lists, corresponding to the
-            neighbors of level :math:`l` for a certain vertex :math:`v`.
+            neighbors of level :math:`l` (all vertices within distance
+            :math:`l`) for a certain vertex :math:`v`.
+            Computed from :func:`bounded_bfs`, which provides neighborhoods
+            in a compact form.
 
         D : dict
             For each level, set of tuples of nodes connected in that level.
@@ -1241,10 +1495,8 @@ class Graph(object):
             A dictionary of all pairs and their distances.
 
         """
-        N = dict()
-
         if purpose == "any":
-            if self._format == "all":
+            if self._format in ["all", "csr"]:
                 purpose = "adjacency"
             else:
                 purpose = self._format
@@ -1259,57 +1511,47 @@ class Graph(object):
             d = r
             warnings.warn('negative d as input - d set to r')
 
-        # chain neighbors
-        if sort_neighbors:
-            def chain(n):
-                return sorted(n)
+        # Traverse the adjacency, where vertices are enumerated
+        if self._format == "csr":
+            vertices = self._csr_symbols(np.arange(self.n), purpose)
+            A = self.csr_storage.matrix()
+        elif purpose == "adjacency":
+            self.desired_format("adjacency")
+            vertices = list(range(self.n))
+            A = self.adjacency_matrix
         else:
-            def chain(n):
-                return n
+            self.desired_format("dictionary")
+            vertices = list(self.get_vertices(purpose))
+            idx = {v: i for (i, v) in enumerate(vertices)}
+            rows, cols = list(), list()
+            for (i, ns) in iteritems(self.edge_dictionary):
+                rows += len(ns)*[idx[i]]
+                cols += [idx[j] for j in ns.keys()]
+            A = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(vertices), len(vertices)))
+
+        indptr, indices, distances = bounded_bfs(A, (max(r, d) if with_distances else r))
+        symbols = np.empty(len(vertices), dtype=object)
+        symbols[:] = vertices
+        roots = np.repeat(np.arange(len(vertices)), np.diff(indptr))
 
         # Initialize neighborhoods
-        vertices = list(self.get_vertices(purpose))
-        N[0] = {i: {i} for i in vertices}
+        N = {0: {i: {i} for i in vertices}}
+        neighbors = symbols[indices].tolist()
+        for level in range(1, r+1):
+            # Neighborhoods are ordered by distance
+            ends = (indptr[:-1] + np.bincount(roots[distances <= level],
+                                              minlength=len(vertices))).tolist()
+            N[level] = {v: (sorted(neighbors[a:b]) if sort_neighbors else neighbors[a:b])
+                        for (v, a, b) in zip(vertices, indptr.tolist(), ends)}
 
         # and distances
         if with_distances:
-            D = dict()
-            D[0] = set(zip(vertices, vertices))
-            Dist_pair = {(v, v): 0 for v in vertices}
-
-        if r > 0:
-            N[1] = dict()
-            if with_distances and d >= 1:
-                D[1] = set()
-            for i in vertices:
-                ns = list(self.neighbors(i, purpose))
-                N[1][i] = chain([i]+ns)
-                if with_distances and d >= 1:
-                    dset = {(i, n) for n in ns}
-                    Dist_pair.update(zip(dset, len(dset)*[1]))
-                    D[1] |= dset
-
-            # calculate neighborhoods by a recursive formula
-            # for all levels from 1 to r
-            for level in range(1, max(r, d)):
-                N[level+1] = dict()
-                if with_distances and level <= d-1:
-                    D[level+1] = set()
-                for i in vertices:
-                    neighbors = set()
-                    for w in N[level][i]:
-                        neighbors |= set(N[level][w])
-                    N[level+1][i] = chain(list(neighbors))
-                    if with_distances and level <= d-1:
-                        dset = {(i, j)
-                                for j in (neighbors - set(N[level][i]))}
-                        Dist_pair.update(zip(dset, len(dset)*[level+1]))
-                        D[level+1] |= dset
-            if with_distances:
-                for level in range(r+1, d):
-                    N.pop(level, None)
-
-        if with_distances:
+            D, Dist_pair = dict(), dict()
+            for level in range(d+1):
+                pairs = list(zip(symbols[roots[distances == level]].tolist(),
+                                 symbols[indices[distances == level]].tolist()))
+                D[level] = set(pairs)
+                Dist_pair.update(zip(pairs, len(pairs)*[level]))
             return N, D, Dist_pair
         else:
             return N
@@ -1325,11 +1567,13 @@ class Graph(object):
 
         Returns
         -------
-        g : dict or np.array
+        g : dict, np.array or scipy.sparse.csr_matrix
             The graph Object.
 
         """
-        if self._format in ["adjacency", "all"]:
+        if self._format == "csr":
+            return self.csr_storage.matrix()
+        elif self._format in ["adjacency", "all"]:
             return self.adjacency_matrix
         else:
             return self.edge_dictionary
@@ -1356,7 +1600,11 @@ class Graph(object):
             vertices = set(vertices).copy()
 
         subgraph = Graph(graph_format=self._format)
-        if self._format == 'adjacency':
+        if self._format == 'csr':
+            idx = sorted(self._csr_index(v, "dictionary") for v in vertices)
+            subgraph._set_csr_storage(self.csr_storage.subgraph(idx))
+            return subgraph
+        elif self._format == 'adjacency':
             for v in vertices:
                 if v < 0 or v >= self.n:
                     raise ValueError('vertices are not valid '
@@ -1462,6 +1710,203 @@ class Graph(object):
         return subgraph
 
 
+class CSRStorage(object):
+    """A compact storage of a graph, in compressed sparse row format.
+
+    Parameters
+    ----------
+    adjacency_matrix : array-like or scipy.sparse matrix, square
+        The adjacency matrix of the graph.
+
+    node_labels : dict, default=None
+        The labels of vertices, with keys indexes from 0 to n-1.
+
+    edge_labels : dict, default=None
+        The labels of edges, with keys index-tuples. Only labels
+        of edges with a nonzero weight are stored.
+
+    symbols : list, default=None
+        The symbols of all vertices, if they are not their indexes.
+
+    Attributes
+    ----------
+    n : int
+        The number of vertices.
+
+    indptr, indices, weights : np.array
+        The neighbors of vertex :math:`i` and the weights of their
+        edges are stored from position `indptr[i]` to `indptr[i+1]`.
+
+    node_labels : np.array, shape=(n,)
+        The codes of the vertex labels, or -1 for unlabeled vertices.
+
+    node_label_values : list
+        The vertex labels corresponding to each code.
+
+    edge_labels : np.array, shape=(indices.shape[0],)
+        The codes of the edge labels, or -1 for unlabeled edges.
+
+    edge_label_values : list
+        The edge labels corresponding to each code.
+
+    symbols : list or None
+        The symbols of all vertices.
+
+    """
+
+    __slots__ = ("n", "indptr", "indices", "weights", "node_labels", "node_label_values",
+                 "edge_labels", "edge_label_values", "symbols")
+
+    def __init__(self, adjacency_matrix, node_labels=None, edge_labels=None, symbols=None):
+        """__init__ function of the csr storage object."""
+        A = csr_matrix(adjacency_matrix, copy=True)
+        if A.shape[0] != A.shape[1]:
+            raise ValueError('input matrix must be squared')
+        A.sum_duplicates()
+        A.eliminate_zeros()
+
+        self.n = A.shape[0]
+        self.indptr, self.indices, self.weights = A.indptr, A.indices, A.data
+        self.symbols = symbols
+        self.set_labels(node_labels, "vertex")
+        self.set_labels(edge_labels, "edge")
+
+    def set_labels(self, labels, label_type="vertex"):
+        """Encode and store labels.
+
+        Parameters
+        ----------
+        labels : dict or None
+            The labels, with keys indexes for vertices or index-tuples for edges.
+
+        label_type : str, valid_values={"vertex", "edge"}, default="vertex"
+            Defines if the labels are for vertices or edges.
+
+        Returns
+        -------
+        None.
+
+        """
+        n = self.n
+        if labels is None:
+            labels = dict()
+
+        if label_type == "vertex":
+            keys = [k for k in labels.keys() if 0 <= k < n]
+            self.node_labels, self.node_label_values = \
+                encode_labels([labels[k] for k in keys], keys, n)
+        elif label_type == "edge":
+            # Find the position of each labeled edge, from sorted keys
+            edge_keys = np.repeat(np.arange(n), np.diff(self.indptr))*n + self.indices
+            keys = [k for k in labels.keys() if 0 <= k[0] < n and 0 <= k[1] < n]
+            codes = np.array([i*n + j for (i, j) in keys], dtype=np.int64)
+            positions = np.searchsorted(edge_keys, codes)
+            found = positions < edge_keys.shape[0]
+            found[found] = edge_keys[positions[found]] == codes[found]
+            self.edge_labels, self.edge_label_values = \
+                encode_labels([labels[k] for (k, f) in zip(keys, found) if f],
+                              positions[found], edge_keys.shape[0])
+        else:
+            raise ValueError('label type can only be "vertex" or "edge"')
+
+    def get_labels(self, label_type="vertex"):
+        """Decode the stored labels.
+
+        Parameters
+        ----------
+        label_type : str, valid_values={"vertex", "edge"}, default="vertex"
+            Defines if the labels are for vertices or edges.
+
+        Returns
+        -------
+        labels : dict
+            The labels, with keys indexes for vertices or index-tuples for edges.
+
+        """
+        if label_type == "vertex":
+            values = self.node_label_values
+            return {i: values[c] for (i, c) in enumerate(self.node_labels.tolist()) if c >= 0}
+        elif label_type == "edge":
+            values = self.edge_label_values
+            rows = np.repeat(np.arange(self.n), np.diff(self.indptr))
+            return {(i, j): values[c] for (i, j, c) in
+                    zip(rows.tolist(), self.indices.tolist(), self.edge_labels.tolist()) if c >= 0}
+        else:
+            raise ValueError('label type can only be "vertex" or "edge"')
+
+    def matrix(self):
+        """Get the adjacency matrix as a scipy.sparse.csr_matrix, sharing the stored arrays."""
+        return csr_matrix((self.weights, self.indices, self.indptr), shape=(self.n, self.n))
+
+    def subgraph(self, vertices):
+        """Get the storage of an induced subgraph.
+
+        Parameters
+        ----------
+        vertices : list
+            The sorted indexes of the vertices of the subgraph.
+
+        Returns
+        -------
+        subgraph : CSRStorage
+            The storage of the induced subgraph.
+
+        """
+        idx = np.array(vertices, dtype=int)
+
+        # Slice the positions of the edges, to keep their labels
+        P = csr_matrix((np.arange(1, self.indices.shape[0] + 1), self.indices, self.indptr),
+                       shape=(self.n, self.n))[idx, :][:, idx]
+        P.sort_indices()
+        positions = P.data - 1
+
+        symbols = (None if self.symbols is None else [self.symbols[i] for i in idx.tolist()])
+        subgraph = CSRStorage(csr_matrix((self.weights[positions], P.indices, P.indptr), shape=P.shape),
+                              symbols=symbols)
+        subgraph.node_labels = self.node_labels[idx]
+        subgraph.node_label_values = self.node_label_values
+        subgraph.edge_labels = self.edge_labels[positions]
+        subgraph.edge_label_values = self.edge_label_values
+        return subgraph
+
+
+def encode_labels(labels, positions, size):
+    """Encode labels as integer codes.
+
+    Parameters
+    ----------
+    labels : list
+        The labels.
+
+    positions : iterable
+        The position of each label.
+
+    size : int
+        The size of the codes array.
+
+    Returns
+    -------
+    codes : np.array, shape=(size,)
+        The code of the label at each position, or -1 where no label exists.
+
+    values : list
+        The label corresponding to each code.
+
+    """
+    codes = np.full(size, -1, dtype=int)
+    values, index = list(), dict()
+    for (position, label) in zip(positions, labels):
+        try:
+            code = index.setdefault(label, len(values))
+        except TypeError:
+            # Unhashable labels (e.g. attribute vectors) are kept as they are
+            code = len(values)
+        if code == len(values):
+            values.append(label)
+        codes[position] = code
+    return codes, values
+
+
 def is_adjacency(g, transform=False):
     """Define if input is in a valid adjacency matrix format.
 
@@ -1702,24 +2147,132 @@ def floyd_warshall(adjacency_matrix):
         The shortest path matrix as produced by floyd warshall
 
     """
-    n = adjacency_matrix.shape[0]
-
-    dist = np.empty((n, n))
     # Initialization
-    for i in range(0, n):
-        for j in range(0, n):
-            if (i == j):
-                dist[i, j] = 0.
-            elif (adjacency_matrix[i, j] == 0):
-                dist[i, j] = float("Inf")
-            else:
-                dist[i, j] = adjacency_matrix[i, j]
+    dist = np.array(adjacency_matrix, dtype=float)
+    dist[dist == 0] = float("Inf")
+    np.fill_diagonal(dist, 0.)
 
-    # Calculation
-    for k in range(0, n):
-        for i in range(0, n):
-            for j in range(0, n):
-                if (dist[i, j] > dist[i, k] + dist[k, j]):
-                    dist[i, j] = dist[i, k] + dist[k, j]
+    # Calculation: relax all pairs through each intermediate vertex k
+    for k in range(dist.shape[0]):
+        np.minimum(dist, dist[:, k, np.newaxis] + dist[np.newaxis, k, :], out=dist)
 
     return dist
+
+
+def all_pairs_shortest_path(adjacency_matrix, density_threshold=0.25):
+    """Calculate the shortest path matrix, choosing the fastest algorithm.
+
+    Unweighted graphs are traversed with breadth first search and sparse graphs
+    with positive weights with dijkstra, while the rest use (vectorized)
+    floyd warshall. All produce the same matrix as :func:`floyd_warshall`.
+
+    Parameters
+    ----------
+    adjacency_matrix : np.array or scipy.sparse matrix, square
+        The adjacency matrix of the graph, on which the distances are being
+        calculated.
+
+    density_threshold : float, default=0.25
+        The ratio of edges to vertex pairs, above which weighted graphs
+        are considered dense.
+
+    Returns
+    -------
+    dist : np.array
+        The shortest path matrix.
+
+    """
+    # Self loops do not participate in shortest paths.
+    if isspmatrix(adjacency_matrix):
+        A = adjacency_matrix.tocoo()
+        keep = (A.row != A.col) & (A.data != 0)
+        A = csr_matrix((A.data[keep].astype(float), (A.row[keep], A.col[keep])), shape=A.shape)
+        n, weights = A.shape[0], A.data
+    else:
+        A = np.array(adjacency_matrix, dtype=float)
+        np.fill_diagonal(A, 0.)
+        n, weights = A.shape[0], A[A != 0]
+
+    if n == 0 or weights.shape[0] == 0:
+        dist = np.full((n, n), float("Inf"))
+        np.fill_diagonal(dist, 0.)
+        return dist
+    elif np.all(weights == 1):
+        return shortest_path(A, method="D", unweighted=True)
+    elif np.all(weights > 0) and weights.shape[0] <= density_threshold*n*n:
+        return shortest_path(A, method="D")
+    else:
+        return floyd_warshall(A.toarray() if isspmatrix(A) else A)
+
+
+def bounded_bfs(adjacency_matrix, depth):
+    """Calculate the neighborhoods of all vertices up to a depth, with a truncated BFS.
+
+    Parameters
+    ----------
+    adjacency_matrix : np.array or scipy.sparse matrix, square
+        The adjacency matrix of the graph. Each row is connected to all
+        columns of its nonzero elements.
+
+    depth : int
+        The maximum distance from each vertex.
+
+    Returns
+    -------
+    indptr : np.array, shape=(n+1,)
+        The neighborhood of vertex :math:`i` is stored from position
+        `indptr[i]` to `indptr[i+1]`.
+
+    indices : np.array
+        The vertices of all neighborhoods, ordered by their distance from the
+        root (the root first) and by their index.
+
+    distances : np.array
+        The distance of each vertex in `indices` from its root.
+
+    """
+    A = csr_matrix(adjacency_matrix)
+    A.eliminate_zeros()
+    n = A.shape[0]
+
+    # Traverse from blocks of roots, so that their distances fit in memory
+    rows, cols, dists = [np.empty((0,), dtype=int)], [np.empty((0,), dtype=int)], [np.empty((0,))]
+    block = max(1, 2**22 // max(n, 1))
+    for start in range(0, n, block):
+        roots = np.arange(start, min(n, start + block))
+        D = csgraph.dijkstra(A, directed=True, indices=roots, unweighted=True, limit=depth)
+        i, j = np.nonzero(np.isfinite(D))
+        rows.append(roots[i])
+        cols.append(j)
+        dists.append(D[i, j])
+
+    rows, cols, dists = np.concatenate(rows), np.concatenate(cols), np.concatenate(dists).astype(int)
+    order = np.lexsort((cols, dists, rows))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n))))
+    return indptr, cols[order], dists[order]
+
+
+def get_neighborhood(neighborhoods, vertex, radius):
+    """Get a neighborhood of a vertex from the output of :func:`bounded_bfs`.
+
+    Parameters
+    ----------
+    neighborhoods : tuple
+        The indptr, indices and distances as produced from :func:`bounded_bfs`.
+
+    vertex : int
+        The index of the root vertex.
+
+    radius : int
+        The radius of the neighborhood.
+
+    Returns
+    -------
+    neighbors : np.array
+        The indexes of the vertices at distance at most radius, ordered by
+        their distance.
+
+    """
+    indptr, indices, distances = neighborhoods
+    start, end = indptr[vertex], indptr[vertex + 1]
+    return indices[start:start + np.searchsorted(distances[start:end], radius, side="right")]
@@ -185,10 +185,10 @@ class GraphKernel(BaseEstimator, TransformerMixin):
                       or [function] x:[(np.array, np.array)] , y:[(np.array, np.array)] -> [number]
 
                 - "vertex_histogram" or "subtree_wl"
-                    *No arguments*
+                    + (**o**) sparse: [bool]
 
                 - "edge_histogram"
-                    *No arguments*
+                    + (**o**) sparse: [bool]
 
             2. general_kernels (this kernel will use the next kernel
                on the list as base kernel)
@@ -221,6 +221,12 @@ class GraphKernel(BaseEstimator, TransformerMixin):
     random_seed : int, optional
         Initialize can provide a randomness by providing a random seed.
 
+    memmap : str, tuple or None, optional
+        A directory or a pair of a directory and a float type, where the kernel
+        matrix will be stored as a disk-backed `np.memmap` (see `Kernel`).
+        Supported only by kernels that are calculated pairwise.
+        Ignored when Nystroem GraphKernel object is instanciated.
+
     Attributes
     ----------
     kernel_ : function
@@ -252,7 +258,8 @@ class GraphKernel(BaseEstimator, TransformerMixin):
                  verbose=False,
                  n_jobs=None,
                  random_seed=default_random_seed_value,
-                 Nystroem=False):
+                 Nystroem=False,
+                 memmap=None):
         """`__init__` for `GraphKernel` object."""
         self.kernel = kernel
         self.normalize = normalize
@@ -260,9 +267,11 @@ class GraphKernel(BaseEstimator, TransformerMixin):
         self.n_jobs = n_jobs
         self.random_seed = random_seed
         self.Nystroem = Nystroem
+        self.memmap = memmap
         self.initialized_ = {"kernel": False,
                              "Nystroem": False,
-                             "n_jobs": False}
+                             "n_jobs": False,
+                             "memmap": False}
 
     def fit(self, X, y=None):
         """Fit a dataset, for a transformer.
@@ -353,6 +362,63 @@ class GraphKernel(BaseEstimator, TransformerMixin):
 
         return K
 
+    def transform_iter(self, X, batch_size=100):
+        """Calculate the kernel matrix between given and fitted dataset, in batches.
+
+        Parameters
+        ----------
+        X : iterable
+            Each element must be an iterable with at most three features and at
+            least one. The first that is obligatory is a valid graph structure
+            (adjacency matrix or edge_dictionary) while the second is
+            node_labels and the third edge_labels (that fitting the given graph
+            format). The test samples, which are consumed lazily.
+
+        batch_size : int, default=100
+            The number of graphs that are transformed together.
+
+        Yields
+        ------
+        K : numpy array, shape = [batch_size, n_input_graphs]
+            The rows of the kernel matrix, corresponding to each batch
+            (the last batch may be smaller).
+
+        """
+        # Check if nystroem has been initialized had been called
+        if bool(self.nystroem_):
+            check_is_fitted(self, 'components_')
+
+        for K in self.kernel_.transform_iter(X, batch_size=batch_size):
+            if bool(self.nystroem_):
+                yield K.dot(self.nystroem_normalization_.T)
+            else:
+                yield K
+
+    def transform_features(self, X):
+        """Calculate the explicit feature vectors of the given graphs.
+
+        Only supported for kernels defined as an inner product of explicit
+        features (e.g. "vertex_histogram", "shortest_path", "weisfeiler_lehman").
+
+        Parameters
+        ----------
+        X : iterable
+            Each element must be an iterable with at most three features and at
+            least one. The first that is obligatory is a valid graph structure
+            (adjacency matrix or edge_dictionary) while the second is
+            node_labels and the third edge_labels (that fitting the given graph
+            format).
+
+        Returns
+        -------
+        phi : np.array or scipy.sparse.csr_matrix, shape = [n_input_graphs, n_features]
+            The features of the input graphs, aligned to the features of the
+            fitted dataset.
+
+        """
+        check_is_fitted(self, 'kernel_')
+        return self.kernel_.transform_features(X)
+
     def fit_transform(self, X, y=None):
         """Fit and transform, on the same dataset.
 
@@ -408,7 +474,8 @@ class GraphKernel(BaseEstimator, TransformerMixin):
                 self.nystroem_ = self.Nystroem
             self.initialized_["Nystroem"] = True
 
-        if not self.initialized_["kernel"] or not self.initialized_["n_jobs"]:
+        if not self.initialized_["kernel"] or not self.initialized_["n_jobs"] or \
+                not self.initialized_["memmap"]:
             if self.kernel is None:
                 raise ValueError('kernel must be defined at the __init__ '
                                  'function of the graph kernel decorator ')
@@ -427,6 +494,12 @@ class GraphKernel(BaseEstimator, TransformerMixin):
                 kernel, params = self.make_kernel_(
                     copy.deepcopy(k), hidden_args)
 
+                if self.memmap is not None and not bool(self.nystroem_):
+                    if "memmap" not in kernel._get_param_names():
+                        raise ValueError('memmap is not supported for kernels '
+                                         'that are not calculated pairwise')
+                    params["memmap"] = self.memmap
+
                 self.kernel_ = kernel(**params)
             self.initialized_["kernel"] = True
 
@@ -34,15 +34,19 @@ def sm_kernel(x, y, kv, ke, k):
     Parameters
     ----------
     x, y : tuples, size=4
-        A tuple corresponding to the number of verices,
-        the edge dictionarie starting from vertices of
-        index zero, the labels for nodes, the labels for edges.
+        A tuple corresponding to the number of vertices, the edge index
+        matrix (the index of each edge or -1, for all pairs of distinct
+        vertices), the labels of the vertices and the labels of the edges
+        (in the order of their indexes).
 
-    kv : function
-        A kernel for vertex labels.
+    kv : function, str, tuple or None
+        A kernel for vertex labels. Either a function applied on each pair
+        of labels, or a kernel calculated natively on encoded labels:
+        "dirac" for integer codes, "dot" or ("rbf", gamma) for attribute
+        matrices.
 
-    ke : function
-        A kernel for edge labels.
+    ke : function, str, tuple or None
+        A kernel for edge labels, of the same form as kv.
 
     k : int
         The upper bound for the maximum size of subgraphs.
@@ -56,111 +60,123 @@ def sm_kernel(x, y, kv, ke, k):
     nx, Ex, Lx, Lex = x
     ny, Ey, Ly, Ley = y
 
-    # Costs for vertices
-    cv_l = list()
-
-    if kv is not None:
-        # Calculate valid vertices
-        Vp = list()
-
-        # calculate product graph vertex set
-        nv = 0
-        for i in range(nx):
-            for j in range(ny):
-                value = kv(Lx[i], Ly[j])
-                if(value != .0):
-                    # add to vertex set
-                    Vp.append((i, j))
-                    # initialise an empty set for neighbors
-                    cv_l.append(value)
-                    nv += 1
-    else:
-        Vp = [(i, j) for i in range(nx) for j in range(ny)]
-        nv = nx*ny
-        cv_l = iter(1. for _ in range(nv))
-
-    # Initialise c arrays.
-    cdef int *enum
-    cdef double *cv
-    cdef double **ce
-    enum = <int *>malloc(nv*cython.sizeof(int))
-    ce = <double **>malloc(nv*cython.sizeof(cython.p_double))
-    cv = <double *>malloc(nv*cython.sizeof(cython.double))
-
-    for (i, v) in enumerate(cv_l):
-        enum[i] = i
-        cv[i] = v
-        ce[i] = <double *>malloc(nv*cython.sizeof(cython.double))
-
-    with cython.boundscheck(False):
-        # calculate product graph valid edges
-        if ke is not None:
-            for (i, v) in enumerate(Vp):
-                for (j, w) in enumerate(Vp):
-                    if i == j:
-                        ce[j][i] = .0
-                        break
-                    if v[0] == w[0] or v[1] == w[1]:
-                        value = .0
-                    else:
-                        ea, eb = (v[0], w[0]), (v[1], w[1])
-                        conda, condb = ea not in Ex, eb not in Ey
-                        if conda and condb:
-                            # d-edge
-                            value = -1.
-                        elif conda or condb:
-                            value = .0
-                        else:
-                            # possible c-edge
-                            try:
-                              lea = Lex[ea]
-                              leb = Ley[eb]
-                            except KeyError as key_error:
-                              raise KeyError(key_error +
-                                             '\nEdge labels must exist for '
-                                             'all edges.')
-                            value = ke(lea, leb)
-
-                    ce[j][i] = ce[i][j] = value
-        else:
-            for (i, v) in enumerate(Vp):
-                for (j, w) in enumerate(Vp):
-                    if i == j:
-                        ce[j][i] = .0
-                        break
-                    if v[0] == w[0] or v[1] == w[1]:
-                        value = .0
-                    else:
-                        ea, eb = (v[0], w[0]), (v[1], w[1])
-                        conda, condb = ea not in Ex, eb not in Ey
-                        if conda and condb:
-                            # d-edge
-                            value = -1.
-                        elif conda or condb:
-                            value = .0
-                        else:
-                            value = 1.
-                    ce[j][i] = ce[i][j] = value
-            
+    # Costs for vertices and for pairs of edges with matching endpoints
+    cost_v = label_costs(Lx, Ly, nx, ny, kv)
+    mx = (int(np.max(Ex)) + 1 if nx > 0 else 0)
+    my = (int(np.max(Ey)) + 1 if ny > 0 else 0)
+    try:
+        cost_e = label_costs(Lex, Ley, mx, my, ke)
+    except KeyError as key_error:
+        raise KeyError(str(key_error) + '\nEdge labels must exist for all edges.')
+
+    # The product graph vertex set
+    Vp = np.flatnonzero(cost_v)
+    cdef int nv = Vp.shape[0]
+    cdef np.ndarray[int, ndim=1] vi_np = (Vp // ny).astype(np.intc)
+    cdef np.ndarray[int, ndim=1] vj_np = (Vp % ny).astype(np.intc)
+    cdef np.ndarray[int, ndim=1] enum_np = np.arange(nv, dtype=np.intc)
+    cdef np.ndarray[double, ndim=1] cv_np = np.ascontiguousarray(cost_v.ravel()[Vp], dtype=float)
+    cdef np.ndarray[double, ndim=2] ce_np = np.empty(shape=(nv, nv))
+    cdef np.ndarray[int, ndim=2] Ex_np = np.ascontiguousarray(Ex, dtype=np.intc)
+    cdef np.ndarray[int, ndim=2] Ey_np = np.ascontiguousarray(Ey, dtype=np.intc)
+    cdef np.ndarray[double, ndim=2] lab_np = np.ascontiguousarray(cost_e, dtype=float).reshape(mx, my)
 
     # Initialize values
     cdef np.ndarray[double, ndim=1] tv_np = np.zeros(shape=(k + 1))
     cdef double *tv = &tv_np[0]
+    if nv == 0:
+        return tv_np
 
+    cdef double **ce = <double **>malloc(nv*cython.sizeof(cython.p_double))
+    if ce == NULL:
+        raise MemoryError()
+    cdef int i, status, nx_c = nx, ny_c = ny, my_c = my, k_c = k
     try:
-        # Run the core function
-        sm_core_init(1, enum, nv, k, cv, ce, tv)
-
-        tv_np.reshape((k+1, 1))
+        for i in range(nv):
+            ce[i] = &ce_np[i, 0]
+
+        # The core keeps its state per call, so the GIL can be released
+        with nogil:
+            product_graph_edges(nv, &vi_np[0], &vj_np[0], nx_c, ny_c, <int *>Ex_np.data,
+                                <int *>Ey_np.data, <double *>lab_np.data, my_c, ce)
+            status = sm_core_init(1, &enum_np[0], nv, k_c, &cv_np[0], ce, tv)
+        if status != 0:
+            raise MemoryError()
         return tv_np
     finally:
         # Deallocate memory
-        free(enum)
-        free(cv)
-        for i in range(nv):
-            free(ce[i])
         free(ce)
 
+
+def label_costs(Lx, Ly, nx, ny, kernel):
+    """Calculate a kernel between all pairs of labels of two graphs.
+
+    Parameters
+    ----------
+    Lx, Ly : sequence or np.array
+        The labels (indexable by position) for a function kernel, or
+        the encoded labels for a native kernel.
+
+    nx, ny : int
+        The number of labels.
+
+    kernel : function, str, tuple or None
+        The kernel (see :func:`sm_kernel`). If None all pairs have cost 1.
+
+    Returns
+    -------
+    costs : np.array, shape=(nx, ny)
+        The kernel values.
+
+    """
+    if kernel is None:
+        return np.ones(shape=(nx, ny))
+    elif nx == 0 or ny == 0:
+        return np.zeros(shape=(nx, ny))
+    elif kernel == "dirac":
+        return np.equal.outer(Lx, Ly).astype(float)
+    elif kernel == "dot":
+        return np.dot(Lx, Ly.T)
+    elif type(kernel) is tuple and kernel[0] == "rbf":
+        distances = np.sum(Lx ** 2, axis=1)[:, np.newaxis] + np.sum(Ly ** 2, axis=1) - 2*np.dot(Lx, Ly.T)
+        return np.exp(-kernel[1]*np.maximum(distances, 0))
+    else:
+        return np.array([[kernel(Lx[i], Ly[j]) for j in range(ny)] for i in range(nx)],
+                        dtype=float).reshape(nx, ny)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void product_graph_edges(int nv, int *vi, int *vj, int nx, int ny, int *Ex, int *Ey,
+                              double *cost_e, int ney, double **ce) nogil:
+    """Fill the edge costs of the weighted product graph.
+
+    Product vertices sharing a vertex are not adjacent. Pairs of non edges
+    produce d-edges (-1) and pairs of edges c-edges, weighted by the edge
+    label kernel.
+    """
+    cdef int p, q, ea, eb
+    cdef double value
+    for p in range(nv):
+        ce[p][p] = .0
+        for q in range(p):
+            if vi[p] == vi[q] or vj[p] == vj[q]:
+                value = .0
+            else:
+                ea = Ex[vi[p]*nx + vi[q]]
+                eb = Ey[vj[p]*ny + vj[q]]
+                if ea < 0 and eb < 0:
+                    # d-edge
+                    value = -1.
+                elif ea < 0 or eb < 0:
+                    value = .0
+                else:
+                    # c-edge
+                    value = cost_e[ea*ney + eb]
+            ce[p][q] = value
+            ce[q][p] = value
+
+
 def k_to_ij_triangular(k, dim):
     i = int(dim - 1 - floor(sqrt(-8*k + 4*(dim+1)*dim-7)/2.0 - 0.5))
     j = int(k + i - (dim+1)*(dim)//2 + (dim-i+1)*(dim-i)//2)
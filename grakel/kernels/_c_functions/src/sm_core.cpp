@@ -4,42 +4,50 @@
  * Code taken from: http://www.partow.net/programming/hashfunctions/#APHashFunction
  */
 #include "../include/functions.hpp"
-#include <list>
 #include <cmath>
 #include <stdlib.h>
 
 using namespace std;
 
-double *cv;
-double **ce;
-double *totalValue;
-unsigned int k;
-
-void sm_core(double value, list<int> c, list<int> p, int* d, int lBound, int uBound) {
-	
-	while (!p.empty()) {
-		int i = p.front();
-		p.pop_front();
-
-		double nValue = value * cv[i];
-		double* iEdgeValue = ce[i];
-		for (list<int>::const_iterator it = c.begin(); it != c.end(); it++) {
-			nValue *= abs(iEdgeValue[*it]);
+/* The state of a single kernel calculation: the product graph, the
+ * accumulated values, the current clique and a candidate buffer
+ * for each clique size. Nothing is shared between calls, so the kernel
+ * can be calculated concurrently from many threads.
+ */
+struct sm_context {
+	double *cv;
+	double **ce;
+	double *totalValue;
+	unsigned int k;
+	int nv;
+	int *c;
+	unsigned int cSize;
+	int *candidates;
+};
+
+static void sm_core(sm_context *ctx, double value, const int *p, int pSize, int* d, int lBound, int uBound) {
+
+	for (int t = 0; t < pSize; t++) {
+		int i = p[t];
+
+		double nValue = value * ctx->cv[i];
+		double* iEdgeValue = ctx->ce[i];
+		for (unsigned int it = 0; it < ctx->cSize; it++) {
+			nValue *= fabs(iEdgeValue[ctx->c[it]]);
 		}
 
-		totalValue[c.size()] += nValue;
+		ctx->totalValue[ctx->cSize] += nValue;
 
-		if (c.size()+1 < k) {
-			c.push_back(i);
-			
+		if (ctx->cSize+1 < ctx->k) {
 			// prepare candidate set for recursive call
-			list<int> newP;
-			for (list<int>::const_iterator it = p.begin(); it != p.end(); it++) {
-				int v = *it;
+			int *newP = ctx->candidates + ctx->cSize * ctx->nv;
+			int newPSize = 0;
+			for (int it = t + 1; it < pSize; it++) {
+				int v = p[it];
 				if (iEdgeValue[v] != 0)
-					newP.push_back(v);
+					newP[newPSize++] = v;
 			}
-			
+
 			int newUBound = uBound;
 			int newLBound = lBound;
 			if (lBound <= uBound) {
@@ -50,7 +58,7 @@ void sm_core(double value, list<int> c, list<int> p, int* d, int lBound, int uBo
 				while (++nm <= newUBound) {
 					if (iEdgeValue[d[nm]] < 0) continue;
 					if (iEdgeValue[d[nm]] > 0)
-						newP.push_back(d[nm]);
+						newP[newPSize++] = d[nm];
 					// swap
 					tmp = d[newLBound];
 					d[newLBound] = d[nm];
@@ -58,39 +66,50 @@ void sm_core(double value, list<int> c, list<int> p, int* d, int lBound, int uBo
 					newLBound++;
 				}
 			}
-			
-			sm_core(nValue, c, newP, d, newLBound, newUBound);
-			c.pop_back();
+
+			ctx->c[ctx->cSize++] = i;
+			sm_core(ctx, nValue, newP, newPSize, d, newLBound, newUBound);
+			ctx->cSize--;
 		}
 	}
 }
-	
 
-void sm_core_init(double value, int* d, int nv, int kappa, double *cost_vertices, double **cost_edges, double *total_value) {
-	
-	cv = cost_vertices;
-	ce = cost_edges;
-	totalValue = total_value;
-	k = (unsigned int) kappa;
 
-	list<int> c;
+int sm_core_init(double value, int* d, int nv, int kappa, double *cost_vertices, double **cost_edges, double *total_value) {
+
+	sm_context ctx;
+	ctx.cv = cost_vertices;
+	ctx.ce = cost_edges;
+	ctx.totalValue = total_value;
+	ctx.k = (unsigned int) kappa;
+	ctx.nv = nv;
+	ctx.cSize = 0;
+
+	// A clique holds at most k vertices and the candidates of each size at most nv
+	ctx.c = (int *) malloc(((size_t) kappa) * sizeof(int));
+	ctx.candidates = (int *) malloc(((size_t) kappa) * ((size_t) nv) * sizeof(int));
+	if (ctx.c == NULL || ctx.candidates == NULL) {
+		free(ctx.c);
+		free(ctx.candidates);
+		return -1;
+	}
+
 	int lBound = 0;
 	int uBound = nv-1;
 
 	for (int it=lBound; it<=uBound; it++) {
 		int i = d[it];
-		double nValue = value * cv[i];
-		
-		totalValue[0] += nValue;
+		double nValue = value * ctx.cv[i];
 
-		if (k > 1) {
-			c.push_back(i);
-			
+		ctx.totalValue[0] += nValue;
+
+		if (ctx.k > 1) {
 			// prepare candidate set for recursive call
-			list<int> p;
+			int *p = ctx.candidates;
+			int pSize = 0;
 			int tmp;
 			int newUBound = uBound;
-			double *iEdgeValue = ce[i];
+			double *iEdgeValue = ctx.ce[i];
 			while (iEdgeValue[d[newUBound]] == 0 && --newUBound > it);
 			int newLBound = it;
 			while (++newLBound <= newUBound && iEdgeValue[d[newLBound]] == 0);
@@ -98,16 +117,21 @@ void sm_core_init(double value, int* d, int nv, int kappa, double *cost_vertices
 			while (++nm <= newUBound) {
 				if (iEdgeValue[d[nm]] < 0) continue;
 				if (iEdgeValue[d[nm]] > 0)
-					p.push_back(d[nm]);
+					p[pSize++] = d[nm];
 				// swap
 				tmp = d[newLBound];
 				d[newLBound] = d[nm];
 				d[nm] = tmp;
 				newLBound++;
 			}
-			
-			sm_core(nValue, c, p, d, newLBound, newUBound);
-			c.pop_back();
+
+			ctx.c[ctx.cSize++] = i;
+			sm_core(&ctx, nValue, p, pSize, d, newLBound, newUBound);
+			ctx.cSize--;
 		}
 	}
+
+	free(ctx.c);
+	free(ctx.candidates);
+	return 0;
 }
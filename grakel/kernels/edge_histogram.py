@@ -10,10 +10,13 @@ from sklearn.exceptions import NotFittedError
 from sklearn.utils.validation import check_is_fitted
 
 from grakel.kernels import Kernel
+from grakel.kernels.vertex_histogram import squared_norms
 from grakel.graph import Graph
 
 from numpy import zeros
-from numpy import einsum
+
+from scipy.sparse import csr_matrix
+
 
 # Python 2/3 cross-compatibility import
 from six import iteritems
@@ -25,7 +28,10 @@ class EdgeHistogram(Kernel):
 
     Parameters
     ----------
-    None.
+    sparse : bool, default=False
+        Store the feature matrices as :class:`scipy.sparse.csr_matrix`,
+        instead of dense numpy arrays. Advised when the number of distinct
+        labels is large (e.g. as a base kernel of WeisfeilerLehman).
 
     Attributes
     ----------
@@ -34,19 +40,26 @@ class EdgeHistogram(Kernel):
     """
 
     def __init__(self, n_jobs=None,
-                 normalize=False, verbose=False):
+                 normalize=False, verbose=False, sparse=False):
         """Initialize an edge kernel."""
         super(EdgeHistogram, self).__init__(n_jobs=n_jobs,
                                             normalize=normalize,
                                             verbose=verbose)
+        self.sparse = sparse
+        self.initialized_.update({"sparse": False})
 
-    def initialized_(self):
+    def initialize_(self):
         """Initialize all transformer arguments, needing initialization."""
         if not self.initialized_["n_jobs"]:
             if self.n_jobs is not None:
                 warn('no implemented parallelization for EdgeHistogram')
             self.initialized_["n_jobs"] = True
 
+        if not self.initialized_["sparse"]:
+            if self.sparse not in [True, False]:
+                raise TypeError('sparse must be a boolean')
+            self.initialized_["sparse"] = True
+
     def parse_input(self, X):
         """Parse and check the given input for EH kernel.
 
@@ -62,7 +75,7 @@ class EdgeHistogram(Kernel):
 
         Returns
         -------
-        out : np.array, shape=(len(X), n_labels)
+        out : np.array or scipy.sparse.csr_matrix, shape=(len(X), n_labels)
             A np array for frequency (cols) histograms for all Graphs (rows).
 
         """
@@ -71,10 +84,12 @@ class EdgeHistogram(Kernel):
         else:
             rows, cols, data = list(), list(), list()
             if self._method_calling in [1, 2]:
-                labels = dict()
+                labels, fitted_labels = dict(), dict()
                 self._labels = labels
             elif self._method_calling == 3:
-                labels = dict(self._labels)
+                # unseen labels are indexed after the fitted ones
+                labels, fitted_labels = dict(), self._labels
+            nl = len(fitted_labels)
             ni = 0
             for (i, x) in enumerate(iter(X)):
                 is_iter = isinstance(x, Iterable)
@@ -102,10 +117,12 @@ class EdgeHistogram(Kernel):
                     rows.append(ni)
 
                     # and to the value that this label is indexed
-                    col_idx = labels.get(label, None)
+                    col_idx = fitted_labels.get(label, None)
+                    if col_idx is None:
+                        col_idx = labels.get(label, None)
                     if col_idx is None:
                         # if not indexed, add the new index (the next)
-                        col_idx = len(labels)
+                        col_idx = nl + len(labels)
                         labels[label] = col_idx
 
                     # designate the certain column information
@@ -115,12 +132,16 @@ class EdgeHistogram(Kernel):
                     data.append(frequency)
                 ni += 1
 
-            # Initialise the feature matrix
-            features = zeros(shape=(ni, len(labels)))
-            features[rows, cols] = data
-
             if ni == 0:
                 raise ValueError('parsed input is empty')
+
+            # Initialise the feature matrix
+            if self.sparse:
+                features = csr_matrix((data, (rows, cols)),
+                                      shape=(ni, nl + len(labels)), dtype=float)
+            else:
+                features = zeros(shape=(ni, nl + len(labels)))
+                features[rows, cols] = data
             return features
 
     def _calculate_kernel_matrix(self, Y=None):
@@ -131,7 +152,7 @@ class EdgeHistogram(Kernel):
 
         Parameters
         ----------
-        Y : np.array, default=None
+        Y : np.array or scipy.sparse.csr_matrix, default=None
             The array between samples and features.
 
         Returns
@@ -147,8 +168,24 @@ class EdgeHistogram(Kernel):
             K = self.X.dot(self.X.T)
         else:
             K = Y[:, :self.X.shape[1]].dot(self.X.T)
+
+        if self.sparse:
+            K = K.toarray()
         return K
 
+    def _transform_features(self, X):
+        """Calculate the edge label histograms of the given graphs, on the fitted labels."""
+        self._method_calling = 3
+        # Check is fit had been called
+        check_is_fitted(self, ['X'])
+
+        # Input validation and parsing
+        if X is None:
+            raise ValueError('transform input cannot be None')
+        else:
+            Y = self.parse_input(X)
+        return Y[:, :self.X.shape[1]], squared_norms(Y)
+
     def diagonal(self):
         """Calculate the kernel matrix diagonal of the fitted data.
 
@@ -170,12 +207,12 @@ class EdgeHistogram(Kernel):
             check_is_fitted(self, ['_X_diag'])
         except NotFittedError:
             # Calculate diagonal of X
-            self._X_diag = einsum('ij,ij->i', self.X, self.X)
+            self._X_diag = squared_norms(self.X)
 
         try:
             # If transform has happened return both diagonals
             check_is_fitted(self, ['_Y'])
-            return self._X_diag, einsum('ij,ij->i', self._Y, self._Y)
+            return self._X_diag, squared_norms(self._Y)
         except NotFittedError:
             # Else just return both X_diag
             return self._X_diag
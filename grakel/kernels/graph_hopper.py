@@ -3,17 +3,21 @@
 # License: BSD 3 clause
 import numpy as np
 
-from collections import defaultdict
 from collections import Iterable
+from functools import partial
 from numbers import Real
 from warnings import warn
 
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+from sklearn.externals import joblib
+
 from grakel.kernels import Kernel
 from grakel.graph import Graph
-from grakel.graph import dijkstra
 
-# Python 2/3 cross-compatibility import
-from six.moves import filterfalse
+# The maximum number of vertices of a block of graphs,
+# whose node level kernels are calculated together
+block_vertices = 2**10
 
 
 class GraphHopper(Kernel):
@@ -34,6 +38,11 @@ class GraphHopper(Kernel):
     _metric : function
         The base metric applied between features.
 
+    _block_metric : tuple or None
+        The name and the parameter of a supported metric, for which the
+        kernel matrix is calculated in blocks of stacked graphs.
+        None for a user defined metric.
+
     _calculate_norm : bool
         Defines if the norm of the attributes will be calculated
         (in order to avoid recalculation when using it with e.g. gaussian).
@@ -43,11 +52,13 @@ class GraphHopper(Kernel):
     _graph_format = "all"
 
     def __init__(self, n_jobs=None,
-                 normalize=False, verbose=False, kernel_type='linear'):
+                 normalize=False, verbose=False, kernel_type='linear',
+                 memmap=None):
         """Initialize an Graph Hopper kernel."""
         super(GraphHopper, self).__init__(n_jobs=n_jobs,
                                           normalize=normalize,
-                                          verbose=verbose)
+                                          verbose=verbose,
+                                          memmap=memmap)
         self.kernel_type = kernel_type
         self.initialized_.update({"kernel_type": False})
 
@@ -58,26 +69,32 @@ class GraphHopper(Kernel):
             if type(self.kernel_type) is str:
                 if self.kernel_type == "linear":
                     self._metric = linear_kernel
+                    self._block_metric = ("linear", None)
                     self._calculate_norm = False
                 elif self.kernel_type == "gaussian":
-                    self._metric = lambda x, y: gaussian_kernel(x, y, 1)
+                    self._metric = partial(gaussian_kernel, mu=1)
+                    self._block_metric = ("gaussian", 1)
                     self._calculate_norm = True
                 elif self.kernel_type == "bridge":
                     self._metric = bridge_kernel
+                    self._block_metric = ("bridge", None)
                     self._calculate_norm = False
                 else:
                     raise ValueError('Unsupported kernel with name "' + str(self.kernel_type) + '"')
             elif (type(self.kernel_type) is tuple and len(self.kernel_type) == 2 and
                     self.kernel_type[0] == "gaussian" and isinstance(self.kernel_type[1], Real)):
-                self._metric = lambda x, y: gaussian_kernel(x, y, self.kernel_type[1])
+                self._metric = partial(gaussian_kernel, mu=self.kernel_type[1])
+                self._block_metric = self.kernel_type
                 self._calculate_norm = True
             elif callable(self.kernel_type):
-                self._metric = self._kernel_type
+                self._metric = self.kernel_type
+                self._block_metric = None
                 self._calculate_norm = False
             else:
                 raise TypeError('Unrecognized "kernel_type": can either be a str '
                                 'from the supported: "linear", "gaussian", "bridge" '
                                 'or tuple ("gaussian", mu) or a callable.')
+            self.initialized_["kernel_type"] = True
 
     def parse_input(self, X):
         """Parse and check the given input for the Graph Hopper kernel.
@@ -127,14 +144,15 @@ class GraphHopper(Kernel):
                                     'graph object or a list with at least '
                                     'a graph like object and node, ')
 
-                spm, attr = g.build_shortest_path_matrix(labels="vertex")
+                attr = g.get_labels(purpose="adjacency")
                 nv = g.nv()
                 try:
                     attributes = np.array([attr[j] for j in range(nv)])
                 except TypeError:
                     raise TypeError('All attributes of a single graph should have the same dimension.')
-                diam.append(int(np.max(spm[spm < float("Inf")])))
-                graphs.append((g.get_adjacency_matrix(), nv, attributes))
+                dag, occ = shortest_path_dags(g.get_adjacency_matrix())
+                diam.append(len(occ) - 1)
+                graphs.append((dag, occ, nv, attributes))
                 ni += 1
 
         if self._method_calling == 1:
@@ -144,98 +162,87 @@ class GraphHopper(Kernel):
 
         out = list()
         for i in range(ni):
-            AM, node_nr, attributes = graphs[i]
-            des = np.zeros(shape=(node_nr, node_nr, max_diam), dtype=int)
-            occ = np.zeros(shape=(node_nr, node_nr, max_diam), dtype=int)
-
-            # Convert adjacency matrix to dictionary
-            idx_i, idx_j = np.where(AM > 0)
-            ed = defaultdict(dict)
-            for (a, b) in filterfalse(lambda a: a[0] == a[1], zip(idx_i, idx_j)):
-                ed[a][b] = AM[a, b]
-
-            for j in range(node_nr):
-                A = np.zeros(shape=AM.shape)
-
-                # Single-source shortest path from node j
-                D, p = dijkstra(ed, j)
-
-                D = np.array(list(D.get(k, float("Inf")) for k in range(node_nr)))
-                p[j] = -1
-
-                # Restrict to the connected component of node j
-                conn_comp = np.where(D < float("Inf"))[0]
-
-                # To-be DAG adjacency matrix of connected component of node j
-                A_cc = A[conn_comp, :][:, conn_comp]
-
-                # Adjacency matrix of connected component of node j
-                AM_cc = AM[conn_comp, :][:, conn_comp]
-                D_cc = D[conn_comp]
-                conn_comp_converter = np.zeros(shape=(A.shape[0], 1), dtype=int)
-                for k in range(conn_comp.shape[0]):
-                    conn_comp_converter[conn_comp[k]] = k
-                conn_comp_converter = np.vstack([0, conn_comp_converter])
-                p_cc = conn_comp_converter[np.array(list(p[k] for k in conn_comp)) + 1]
-
-                # Number of nodes in connected component of node j
-                conncomp_node_nr = A_cc.shape[0]
-                for v in range(conncomp_node_nr):
-                    if p_cc[v] > 0:
-                        # Generate A_cc by adding directed edges of form (parent(v), v)
-                        A_cc[p_cc[v], v] = 1
-
-                    # Distance from v to j
-                    v_dist = D_cc[v]
-
-                    # All neighbors of v in the undirected graph
-                    v_nbs = np.where(AM_cc[v, :] > 0)[0]
-
-                    # Distances of neighbors of v to j
-                    v_nbs_dists = D_cc[v_nbs]
-
-                    # All neighbors of v in undirected graph who are
-                    # one step closer to j than v is; i.e. SP-DAG parents
-                    v_parents = v_nbs[v_nbs_dists == (v_dist - 1)]
-
-                    # Add SP-DAG parents to A_cc
-                    A_cc[v_parents, v] = 1
-
-                # Computes the descendants & occurence vectors o_j(v), d_j(v)
-                # for all v in the connected component
-                occ_p, des_p = od_vectors_dag(A_cc, D_cc)
-
-                if des_p.shape[0] == 1 and j == 0:
-                    des[j, 0, 0] = des_p
-                    occ[j, 0, 0] = occ_p
-                else:
-                    # Convert back to the indices of the original graph
-                    for v in range(des_p.shape[0]):
-                        for l in range(des_p.shape[1]):
-                            des[j, conn_comp[v], l] = des_p[v, l]
-                    # Convert back to the indices of the original graph
-                    for v in range(occ_p.shape[0]):
-                        for l in range(occ_p.shape[1]):
-                            occ[j, conn_comp[v], l] = occ_p[v, l]
-
-            M = np.zeros(shape=(node_nr, max_diam, max_diam))
-            # j loops through choices of root
-            for j in range(node_nr):
-                des_mat_j_root = np.squeeze(des[j, :, :])
-                occ_mat_j_root = np.squeeze(occ[j, :, :])
-                # v loops through nodes
-                for v in range(node_nr):
-                    for a in range(max_diam):
-                        for b in range(a, max_diam):
-                            # M[v,:,:] is M[v]; a = node coordinate in path, b = path length
-                            M[v, a, b] += des_mat_j_root[v, b - a]*occ_mat_j_root[v, a]
-
+            dag, occ, node_nr, attributes = graphs[i]
+            M = hopper_weights(dag, occ, node_nr, max_diam)
             if self._calculate_norm:
                 out.append((M, attributes, np.sum(attributes ** 2, axis=1)))
             else:
                 out.append((M, attributes))
         return out
 
+    def _calculate_kernel_matrix(self, Y=None):
+        """Calculate the kernel matrix given a target_graph and a kernel.
+
+        For the supported metrics, the M and attribute matrices of all the
+        vertices are stacked and the node level kernels are calculated with
+        matrix products, between blocks of graphs. The kernel values are the
+        sums of the node level kernels, over each pair of graphs.
+
+        Parameters
+        ----------
+        Y : list, default=None
+            The extracted features of the target graphs, as produced by `parse_input`.
+            If None kernel is calculated between X and itself.
+
+        Returns
+        -------
+        K : numpy array or np.memmap, shape = [n_targets, n_inputs]
+            The kernel matrix: a calculation between all pairs of graphs
+            between targets and inputs. If Y is None targets and inputs
+            are the taken from self.X. Otherwise Y corresponds to targets
+            and self.X to inputs.
+
+        """
+        if self._block_metric is None:
+            return super(GraphHopper, self)._calculate_kernel_matrix(Y)
+
+        symmetric = Y is None
+        if symmetric:
+            Y = self.X
+
+        # Paths longer than the shortest padding, are not shared between the graphs
+        m = min(self.X[0][0].shape[1], Y[0][0].shape[1])
+        xs = stack_features(self.X, m)
+        ys = (xs if symmetric else stack_features(Y, m))
+
+        # Only the entries of M that are nonzero for both targets and inputs contribute
+        keep = np.flatnonzero(np.any(xs[0], axis=0) & np.any(ys[0], axis=0))
+        xs = (xs[0][:, keep],) + xs[1:]
+        ys = (xs if symmetric else (ys[0][:, keep],) + ys[1:])
+
+        shape = (len(Y), len(self.X))
+        if self._parallel is None and self._memmap is None:
+            K = np.zeros(shape=shape)
+        else:
+            K = self._allocate_kernel_matrix(shape=shape)
+
+        if self._block_metric[0] == "linear":
+            # The linear kernel is an inner product of graph level features
+            Fx, Fy = linear_features(xs), (None if symmetric else linear_features(ys))
+            stripe = max(1, block_vertices**2 // max(shape[1], 1))
+            for r0 in range(0, shape[0], stripe):
+                r1 = min(r0 + stripe, shape[0])
+                K[r0:r1] = (Fx if symmetric else Fy)[r0:r1].dot(Fx.T)
+        else:
+            rows, cols = vertex_blocks(ys[3]), vertex_blocks(xs[3])
+            blocks = [((r0, r1), (c0, c1)) for (i, (r0, r1)) in enumerate(rows)
+                      for (j, (c0, c1)) in enumerate(cols) if not symmetric or i <= j]
+            if self._parallel is None:
+                for ((r0, r1), (c0, c1)) in blocks:
+                    hopper_block(K, (r0, c0), slice_features(ys, r0, r1),
+                                 slice_features(xs, c0, c1), self._block_metric, symmetric)
+            else:
+                self._parallel(joblib.delayed(hopper_block)(
+                    K, (r0, c0), slice_features(ys, r0, r1), slice_features(xs, c0, c1),
+                    self._block_metric, symmetric) for ((r0, r1), (c0, c1)) in blocks)
+
+        if isinstance(K, np.memmap):
+            if self._memmap is None:
+                K = np.asarray(K)
+            else:
+                K.flush()
+        return K
+
     def pairwise_operation(self, x, y):
         """Graph Hopper kernel as proposed in :cite:`feragen2013scalable`.
 
@@ -262,6 +269,164 @@ class GraphHopper(Kernel):
                             (yp.reshape(yp.shape[0], m_sq),) + y[1:])
 
 
+def stack_features(features, m):
+    """Stack the extracted features of graphs, on the vertex axis.
+
+    Parameters
+    ----------
+    features : list
+        Extracted features from `parse_input`.
+
+    m : int
+        The side of the M matrices, that is kept.
+
+    Returns
+    -------
+    M : np.array, shape=(n_vertices, m*m)
+        The flattened M matrices of all the vertices.
+
+    NA : np.array, shape=(n_vertices, n_attributes)
+        The vertex attributes.
+
+    norm2 : np.array, shape=(n_vertices,)
+        The squared norms of the attributes.
+
+    offsets : np.array, shape=(n_graphs + 1,)
+        The index of the first vertex of each graph, followed by n_vertices.
+
+    """
+    M = np.vstack([f[0][:, :m, :m].reshape(f[0].shape[0], m*m) for f in features])
+    NA = np.vstack([np.reshape(f[1], (f[1].shape[0], -1)) for f in features]).astype(float)
+    offsets = np.cumsum([0] + [f[0].shape[0] for f in features])
+    return M, NA, np.sum(NA ** 2, axis=1), offsets
+
+
+def slice_features(stacked, g0, g1):
+    """Extract the stacked features of a range of graphs.
+
+    Parameters
+    ----------
+    stacked : tuple
+        Stacked features (see :func:`stack_features`).
+
+    g0, g1 : int
+        The first and the last (exclusive) graph.
+
+    Returns
+    -------
+    stacked : tuple
+        The stacked features of the graphs g0, ..., g1 - 1.
+
+    """
+    M, NA, norm2, offsets = stacked
+    v0, v1 = offsets[g0], offsets[g1]
+    return M[v0:v1], NA[v0:v1], norm2[v0:v1], offsets[g0:g1 + 1] - v0
+
+
+def vertex_blocks(offsets, size=None):
+    """Split graphs into ranges of consecutive graphs, with a bounded number of vertices.
+
+    Parameters
+    ----------
+    offsets : np.array
+        The vertex offsets of the graphs (see :func:`stack_features`).
+
+    size : int, default=None
+        The maximum number of vertices of a range, unless it consists of a single graph.
+        If None `block_vertices` is used.
+
+    Returns
+    -------
+    blocks : list
+        A list of graph ranges (g0, g1).
+
+    """
+    if size is None:
+        size = block_vertices
+    blocks, g0, ng = list(), 0, offsets.shape[0] - 1
+    while g0 < ng:
+        g1 = min(ng, max(g0 + 1, np.searchsorted(offsets, offsets[g0] + size, side="right") - 1))
+        blocks.append((g0, g1))
+        g0 = g1
+    return blocks
+
+
+def linear_features(stacked):
+    """Calculate graph level features, whose inner products are the linear Graph Hopper kernel.
+
+    The linear kernel :math:`\\sum_{v, w} \\langle M_{v}, M_{w} \\rangle \\langle a_{v}, a_{w} \\rangle`
+    equals the inner product of the sums :math:`\\sum_{v} M_{v} \\otimes a_{v}`.
+
+    Parameters
+    ----------
+    stacked : tuple
+        Stacked features (see :func:`stack_features`).
+
+    Returns
+    -------
+    features : np.array, shape=(n_graphs, m*m*n_attributes)
+        The graph level features.
+
+    """
+    M, NA, _, offsets = stacked
+    features = np.empty(shape=(offsets.shape[0] - 1, M.shape[1]*NA.shape[1]))
+    for i in range(features.shape[0]):
+        v0, v1 = offsets[i], offsets[i + 1]
+        features[i] = M[v0:v1].T.dot(NA[v0:v1]).ravel()
+    return features
+
+
+def hopper_block(K, offset, rows, cols, metric, symmetric=False):
+    """Calculate a block of the kernel matrix, from stacked features, and write it on K.
+
+    Parameters
+    ----------
+    K : np.array
+        The (shared) kernel matrix.
+
+    offset : tuple
+        The row and column index of K, where the block starts.
+
+    rows, cols : tuple
+        The stacked features of the graphs of the rows and the columns
+        (see :func:`stack_features`).
+
+    metric : tuple
+        The name of the node metric ("gaussian", "bridge") and its parameter.
+
+    symmetric : bool, default=False
+        If True K is symmetric, so off diagonal blocks are also written transposed.
+
+    Returns
+    -------
+    None.
+
+    """
+    M_i, NA_i, norm2_i, offsets_i = rows
+    M_j, NA_j, norm2_j, offsets_j = cols
+
+    # The node level kernels of all vertex pairs
+    weight_matrix = np.dot(M_i, M_j.T)
+    NA_squared_distmatrix = np.dot(NA_i, NA_j.T)
+    NA_squared_distmatrix *= -2
+    NA_squared_distmatrix += norm2_i[:, np.newaxis]
+    NA_squared_distmatrix += norm2_j
+    if metric[0] == "gaussian":
+        weight_matrix *= np.exp(-metric[1]*NA_squared_distmatrix)
+    else:
+        nodepair = (4 - np.sqrt(np.maximum(NA_squared_distmatrix, 0)))/4
+        weight_matrix *= np.maximum(nodepair, 0)
+
+    # Sum them over each pair of graphs
+    kb = np.add.reduceat(np.add.reduceat(weight_matrix, offsets_i[:-1], axis=0),
+                         offsets_j[:-1], axis=1)
+
+    r, c = offset
+    K[r:r + kb.shape[0], c:c + kb.shape[1]] = kb
+    if symmetric and r != c:
+        K[c:c + kb.shape[1], r:r + kb.shape[0]] = kb.T
+
+
 def linear_kernel(x, y):
     """Graph Hopper linear pairwise kernel as proposed in :cite:`feragen2013scalable`.
 
@@ -353,69 +518,89 @@ def kernelmatrix2distmatrix(K):
     return np.sqrt(diag_K + diag_K.T - 2*K)
 
 
-def od_vectors_dag(G, shortestpath_dists):
-    """Compute the set of occurrence and distance vectors for G.
+def shortest_path_dags(A):
+    """Calculate the shortest path DAGs rooted at every vertex of a graph.
 
-    Defined in :cite:`feragen2013scalable`.
+    All the DAGs are stored as a single block diagonal sparse matrix, where
+    the node :math:`(j, v)` is vertex v on the DAG rooted at j. Unweighted
+    graphs are traversed with BFS.
 
     Parameters
     ----------
-    G : np.array, n_dim=2
-        DAG induced from a gappy tree where the indexing of nodes gives a
-        breadth first order of the corresponding original graph
-
-    shortestpath_dists : np.array, n_dim=1
-        Shortest path distances from the source node.
+    A : np.array, shape=(n, n)
+        The adjacency matrix of the graph.
 
     Returns
     -------
-    occ : np.array, n_dim=2
-        n x d descendant matrix occ, where n: `G.shape[0]` loops through the
-        nodes of G, and d: 'diameter of G'. The rows of the occ matrix will be
-        padded with zeros on the right.
+    dag : scipy.sparse.csr_matrix, shape=(n*n, n*n)
+        The DAG edges :math:`(j, u) \\rightarrow (j, v)`, for each edge (u, v)
+        that lies on a shortest path from j.
+
+    occ : list
+        For each path length a, the indexes j*n + v and the number of
+        shortest paths from j to v with a edges (the occurrence vectors).
+
+    """
+    n = A.shape[0]
+    A = np.array(A, dtype=float)
+    np.fill_diagonal(A, 0)
+    A = csr_matrix(A)
+    D = shortest_path(A, method="D", unweighted=bool(np.all(A.data == 1)))
+    A = A.tocoo()
+
+    on_path = np.isclose(D[:, A.row] + A.data, D[:, A.col]) & np.isfinite(D[:, A.row])
+    j, e = np.nonzero(on_path)
+    dag = csr_matrix((np.ones(j.shape[0]), (j*n + A.row[e], j*n + A.col[e])),
+                     shape=(n*n, n*n))
+
+    # Propagate path counts from the roots along the DAGs
+    occ, paths = list(), np.zeros(shape=(n*n,))
+    paths[np.arange(n)*(n + 1)] = 1
+    dag_t = dag.T.tocsr()
+    while True:
+        idx = np.flatnonzero(paths)
+        if idx.shape[0] == 0:
+            break
+        occ.append((idx, paths[idx]))
+        paths = dag_t.dot(paths)
+    return dag, occ
+
+
+def hopper_weights(dag, occ, n, max_diam):
+    """Calculate the M matrix of the Graph Hopper kernel.
+
+    :math:`M[v, a, b]` counts the shortest paths of b edges that hop on v
+    after a edges, as defined in :cite:`feragen2013scalable`.
+
+    Parameters
+    ----------
+    dag : scipy.sparse.csr_matrix, shape=(n*n, n*n)
+        The shortest path DAGs (see :func:`shortest_path_dags`).
+
+    occ : list
+        The occurrence vectors (see :func:`shortest_path_dags`).
+
+    n : int
+        The number of vertices.
 
-    des : np.array, n_dim=2
-        n x d descendant matrix des, where n: `G.shape[0]` loops through the
-        nodes of G, and d: 'diameter of G'. The rows of the des matrix will be
-        padded with zeros on the right.
+    max_diam : int
+        The padded diameter, which must exceed the length of all shortest paths.
+
+    Returns
+    -------
+    M : np.array, shape=(n, max_diam, max_diam)
+        The M matrix.
 
     """
-    dag_size = G.shape[0]
-    DAG_gen_vector = shortestpath_dists + 1
-
-    # This only works when the DAG is a shortest path DAG on an unweighted graph
-    gen_sorted = DAG_gen_vector.argsort()
-    re_sorted = gen_sorted.argsort()
-    sortedG = G[gen_sorted, :][:, gen_sorted]
-    delta = int(np.max(DAG_gen_vector))
-
-    # Initialize:
-    # For a node v at generation i in the tree, give it the vector
-    # [0 0 ... 1 ... 0] of length h_tree with the 1 at the ith place.
-    occ = np.zeros(shape=(dag_size, delta), dtype=int)
-    occ[0, 0] = 1
-
-    # Initialize:
-    # For a node v at generation i in the tree, give it the vector
-    # [0 0 ... 1 ... 0] of length delta with the 1 at the ith place.
-    des = np.zeros(shape=(dag_size, delta), dtype=int)
-    des[:, 0] = np.ones(shape=(1, dag_size))
-
-    for i in range(dag_size):
-        edges_starting_at_ith = np.where(np.squeeze(sortedG[i, :]) == 1)[0]
-        occ[edges_starting_at_ith, :] = occ[edges_starting_at_ith, :] + \
-            np.matlib.repmat(np.hstack([0, occ[i, :-1]]), edges_starting_at_ith.shape[0], 1)
-
-        # Now use message-passing from the bottom of the DAG to add up the
-        # edges from each node. This is easy because the vertices in the DAG
-        # are depth-first ordered in the original tree; thus, we can just start
-        # from the end of the DAG matrix.
-        edges_ending_at_ith_from_end = np.where(np.squeeze(sortedG[:, dag_size - i - 1]) == 1)[0]
-        des[edges_ending_at_ith_from_end, :] = des[edges_ending_at_ith_from_end, :] + \
-            np.matlib.repmat(np.hstack([0, des[dag_size - i - 1, :-1]]),
-                             edges_ending_at_ith_from_end.shape[0], 1)
-
-    return occ[re_sorted, :], des[re_sorted, :]
+    M = np.zeros(shape=(n, max_diam, max_diam))
+
+    # des holds the number of DAG paths of l edges starting at each node
+    des = np.ones(shape=(n*n,))
+    for l in range(len(occ)):
+        for (a, (idx, count)) in enumerate(occ[:len(occ) - l]):
+            M[:, a, a + l] += np.bincount(idx % n, weights=count*des[idx], minlength=n)
+        des = dag.dot(des)
+    return M
 
 
 if __name__ == '__main__':
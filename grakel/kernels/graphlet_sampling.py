@@ -5,10 +5,16 @@ import collections
 import math
 import warnings
 
+from functools import partial
+
 import numpy as np
 
 from scipy.interpolate import interp1d
+from scipy.sparse import csr_matrix
+
 from sklearn.exceptions import NotFittedError
+from sklearn.externals import joblib
+from sklearn.utils import check_random_state
 from sklearn.utils.validation import check_is_fitted
 
 from grakel.graph import Graph
@@ -35,7 +41,9 @@ class GraphletSampling(Kernel):
 
     Parameters
     ----------
-    random_seed : int, default=42
+    random_seed : int or None, default=42
+        Seeds the random sampling of graphlets. Each graph is sampled from its
+        own random stream, so the result does not depend on n_jobs.
 
     k : int, default=5
         The dimension of the given graphlets.
@@ -84,10 +92,16 @@ class GraphletSampling(Kernel):
     _sample_graphlets : function
         A function taking as input a binary adjacency matrix, parametrised
         to work for the certain samples, k and deterministic/propabilistic
-        mode.
+        mode, returning the distinct sampled graphlets (as adjacency matrices)
+        paired with their number of occurrences.
 
     _graph_bins : dict
-        A dictionary of graph bins holding pynauty objects
+        A dictionary mapping the canonical form of each graphlet isomorphism
+        class to its bin index.
+
+    _canonical_forms : dict
+        A dictionary mapping graphlet adjacency bitmasks to their canonical
+        form, so that bliss is called only once per distinct graphlet.
 
     _nx : int
         Holds the number of sampled X graphs.
@@ -125,14 +139,16 @@ class GraphletSampling(Kernel):
 
     def initialize_(self):
         """Initialize all transformer arguments, needing initialization."""
+        super(GraphletSampling, self).initialize_()
         self._graph_bins = dict()
-        if not self.initialized_["n_jobs"]:
-            if self.n_jobs is not None:
-                warnings.warn('no implemented parallelization for GraphletSampling')
-            self.initialized_["n_jobs"] = True
 
         if not self.initialized_["random_seed"]:
-            np.random.seed(self.random_seed)
+            if self.random_seed is None:
+                self._random_seed = np.random.randint(2**31)
+            elif type(self.random_seed) is int and self.random_seed >= 0:
+                self._random_seed = self.random_seed
+            else:
+                raise TypeError('random_seed must be a non-negative int or None')
             self.initialized_["random_seed"] = True
 
         if not self.initialized_["k"]:
@@ -145,14 +161,14 @@ class GraphletSampling(Kernel):
             elif self.k < 3:
                 raise TypeError('k must be bigger than 3')
 
+            self._canonical_forms = dict()
             self.initialized_["k"] = True
 
         if not self.initialized_["sampling"]:
             sampling = self.sampling
             k = self.k
             if sampling is None:
-                self._sample_graphlets = lambda A: \
-                    sample_graphlets_all_connected(A, k)
+                self._sample_graphlets = partial(sample_graphlets_all_connected, k=k)
             elif type(sampling) is dict:
                 if "n_samples" in sampling:
                     # Get the number of samples
@@ -166,8 +182,8 @@ class GraphletSampling(Kernel):
                                       'ignoring arguments:', ', '.join(args))
 
                     # Initialise the sample graphlets function
-                    self._sample_graphlets = lambda A: \
-                        sample_graphlets_probabilistic(A, k, n_samples)
+                    self._sample_graphlets = partial(sample_graphlets_probabilistic,
+                                                     k=k, n_samples=n_samples)
                 if ("delta" in sampling or "epsilon" in sampling
                         or "a" in sampling):
                     # Otherwise if delta exists
@@ -211,11 +227,11 @@ class GraphletSampling(Kernel):
                             a = fallback_map[k]
 
                     # and calculate number of samples
-                    n_samples = math.ceil(2*(a*np.log10(2) +
-                                          np.log10(1/delta))/(epsilon**2))
+                    n_samples = int(math.ceil(2*(a*np.log10(2) +
+                                              np.log10(1/delta))/(epsilon**2)))
 
-                    self._sample_graphlets = lambda A: \
-                        sample_graphlets_probabilistic(A, k, n_samples)
+                    self._sample_graphlets = partial(sample_graphlets_probabilistic,
+                                                     k=k, n_samples=n_samples)
             else:
                 raise TypeError('sampling can either be a dictionary or None')
             self.initialized_["sampling"] = True
@@ -251,7 +267,7 @@ class GraphletSampling(Kernel):
 
         # Transform - calculate kernel matrix
         try:
-            check_is_fitted(self, ['phi_X'])
+            check_is_fitted(self, ['_phi_X'])
             phi_x = self._phi_X
         except NotFittedError:
             phi_x = np.zeros(shape=(self._nx, len(self._graph_bins)))
@@ -272,6 +288,30 @@ class GraphletSampling(Kernel):
             km /= np.sqrt(np.outer(Y_diag, X_diag))
         return km
 
+    def _transform_features(self, X):
+        """Calculate the graphlet frequencies of the given graphs, on the fitted graphlets."""
+        self._method_calling = 3
+        # Check is fit had been called
+        check_is_fitted(self, ['X'])
+
+        # Input validation and parsing
+        if X is None:
+            raise ValueError('transform input cannot be None')
+        else:
+            Y = self.parse_input(X)
+
+        nf = len(self._graph_bins)
+        rows, cols, data = list(), list(), list()
+        norms = np.zeros(shape=(self._ny,))
+        for ((i, j), v) in iteritems(Y):
+            norms[i] += v*v
+            if j < nf:
+                rows.append(i)
+                cols.append(j)
+                data.append(v)
+
+        return csr_matrix((data, (rows, cols)), shape=(self._ny, nf), dtype=float), norms
+
     def fit_transform(self, X):
         """Fit and transform, on the same dataset.
 
@@ -375,12 +415,16 @@ class GraphletSampling(Kernel):
         if not isinstance(X, collections.Iterable):
             raise TypeError('input must be an iterable\n')
         else:
-            i = -1
+            if self._method_calling in [1, 2]:
+                # Drop what was cached for a previous fit
+                for attr in ['_phi_X', '_X_diag', '_phi_Y']:
+                    if hasattr(self, attr):
+                        delattr(self, attr)
             if self._method_calling == 1:
                 self._graph_bins = dict()
             elif self._method_calling == 3:
                 self._Y_graph_bins = dict()
-            local_values = dict()
+            adjacency_matrices = list()
             for (idx, x) in enumerate(iter(X)):
                 is_iter = False
                 if isinstance(x, collections.Iterable):
@@ -400,60 +444,37 @@ class GraphletSampling(Kernel):
                     raise TypeError('each element of X must be either a ' +
                                     'graph or an iterable with at least 1 ' +
                                     'and at most 3 elements\n')
-                A = (A > 0).astype(int)
-                i += 1
-                # sample graphlets based on the initialized method
-                samples = self._sample_graphlets(A)
-
-                if self._method_calling == 1:
-                    for (j, sg) in enumerate(samples):
-                        # add the graph to an isomorphism class
-                        if len(self._graph_bins) == 0:
-                            self._graph_bins[0] = sg
-                            local_values[(i, 0)] = 1
-                        else:
-                            newbin = True
-                            for k in range(len(self._graph_bins)):
-                                if self._graph_bins[k].isomorphic(sg):
-                                    newbin = False
-                                    if (i, k) not in local_values:
-                                        local_values[(i, k)] = 1
-                                    local_values[(i, k)] += 1
-                                    break
-                            if newbin:
-                                local_values[(i, len(self._graph_bins))] = 1
-                                self._graph_bins[len(self._graph_bins)] = sg
-                elif self._method_calling == 3:
-                    for (j, sg) in enumerate(samples):
-                        # add the graph to an isomorphism class
-                        newbin = True
-                        for k in range(len(self._graph_bins)):
-                            if self._graph_bins[k].isomorphic(sg):
-                                newbin = False
-                                if (i, k) not in local_values:
-                                    local_values[(i, k)] = 1
-                                local_values[(i, k)] += 1
-                                break
-                        if newbin:
-                            if len(self._Y_graph_bins) == 0:
-                                self._Y_graph_bins[0] = sg
-                                local_values[(i, len(self._graph_bins))] = 1
-                            else:
-                                newbin_Y = True
-                                start = len(self._graph_bins)
-                                start_Y = len(self._Y_graph_bins)
-                                for l in range(start_Y):
-                                    if self._Y_graph_bins[l].isomorphic(sg):
-                                        newbin_Y = False
-                                        bin_key = (i, l + start)
-                                        if bin_key not in local_values:
-                                            local_values[bin_key] = 1
-                                        local_values[bin_key] += 1
-                                        break
-                                if newbin_Y:
-                                    idx = start + start_Y
-                                    local_values[(i, idx)] = 1
-                                    self._Y_graph_bins[start_Y] = sg
+                adjacency_matrices.append((A > 0).astype(int))
+
+            i = len(adjacency_matrices) - 1
+            # sample graphlets based on the initialized method, drawing each graph
+            # from an independent random stream so that results do not depend on n_jobs
+            stream = (0 if self._method_calling == 1 else 1)
+            seeds = (np.random.RandomState([self._random_seed, stream, j])
+                     for j in range(len(adjacency_matrices)))
+            if self._parallel is None:
+                samples = [self._sample_graphlets(A, random_state=seed)
+                           for (A, seed) in zip(adjacency_matrices, seeds)]
+            else:
+                samples = self._parallel(joblib.delayed(self._sample_graphlets)(A, random_state=seed)
+                                         for (A, seed) in zip(adjacency_matrices, seeds))
+
+            local_values = collections.Counter()
+            for (j, graphlets) in enumerate(samples):
+                for (sg, count) in graphlets:
+                    # add the graph to an isomorphism class
+                    key = canonical_form(sg, self._canonical_forms)
+                    if key in self._graph_bins:
+                        b = self._graph_bins[key]
+                    elif self._method_calling == 1:
+                        b = len(self._graph_bins)
+                        self._graph_bins[key] = b
+                    elif key in self._Y_graph_bins:
+                        b = self._Y_graph_bins[key]
+                    else:
+                        b = len(self._graph_bins) + len(self._Y_graph_bins)
+                        self._Y_graph_bins[key] = b
+                    local_values[(j, b)] += count
 
             if i == -1:
                 raise ValueError('parsed input is empty')
@@ -465,9 +486,12 @@ class GraphletSampling(Kernel):
             return local_values
 
 
-def sample_graphlets_probabilistic(A, k, n_samples):
+def sample_graphlets_probabilistic(A, k, n_samples, random_state=None):
     """Propabilistical sampling of n_samples of 3..k sized graphs.
 
+    All the vertex subsets are drawn at once, as the prefixes of random
+    permutations of the vertices.
+
     Parameters
     ----------
     A : np.array
@@ -480,29 +504,32 @@ def sample_graphlets_probabilistic(A, k, n_samples):
         Sets the value of randomly drawn random samples,
         from sizes between 3..k
 
+    random_state : RandomState, int, array_like or None, default=None
+        The random number generator or a seed to initialize it.
+
     Returns
     -------
-    graphlets : generator
-        Returns a generator of sampled graphlets (as pynauty graphs),
-        from sizes between 3..k.
+    graphlets : list
+        The distinct sampled graphlets (as binary adjacency matrices),
+        from sizes between 3..k, paired with their number of occurrences.
 
     """
-    s = list(range(A.shape[0]))
-    min_r, max_r = min(3, A.shape[0]), min(k, A.shape[0])
-    if min_r == max_r:
-        def rsamp(*args):
-            return min_r
-    else:
-        def rsamp(*args):
-            return np.random.randint(min_r, max_r+1)
-
-    for i in range(n_samples):
-        index_rand = np.random.choice(s, rsamp(), replace=False)
-        Q = A[index_rand, :][:, index_rand]
-        yield bGraph(Q.shape[0], zip(*np.where(Q == 1)))
-
-
-def sample_graphlets_all_connected(A, k):
+    rng = check_random_state(random_state)
+    n = A.shape[0]
+    min_r, max_r = min(3, n), min(k, n)
+    sizes = rng.randint(min_r, max_r+1, size=n_samples)
+
+    # bound the memory of the random keys
+    chunk = max(1, 2**20 // max(n, 1))
+    samples = np.empty(shape=(n_samples, max_r), dtype=int)
+    for start in range(0, n_samples, chunk):
+        keys = rng.random_sample((min(chunk, n_samples - start), n))
+        samples[start:start+chunk] = np.argsort(keys, axis=1)[:, :max_r]
+
+    return induced_graphlets(A, samples, sizes)
+
+
+def sample_graphlets_all_connected(A, k, random_state=None):
     """All the connected graphlets of size k of a given graph.
 
     The implemented algorithm can be found in :cite:`Karakashian2013AnAF` as `ConSubg`.
@@ -515,14 +542,96 @@ def sample_graphlets_all_connected(A, k):
     k : int
         The maximum dimension of the sampled graphlets.
 
+    random_state : object, default=None
+        Ignored, as the enumeration is deterministic.
+
     Returns
     -------
-    graphlets : generator
-        Returns a generator of sampled graphlets (as pynauty graphs),
-        of size k.
+    graphlets : list
+        The distinct connected graphlets (as binary adjacency matrices),
+        of size k, paired with their number of occurrences.
 
     """
     G = {i: set(np.where(A[i, :] != 0)[0]) for i in range(A.shape[0])}
-    for s in ConSubg(G, k, np.all(A == A.T)):
-        enum = {j: i for i, j in enumerate(s)}
-        yield bGraph(len(s), iter((enum[i], enum[j]) for i in s for j in s & G[i]))
+    samples = np.array([sorted(s) for s in ConSubg(G, k, np.all(A == A.T))], dtype=int)
+    if samples.shape[0] == 0:
+        return list()
+    return induced_graphlets(A, samples, np.full(samples.shape[0], samples.shape[1], dtype=int))
+
+
+def induced_graphlets(A, samples, sizes):
+    """Extract the distinct induced subgraphs of a graph, in bulk.
+
+    Parameters
+    ----------
+    A : np.array
+        A binary array defining a certain graph.
+
+    samples : np.array, shape=(n_samples, max_size)
+        Each row holds the vertices of a sample, of which the first are used.
+
+    sizes : np.array, shape=(n_samples,)
+        The number of vertices of each sample.
+
+    Returns
+    -------
+    graphlets : list
+        The distinct induced subgraphs (as binary adjacency matrices), paired
+        with their number of occurrences.
+
+    """
+    graphlets = list()
+    for r in np.unique(sizes):
+        index = samples[sizes == r, :r]
+        Q = A[index[:, :, None], index[:, None, :]] != 0
+        Q = np.logical_or(Q, np.transpose(Q, (0, 2, 1)))
+
+        # count the samples of each distinct adjacency bitmask
+        triu = np.triu_indices(r)
+        masks, counts = np.unique(Q[:, triu[0], triu[1]], axis=0, return_counts=True)
+        for (mask, count) in zip(masks, counts):
+            Q = np.zeros(shape=(r, r), dtype=bool)
+            Q[triu] = mask
+            graphlets.append((np.logical_or(Q, Q.T), count))
+    return graphlets
+
+
+def canonical_form(A, cache=None):
+    """Calculate a canonical form of a graphlet, identifying its isomorphism class.
+
+    Two graphlets are isomorphic if and only if their canonical forms are
+    equal. Edge direction is ignored, as on the bliss isomorphism test.
+
+    Parameters
+    ----------
+    A : np.array
+        A binary array defining a graphlet.
+
+    cache : dict, default=None
+        A dictionary mapping an adjacency bitmask to its canonical form.
+        If given, the bliss canonical labeling is computed only once for
+        each distinct adjacency matrix.
+
+    Returns
+    -------
+    key : tuple
+        The number of vertices and the packed upper triangle of the
+        adjacency matrix, after relabeling the vertices canonically.
+
+    """
+    n = A.shape[0]
+    A = np.logical_or(A, A.T)
+    triu = np.triu_indices(n)
+    mask = (n, np.packbits(A[triu]).tobytes())
+    if cache is not None and mask in cache:
+        return cache[mask]
+
+    # Relabel the vertices through the bliss canonical labeling
+    labeling = bGraph(n, zip(*np.where(A))).canonical_labeling()
+    perm = np.array([labeling[v] for v in range(n)], dtype=int)
+    C = np.zeros(shape=(n, n), dtype=bool)
+    C[perm[:, None], perm[None, :]] = A
+    key = (n, np.packbits(C[triu]).tobytes())
+    if cache is not None:
+        cache[mask] = key
+    return key
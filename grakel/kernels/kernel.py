@@ -2,11 +2,17 @@
 # Author: Ioannis Siglidis <y.siglidis@gmail.com>
 # License: BSD 3 clause
 import collections
-import warnings
 import copy
+import os
+import shutil
+import tempfile
+import warnings
 
 import numpy as np
 
+from scipy.sparse import diags
+from scipy.sparse import issparse
+
 from sklearn.base import BaseEstimator
 from sklearn.base import TransformerMixin
 from sklearn.exceptions import NotFittedError
@@ -14,15 +20,24 @@ from sklearn.utils.validation import check_is_fitted
 from sklearn.externals import joblib
 
 from grakel.graph import Graph
-from grakel.kernels._c_functions import k_to_ij_triangular
-from grakel.kernels._c_functions import k_to_ij_rectangular
 
 # Python 2/3 cross-compatibility import
 from six import iteritems
+from six import string_types
 try:
-    import itertools.imap as map
+    from weakref import finalize
 except ImportError:
-    pass
+    import atexit
+
+    def finalize(obj, func, *args):
+        """Call func with args at exit (no `weakref.finalize` support)."""
+        atexit.register(func, *args)
+
+# The shared memory filesystem, used for the parallel kernel matrix
+SYSTEM_SHARED_MEM_FS = '/dev/shm'
+
+# The maximum block side, for memory mapped kernel matrices
+memmap_block_side = 1024
 
 
 class Kernel(BaseEstimator, TransformerMixin):
@@ -44,6 +59,16 @@ class Kernel(BaseEstimator, TransformerMixin):
     verbose : bool, optional
         Define if messages will be printed on stdout.
 
+    memmap : str, tuple or None, optional
+        Write kernel matrices calculated pairwise, on disk-backed `np.memmap`
+        files instead of memory. The matrix is calculated and normalized block
+        by block, so that it is never entirely materialized in memory.
+            - str : a directory, where the matrices will be stored as `np.float64`
+
+            - tuple : a pair of a directory and a float type (e.g. `np.float32`)
+
+            - None : kernel matrices are stored as numpy arrays in memory
+
     Attributes
     ----------
     X : list
@@ -72,21 +97,28 @@ class Kernel(BaseEstimator, TransformerMixin):
         A Parallel initialized object to imply parallelization to kernel execution.
         The use of this object depends on the implementation of each base kernel.
 
+    _memmap : tuple or None
+        A pair of the directory and the dtype of memory mapped kernel matrices,
+        or None if the kernel matrix is stored in memory.
+
     """
 
     X = None
     _graph_format = "dictionary"
     _method_calling = 0
+    _memmap = None
 
     def __init__(self,
                  n_jobs=None,
                  normalize=False,
-                 verbose=False):
+                 verbose=False,
+                 memmap=None):
         """`__init__` for `kernel` object."""
         self.verbose = verbose
         self.n_jobs = n_jobs
         self.normalize = normalize
-        self.initialized_ = dict(n_jobs=False)
+        self.memmap = memmap
+        self.initialized_ = dict(n_jobs=False, memmap=False)
 
     def fit(self, X, y=None):
         """Fit a dataset, for a transformer.
@@ -163,9 +195,110 @@ class Kernel(BaseEstimator, TransformerMixin):
         self._is_transformed = True
         if self.normalize:
             X_diag, Y_diag = self.diagonal()
-            km /= np.sqrt(np.outer(Y_diag, X_diag))
+            if isinstance(km, np.memmap):
+                normalize_block_wise(km, Y_diag, X_diag, memmap_block_side)
+            else:
+                km /= np.sqrt(np.outer(Y_diag, X_diag))
         return km
 
+    def transform_iter(self, X, batch_size=100):
+        """Calculate the kernel matrix between given and fitted dataset, in batches.
+
+        The input is consumed lazily, so that graphs can be streamed and the
+        rows of the kernel matrix are produced as soon as a batch is complete.
+
+        Parameters
+        ----------
+        X : iterable
+            Each element must be an iterable with at most three features and at
+            least one. The first that is obligatory is a valid graph structure
+            (adjacency matrix or edge_dictionary) while the second is
+            node_labels and the third edge_labels (that fitting the given graph
+            format). The test samples.
+
+        batch_size : int, default=100
+            The number of graphs that are transformed together.
+
+        Yields
+        ------
+        K : numpy array, shape = [batch_size, n_input_graphs]
+            The rows of the kernel matrix, corresponding to each batch
+            (the last batch may be smaller). If normalization is set, the rows
+            are normalized with the cached diagonal of the fitted data.
+
+        """
+        if type(batch_size) is not int or batch_size <= 0:
+            raise ValueError('batch_size must be a positive integer')
+        if X is None:
+            raise ValueError('`transform_iter` input cannot be None')
+
+        batch = list()
+        for x in X:
+            batch.append(x)
+            if len(batch) == batch_size:
+                yield self.transform(batch)
+                batch = list()
+
+        if len(batch):
+            yield self.transform(batch)
+
+    def transform_features(self, X):
+        """Calculate the explicit feature vectors of the given graphs.
+
+        Only kernels that are defined as an inner product of explicit
+        (histogram) features implement this method. The inner product of
+        these features with those of the fitted dataset, equals the kernel
+        matrix calculated from `transform` (normalized if normalize is set).
+
+        Parameters
+        ----------
+        X : iterable
+            Each element must be an iterable with at most three features and at
+            least one. The first that is obligatory is a valid graph structure
+            (adjacency matrix or edge_dictionary) while the second is
+            node_labels and the third edge_labels (that fitting the given graph
+            format).
+
+        Returns
+        -------
+        phi : np.array or scipy.sparse.csr_matrix, shape = [n_input_graphs, n_features]
+            The features of the input graphs, aligned to the features of the
+            fitted dataset (unseen features are discarded). If normalize is
+            set, each row is divided by the norm of the full features of its
+            graph, unseen features included, as in `transform`.
+
+        """
+        phi, norms = self._transform_features(X)
+        if self.normalize:
+            norms = np.sqrt(norms)
+            norms[norms == 0] = 1
+            if issparse(phi):
+                phi = diags(1 / norms).dot(phi).tocsr()
+            else:
+                phi = phi / norms[:, np.newaxis]
+        return phi
+
+    def _transform_features(self, X):
+        """Calculate the unnormalized explicit features of the given graphs.
+
+        Parameters
+        ----------
+        X : iterable
+            The input graphs, as given to `transform_features`.
+
+        Returns
+        -------
+        phi : np.array or scipy.sparse.csr_matrix, shape = [n_input_graphs, n_features]
+            The features of the input graphs, aligned to the features of the
+            fitted dataset (unseen features are discarded).
+
+        norms : np.array, shape = [n_input_graphs]
+            The squared norm of the features of each input graph, including
+            the discarded ones.
+
+        """
+        raise NotImplementedError('Explicit features are not implemented!')
+
     def fit_transform(self, X):
         """Fit and transform, on the same dataset.
 
@@ -196,6 +329,12 @@ class Kernel(BaseEstimator, TransformerMixin):
         # Transform - calculate kernel matrix
         km = self._calculate_kernel_matrix()
 
+        if isinstance(km, np.memmap):
+            self._X_diag = np.array(np.diagonal(km), dtype=float)
+            if self.normalize:
+                normalize_block_wise(km, self._X_diag, self._X_diag, memmap_block_side)
+            return km
+
         self._X_diag = np.diagonal(km)
         if self.normalize:
             return km / np.sqrt(np.outer(self._X_diag, self._X_diag))
@@ -216,7 +355,7 @@ class Kernel(BaseEstimator, TransformerMixin):
 
         Returns
         -------
-        K : numpy array, shape = [n_targets, n_inputs]
+        K : numpy array or np.memmap, shape = [n_targets, n_inputs]
             The kernel matrix: a calculation between all pairs of graphs
             between targets and inputs. If Y is None targets and inputs
             are the taken from self.X. Otherwise Y corresponds to targets
@@ -224,45 +363,134 @@ class Kernel(BaseEstimator, TransformerMixin):
 
         """
         if Y is None:
-            K = np.zeros(shape=(len(self.X), len(self.X)))
-            if self._parallel is None:
+            if self._parallel is None and self._memmap is None:
+                K = np.zeros(shape=(len(self.X), len(self.X)))
                 cache = list()
                 for (i, x) in enumerate(self.X):
                     K[i, i] = self.pairwise_operation(x, x)
                     for (j, y) in enumerate(cache):
                         K[j, i] = self.pairwise_operation(y, x)
                     cache.append(x)
+                K = np.triu(K) + np.triu(K, 1).T
             else:
                 dim = len(self.X)
-                n_jobs, nsamples = self._n_jobs, ((dim+1)*(dim))//2
-
-                def kij(k):
-                    return k_to_ij_triangular(k, dim)
-
-                split = [iter(((i, j), (self.X[i], self.X[j])) for i, j in
-                         map(kij, range(*rg))) for rg in indexes(n_jobs, nsamples)]
-
-                self._parallel(joblib.delayed(assign)(s, K, self.pairwise_operation) for s in split)
-            K = np.triu(K) + np.triu(K, 1).T
-
+                K = self._allocate_kernel_matrix(shape=(dim, dim))
+                self._calculate_blocks(K, self.X, self.X,
+                                       triangular_blocks(dim, self._block_side(((dim+1)*dim)//2)),
+                                       symmetric=True)
         else:
-            K = np.zeros(shape=(len(Y), len(self.X)))
-            if self._parallel is None:
+            if self._parallel is None and self._memmap is None:
+                K = np.zeros(shape=(len(Y), len(self.X)))
                 for (j, y) in enumerate(Y):
                     for (i, x) in enumerate(self.X):
                         K[j, i] = self.pairwise_operation(y, x)
             else:
                 dim_X, dim_Y = len(self.X), len(Y)
-                n_jobs, nsamples = self._n_jobs, (dim_X * dim_Y)
+                K = self._allocate_kernel_matrix(shape=(dim_Y, dim_X))
+                self._calculate_blocks(K, Y, self.X,
+                                       rectangular_blocks(dim_Y, dim_X, self._block_side(dim_X*dim_Y)))
+
+        if isinstance(K, np.memmap):
+            if self._memmap is None:
+                K = np.asarray(K)
+            else:
+                K.flush()
+        return K
 
-                def kij(k):
-                    return k_to_ij_rectangular(k, dim_X)
+    def _allocate_kernel_matrix(self, shape):
+        """Allocate a kernel matrix, that will be calculated block by block.
 
-                split = [iter(((j, i), (Y[j], self.X[i])) for i, j in
-                         map(kij, range(*rg))) for rg in indexes(n_jobs, nsamples)]
+        Parameters
+        ----------
+        shape : tuple
+            The shape of the kernel matrix.
 
-                self._parallel(joblib.delayed(assign)(s, K, self.pairwise_operation) for s in split)
-        return K
+        Returns
+        -------
+        K : np.memmap
+            A disk-backed kernel matrix if memmap was set, else a
+            shared array that parallel jobs can write on.
+
+        """
+        if self._memmap is None:
+            return shared_array(shape=shape)
+        else:
+            directory, dtype = self._memmap
+            fd, filename = tempfile.mkstemp(suffix='.mmap', prefix='grakel_K_', dir=directory)
+            os.close(fd)
+            return np.memmap(filename, dtype=dtype, shape=shape, mode='w+')
+
+    def _block_side(self, nsamples):
+        """Calculate the side of the blocks, a kernel matrix is split into.
+
+        Parameters
+        ----------
+        nsamples : int
+            The number of kernel matrix elements that need to be calculated.
+
+        Returns
+        -------
+        side : int
+            The side of each square block.
+
+        """
+        side = block_size((1 if self._parallel is None else self._n_jobs), nsamples)
+        if self._memmap is not None:
+            side = min(side, memmap_block_side)
+        return side
+
+    def _calculate_blocks(self, K, rows, cols, blocks, symmetric=False):
+        """Calculate kernel matrix blocks, directly on K.
+
+        Parameters
+        ----------
+        K : np.array
+            The kernel matrix.
+
+        rows, cols : list
+            The graphs corresponding to the rows and the columns of K.
+
+        blocks : iterable
+            Pairs of row and column ranges as `((r0, r1), (c0, c1))`.
+
+        symmetric : bool, default=False
+            Defines if K is symmetric.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self._parallel is None:
+            for ((r0, r1), (c0, c1)) in blocks:
+                kernel_block(K, (r0, c0), rows[r0:r1], cols[c0:c1],
+                             self.pairwise_operation, symmetric=symmetric)
+        else:
+            pairwise_operation = self._detached_pairwise_operation()
+            self._parallel(joblib.delayed(kernel_block)(K, (r0, c0), rows[r0:r1], cols[c0:c1],
+                                                        pairwise_operation, symmetric=symmetric)
+                           for ((r0, r1), (c0, c1)) in blocks)
+
+    def _detached_pairwise_operation(self):
+        """Get the pairwise operation of a kernel copy, that holds no fitted data.
+
+        When a process based joblib backend is used, the pairwise operation
+        is pickled together with the object it is bound to. Detaching it from
+        the fitted data avoids sending the whole dataset to each job.
+
+        Parameters
+        ----------
+        None.
+
+        Returns
+        -------
+        pairwise_operation : function
+            The pairwise operation bound to a shallow copy of the kernel.
+
+        """
+        kernel = copy.copy(self)
+        kernel.X, kernel._Y, kernel._parallel = None, None, None
+        return kernel.pairwise_operation
 
     def diagonal(self):
         """Calculate the kernel matrix diagonal of the fit/transformed data.
@@ -353,7 +581,12 @@ class Kernel(BaseEstimator, TransformerMixin):
             return Xp
 
     def initialize_(self):
-        """Initialize all transformer arguments, needing initialisation."""
+        """Initialize all transformer arguments, needing initialisation.
+
+        Parallel jobs prefer a threading backend. A process based backend can
+        be chosen by fitting inside a `joblib.parallel_backend` context.
+
+        """
         if not self.initialized_["n_jobs"]:
             if type(self.n_jobs) is not int and self.n_jobs is not None:
                 raise ValueError('n_jobs parameter must be an int '
@@ -362,11 +595,27 @@ class Kernel(BaseEstimator, TransformerMixin):
                 self._parallel = None
             else:
                 self._parallel = joblib.Parallel(n_jobs=self.n_jobs,
-                                                 backend="threading",
+                                                 prefer="threads",
                                                  pre_dispatch='all')
                 self._n_jobs = self._parallel._effective_n_jobs()
             self.initialized_["n_jobs"] = True
 
+        if not self.initialized_["memmap"]:
+            if self.memmap is None:
+                self._memmap = None
+            else:
+                if type(self.memmap) is tuple and len(self.memmap) == 2:
+                    directory, dtype = self.memmap
+                else:
+                    directory, dtype = self.memmap, np.float64
+                if not isinstance(directory, string_types) or not os.path.isdir(directory):
+                    raise ValueError('memmap must be an existing directory or a tuple '
+                                     'of an existing directory and a float type')
+                if not np.issubdtype(dtype, np.floating):
+                    raise ValueError('memmap dtype must be a float type')
+                self._memmap = (directory, np.dtype(dtype))
+            self.initialized_["memmap"] = True
+
     def pairwise_operation(self, x, y):
         """Calculate a pairwise kernel between two elements.
 
@@ -402,24 +651,169 @@ class Kernel(BaseEstimator, TransformerMixin):
         super(Kernel, self).set_params(**params)
 
 
-def indexes(n_jobs, nsamples):
-    """Distribute samples accross n_jobs."""
-    n_jobs = n_jobs
+def block_size(n_jobs, nsamples, tiles_per_job=4):
+    """Calculate the side of the square blocks, that a kernel matrix is split into.
+
+    Parameters
+    ----------
+    n_jobs : int
+        The number of jobs the blocks will be distributed to.
+
+    nsamples : int
+        The number of kernel matrix elements that need to be calculated.
+
+    tiles_per_job : int, default=4
+        The desired number of blocks for each job, so that jobs
+        of unequal cost can be balanced.
+
+    Returns
+    -------
+    side : int
+        The side of each square block.
+
+    """
+    return max(1, int(np.sqrt(nsamples / float(tiles_per_job*max(n_jobs, 1)))))
+
+
+def triangular_blocks(dim, side):
+    """Split the upper triangle of a dim x dim matrix into square blocks.
+
+    Parameters
+    ----------
+    dim : int
+        The dimension of the square matrix.
+
+    side : int
+        The side of each block.
+
+    Returns
+    -------
+    blocks : generator
+        Yields pairs of row and column ranges as `((r0, r1), (c0, c1))`,
+        for all blocks that intersect the upper triangle (diagonal included).
+
+    """
+    for r0 in range(0, dim, side):
+        for c0 in range(r0, dim, side):
+            yield (r0, min(r0 + side, dim)), (c0, min(c0 + side, dim))
+
+
+def rectangular_blocks(dim_rows, dim_cols, side):
+    """Split a dim_rows x dim_cols matrix into square blocks.
+
+    Parameters
+    ----------
+    dim_rows, dim_cols : int
+        The dimensions of the matrix.
+
+    side : int
+        The side of each block.
+
+    Returns
+    -------
+    blocks : generator
+        Yields pairs of row and column ranges as `((r0, r1), (c0, c1))`.
+
+    """
+    for r0 in range(0, dim_rows, side):
+        for c0 in range(0, dim_cols, side):
+            yield (r0, min(r0 + side, dim_rows)), (c0, min(c0 + side, dim_cols))
+
+
+def shared_array(shape, dtype=np.float64):
+    """Allocate a zero initialized array, that all joblib workers can write on.
+
+    The array is a `np.memmap` placed on the joblib temporary folder
+    (if defined through `JOBLIB_TEMP_FOLDER`), on shared memory if
+    available or else on the default temporary directory.
+    The memory mapped file is removed, when the array is garbage collected.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the array.
+
+    dtype : np.dtype, default=np.float64
+        The data type of the array.
+
+    Returns
+    -------
+    array : np.memmap
+        The shared array.
 
-    if n_jobs >= nsamples:
-        for i in range(nsamples):
-            yield (i, i+1)
-    else:
-        ns = nsamples/n_jobs
-        start = 0
-        for i in range(n_jobs-1):
-            end = start + ns
-            yield (int(start), int(end))
-            start = end
-        yield (int(start), nsamples)
+    """
+    temp_folder = os.environ.get('JOBLIB_TEMP_FOLDER', None)
+    if temp_folder is None and os.path.isdir(SYSTEM_SHARED_MEM_FS) and \
+            os.access(SYSTEM_SHARED_MEM_FS, os.W_OK):
+        temp_folder = SYSTEM_SHARED_MEM_FS
+    folder = tempfile.mkdtemp(prefix='grakel_', dir=temp_folder)
+    array = np.memmap(os.path.join(folder, 'K.mmap'), dtype=dtype, shape=shape, mode='w+')
+    finalize(array, shutil.rmtree, folder, True)
+    return array
+
+
+def normalize_block_wise(K, row_diag, col_diag, side):
+    """Normalize a kernel matrix in place, with stripes of its rows.
+
+    Parameters
+    ----------
+    K : np.array
+        The kernel matrix.
+
+    row_diag, col_diag : np.array
+        The kernel values of the row and column elements with themselves.
+
+    side : int
+        The stripes have approximately side*side elements.
+
+    Returns
+    -------
+    None.
+
+    """
+    n_rows = max(1, (side*side) // max(K.shape[1], 1))
+    for r0 in range(0, K.shape[0], n_rows):
+        r1 = min(r0 + n_rows, K.shape[0])
+        K[r0:r1] /= np.sqrt(np.outer(row_diag[r0:r1], col_diag))
+    if isinstance(K, np.memmap):
+        K.flush()
 
 
-def assign(data, K, pairwise_operation):
-    """Assign list values of an iterable to a numpy array while calculating a pairwise operation."""
-    for d in data:
-        K[d[0][0], d[0][1]] = pairwise_operation(d[1][0], d[1][1])
+def kernel_block(K, offset, rows, cols, pairwise_operation, symmetric=False):
+    """Calculate a dense block of the kernel matrix and write it on K.
+
+    Parameters
+    ----------
+    K : np.array
+        The (shared) kernel matrix.
+
+    offset : tuple
+        The row and column index of K, where the block starts.
+
+    rows, cols : list
+        The graphs corresponding to the rows and the columns of the block.
+
+    pairwise_operation : function
+        The pairwise kernel between two graphs.
+
+    symmetric : bool, default=False
+        If True K is symmetric, so the block is also written transposed.
+        Blocks lying on the diagonal, calculate only their upper triangle.
+
+    Returns
+    -------
+    None.
+
+    """
+    r, c = offset
+    upper = symmetric and r == c
+    kb = np.zeros(shape=(len(rows), len(cols)))
+    for (i, x) in enumerate(rows):
+        for (j, y) in enumerate(cols[i:] if upper else cols, i if upper else 0):
+            kb[i, j] = pairwise_operation(x, y)
+
+    if upper:
+        kb = np.triu(kb) + np.triu(kb, 1).T
+    K[r:r + kb.shape[0], c:c + kb.shape[1]] = kb
+    if symmetric and not upper:
+        K[c:c + kb.shape[1], r:r + kb.shape[0]] = kb.T
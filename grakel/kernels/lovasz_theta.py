@@ -85,7 +85,8 @@ class LovaszTheta(Kernel):
                  n_samples=50,
                  subsets_size_range=(2, 8),
                  max_dim=None,
-                 base_kernel=lambda x, y: x.T.dot(y)):
+                 base_kernel=lambda x, y: x.T.dot(y),
+                 memmap=None):
         """Initialise a lovasz_theta kernel."""
         # setup valid parameters and initialise from parent
         if not cvxopt_installed:
@@ -94,7 +95,8 @@ class LovaszTheta(Kernel):
 
         super(LovaszTheta, self).__init__(n_jobs=n_jobs,
                                           normalize=normalize,
-                                          verbose=verbose)
+                                          verbose=verbose,
+                                          memmap=memmap)
 
         self.n_samples = n_samples
         self.subsets_size_range = subsets_size_range
@@ -16,15 +16,18 @@ from numpy.linalg import eig
 from numpy.linalg import inv
 from numpy.linalg import multi_dot
 from numpy.linalg import eigvals
+from numpy.linalg import cholesky
+from numpy.linalg import LinAlgError
 
 from grakel.graph import Graph
+from grakel.graph import bounded_bfs
+from grakel.graph import get_neighborhood
+from scipy.linalg import cho_solve
 from scipy.sparse.csgraph import laplacian
+from sklearn.externals import joblib
 
 from grakel.kernels import Kernel
 
-# Python 2/3 cross-compatibility import
-from six import iteritems
-
 positive_eigenvalue_limit = float("+1e-6")
 
 
@@ -34,7 +37,8 @@ class MultiscaleLaplacianFast(Kernel):
     Parameters
     ----------
     L : int, default=3
-        The number of neighborhoods.
+        The number of neighborhoods. The neighborhood of a vertex on level
+        :math:`l` consists of all vertices within distance :math:`l`.
 
     gamma : Real, default=0.01
         A smoothing parameter of float value.
@@ -80,12 +84,14 @@ class MultiscaleLaplacianFast(Kernel):
                  P=10,
                  gamma=0.01,
                  heta=0.01,
-                 N=50):
+                 N=50,
+                 memmap=None):
         """Initialise a `multiscale_laplacian` kernel."""
         super(MultiscaleLaplacianFast, self).__init__(
             n_jobs=n_jobs,
             normalize=normalize,
-            verbose=verbose)
+            verbose=verbose,
+            memmap=memmap)
 
         self.random_seed = random_seed
         self.gamma = gamma
@@ -195,28 +201,14 @@ class MultiscaleLaplacianFast(Kernel):
 
                 Lap = laplacian(A).astype(float)
                 _increment_diagonal_(Lap, self.heta)
-                data[ng] = {0: A, 1: phi, 2: inv(Lap)}
-                neighborhoods[ng] = x
+                data[ng] = {0: A, 1: phi, 2: Lap}
+                if self.L > 0:
+                    neighborhoods[ng] = bounded_bfs(A, self.L)
                 ng += 1
 
             if ng == 0:
                 raise ValueError('parsed input is empty')
 
-            # Define a function for calculating the S's of subgraphs of each iteration
-            def calculate_C(k, j, l):
-                if type(neighborhoods[k]) is Graph:
-                    neighborhoods[k] = neighborhoods[k].produce_neighborhoods(
-                        r=self.L, sort_neighbors=False)
-
-                indexes = neighborhoods[k][l][j]
-                L = laplacian(data[k][0][indexes, :][:, indexes]).astype(float)
-                _increment_diagonal_(L, self.heta)
-                U = data[k][1][indexes, :]
-                S = multi_dot((U.T, inv(L), U))
-                _increment_diagonal_(S, self.gamma)
-
-                return (inv(S), np.sum(np.log(np.real(eigvals(S)))))
-
             if self._method_calling == 1:
                 V = [(k, j) for k in range(ng)
                      for j in range(data[k][0].shape[0])]
@@ -249,25 +241,24 @@ class MultiscaleLaplacianFast(Kernel):
                     np.random.shuffle(V)
                     vs = V[:ns]
 
-                    # Compute the reference subsampled Gram matrix
+                    # Compute the operators of the reference vertices and their Gram matrix
+                    C = stack_operators([neighborhood_operator(data[k][0], data[k][1],
+                                                               get_neighborhood(neighborhoods[k], j, l),
+                                                               self.heta, self.gamma)
+                                         for (k, j) in vs])
+                    K = np.array([flg_kernels((C[0][m], C[1][m]), C) for m in range(ns)])
+
                     K_proj = {k: np.zeros(shape=(data[k][0].shape[0], ns)) for k in range(ng)}
-                    K, C = np.zeros(shape=(len(vs), len(vs))), dict()
                     for (m, (k, j)) in enumerate(vs):
-                        C[m] = calculate_C(k, j, l)
-                        K_proj[k][j, m] = K[m, m] = self.pairwise_operation(C[m], C[m])
-                        for (s, (k2, j2)) in enumerate(vs):
-                            if s < m:
-                                K[s, m] = K[m, s] \
-                                        = K_proj[k2][j2, m] \
-                                        = K_proj[k][j, s] \
-                                        = self.pairwise_operation(C[s], C[m])
-                            else:
-                                break
+                        K_proj[k][j, :] = K[m, :]
 
                     # Compute the kernels of the relations of the reference to everything else
+                    vertices = collections.defaultdict(list)
                     for (k, j) in V[ns:]:
-                        for (m, _) in enumerate(vs):
-                            K_proj[k][j, m] = self.pairwise_operation(C[m], calculate_C(k, j, l))
+                        vertices[k].append(j)
+                    for (k, K_k) in self._landmark_projections(data, neighborhoods, l,
+                                                               vertices, C):
+                        K_proj[k][vertices[k], :] = K_k
 
                     # w the eigen vectors, v the eigenvalues
                     v, w = eig(K)
@@ -290,23 +281,60 @@ class MultiscaleLaplacianFast(Kernel):
                     # (n, k) * (k, P)
                     data[j][1] = data[j][1].dot(ksi)
 
+                vertices = {k: list(range(data[k][0].shape[0])) for k in range(ng)}
                 for l in range(1, self.L+1):
                     C, Q = self.data_level[l]
-                    for j in range(ng):
-                        K_proj = np.zeros(shape=(data[j][0].shape[0], len(C)))
-                        for n in range(data[j][0].shape[0]):
-                            for m in range(len(C)):
-                                K_proj[n, m] = self.pairwise_operation(C[m], calculate_C(j, n, l))
-                        data[j][1] = K_proj.dot(Q)
+                    for (k, K_proj) in self._landmark_projections(data, neighborhoods, l,
+                                                                  vertices, C):
+                        data[k][1] = K_proj.dot(Q)
 
             # Apply the final calculation of S.
             for k in range(ng):
-                S = multi_dot((data[k][1].T, data[k][2], data[k][1]))
-                _increment_diagonal_(S, self.gamma)
-                out.append((inv(S), np.sum(np.log(np.real(eigvals(S))))))
+                out.append(flg_operator(data[k][2], data[k][1], self.gamma))
 
             return out
 
+    def _landmark_projections(self, data, neighborhoods, l, vertices, C):
+        """Calculate the FLG kernels between vertex neighborhoods and the landmarks of a level.
+
+        Each vertex operator is computed exactly once and compared with all
+        the landmarks at the same time. Graphs are distributed to the workers
+        if the kernel is parallel.
+
+        Parameters
+        ----------
+        data : dict
+            The adjacency matrix, features and laplacian of each graph.
+
+        neighborhoods : dict
+            The neighborhoods of each graph as produced from
+            :func:`grakel.graph.bounded_bfs`.
+
+        l : int
+            The current level.
+
+        vertices : dict
+            The vertices of each graph that should be projected.
+
+        C : tuple
+            The stacked operators of the landmarks (see :func:`stack_operators`).
+
+        Returns
+        -------
+        projections : list
+            A list of graph indexes and arrays of shape (len(vertices[k]), n_landmarks).
+
+        """
+        keys = [k for k in sorted(vertices) if len(vertices[k])]
+        args = [(data[k][0], data[k][1],
+                 [get_neighborhood(neighborhoods[k], j, l) for j in vertices[k]],
+                 self.heta, self.gamma, C) for k in keys]
+        if self._parallel is None:
+            projections = [landmark_projection(*a) for a in args]
+        else:
+            projections = self._parallel(joblib.delayed(landmark_projection)(*a) for a in args)
+        return list(zip(keys, projections))
+
     def pairwise_operation(self, x, y):
         """FLG calculation for the fast multiscale laplacian.
 
@@ -323,17 +351,7 @@ class MultiscaleLaplacianFast(Kernel):
             The FLG core kernel value.
 
         """
-        S_inv_x, log_det_x = x
-        S_inv_y, log_det_y = y
-
-        # Calculate the result in term of logs
-        log_detS = -np.sum(np.log(np.real(eigvals(S_inv_x + S_inv_y))))
-        logr = (log_detS - 0.5*(log_det_x + log_det_y))/2.0
-
-        if logr < -30:
-            return .0
-        else:
-            return exp(logr)
+        return float(flg_kernels(x, y))
 
 
 class MultiscaleLaplacian(Kernel):
@@ -342,7 +360,8 @@ class MultiscaleLaplacian(Kernel):
     Parameters
     ----------
     L : int, default=3
-        The number of neighborhoods.
+        The number of neighborhoods. The neighborhood of a vertex on level
+        :math:`l` consists of all vertices within distance :math:`l`.
 
     gamma : Real, default=0.01
         A small softening parameter of float value.
@@ -371,11 +390,13 @@ class MultiscaleLaplacian(Kernel):
                  verbose=False,
                  L=3,
                  gamma=0.01,
-                 heta=0.01):
+                 heta=0.01,
+                 memmap=None):
         """Initialise a `multiscale_laplacian` kernel."""
         super(MultiscaleLaplacian, self).__init__(n_jobs=n_jobs,
                                                   normalize=normalize,
-                                                  verbose=verbose)
+                                                  verbose=verbose,
+                                                  memmap=memmap)
 
         self.gamma = gamma
         self.heta = heta
@@ -459,7 +480,7 @@ class MultiscaleLaplacian(Kernel):
                 ng += 1
                 phi_d = x.get_labels()
                 A = x.get_adjacency_matrix()
-                N = x.produce_neighborhoods(r=self.L, sort_neighbors=False)
+                N = bounded_bfs(A, self.L)
                 try:
                     phi = np.array([list(phi_d[i]) for i in range(A.shape[0])])
                 except TypeError:
@@ -474,7 +495,8 @@ class MultiscaleLaplacian(Kernel):
                 Q = dict()
                 for level in range(1, self.L+1):
                     Q[level] = dict()
-                    for (key, item) in iteritems(N[level]):
+                    for key in range(A.shape[0]):
+                        item = get_neighborhood(N, key, level)
                         Q[level][key] = dict()
                         Q[level][key]["n"] = np.array(item)
                         if len(item) < A.shape[0]:
@@ -646,3 +668,178 @@ def _increment_diagonal_(A, value):
     d = A.diagonal()
     d.setflags(write=True)
     d += value
+
+
+def _cholesky(A):
+    """Calculate the lower Cholesky factor of a symmetric positive definite array.
+
+    Parameters
+    ----------
+    A : np.array
+        A square array (or a stack of square arrays).
+
+    Returns
+    -------
+    factor : np.array or None
+        The lower triangular factor or None if A is not positive definite.
+
+    """
+    try:
+        return cholesky(A)
+    except LinAlgError:
+        return None
+
+
+def flg_operator(L, U, gamma):
+    """Calculate the inverse and the log-determinant of :math:`S=U^{T}L^{-1}U + \\gamma I`.
+
+    Both L and S are factorized with Cholesky, falling back to explicit
+    inverses and eigenvalues when they are not symmetric positive definite.
+
+    Parameters
+    ----------
+    L : np.array, shape=(n, n)
+        The laplacian, with its diagonal incremented by heta.
+
+    U : np.array, shape=(n, P)
+        The vertex features.
+
+    gamma : Real
+        A smoothing parameter.
+
+    Returns
+    -------
+    S_inv : np.array, shape=(P, P)
+        The inverse of S.
+
+    log_det : float
+        The log-determinant of S.
+
+    """
+    factor = (_cholesky(L) if np.array_equal(L, L.T) else None)
+    if factor is None:
+        S = multi_dot((U.T, inv(L), U))
+    else:
+        S = U.T.dot(cho_solve((factor, True), U))
+    _increment_diagonal_(S, gamma)
+
+    factor = _cholesky(S)
+    if factor is None:
+        return inv(S), np.sum(np.log(np.real(eigvals(S))))
+    else:
+        return (cho_solve((factor, True), np.eye(S.shape[0])),
+                2*np.sum(np.log(np.diagonal(factor))))
+
+
+def neighborhood_operator(A, U, indexes, heta, gamma):
+    """Calculate the FLG operator of the subgraph induced by a vertex neighborhood.
+
+    Parameters
+    ----------
+    A : np.array, shape=(n, n)
+        The adjacency matrix of the graph.
+
+    U : np.array, shape=(n, P)
+        The vertex features of the current level.
+
+    indexes : list
+        The vertices of the neighborhood.
+
+    heta, gamma : Real
+        The smoothing parameters.
+
+    Returns
+    -------
+    operator : tuple
+        The inverse and the log-determinant of S (see :func:`flg_operator`).
+
+    """
+    L = laplacian(A[indexes, :][:, indexes]).astype(float)
+    _increment_diagonal_(L, heta)
+    return flg_operator(L, U[indexes, :], gamma)
+
+
+def stack_operators(operators):
+    """Stack FLG operators of equal dimension, for evaluating them together.
+
+    Parameters
+    ----------
+    operators : list
+        A list of tuples of S inverses and log-determinants.
+
+    Returns
+    -------
+    S_inv : np.array, shape=(len(operators), P, P)
+        The stacked inverses.
+
+    log_det : np.array, shape=(len(operators),)
+        The log-determinants.
+
+    """
+    return (np.array([op[0] for op in operators]),
+            np.array([op[1] for op in operators], dtype=float))
+
+
+def flg_kernels(x, Y):
+    """FLG kernel values between an operator and a stack of operators.
+
+    Parameters
+    ----------
+    x : tuple
+        The inverse and the log-determinant of an S matrix.
+
+    Y : tuple
+        Inverses and log-determinants of S matrices, either single or
+        stacked (see :func:`stack_operators`).
+
+    Returns
+    -------
+    kernels : np.array
+        The kernel values, of the shape of the log-determinants of Y.
+
+    """
+    S_inv_x, log_det_x = x
+    S_inv_y, log_det_y = Y
+    S_inv = S_inv_y + S_inv_x
+
+    # Calculate the result in term of logs
+    factor = _cholesky(S_inv)
+    if factor is None:
+        log_detS = -np.sum(np.log(np.real(eigvals(S_inv))), axis=-1)
+    else:
+        log_detS = -2*np.sum(np.log(np.diagonal(factor, axis1=-2, axis2=-1)), axis=-1)
+    logr = (log_detS - 0.5*(log_det_x + log_det_y))/2.0
+
+    return np.where(logr < -30, .0, np.exp(np.maximum(logr, -30)))
+
+
+def landmark_projection(A, U, indexes, heta, gamma, C):
+    """Calculate the FLG kernels between vertex neighborhoods of a graph and landmarks.
+
+    Parameters
+    ----------
+    A : np.array, shape=(n, n)
+        The adjacency matrix of the graph.
+
+    U : np.array, shape=(n, P)
+        The vertex features of the current level.
+
+    indexes : list
+        The neighborhood of each projected vertex.
+
+    heta, gamma : Real
+        The smoothing parameters.
+
+    C : tuple
+        The stacked landmark operators (see :func:`stack_operators`).
+
+    Returns
+    -------
+    K_proj : np.array, shape=(len(indexes), n_landmarks)
+        The projection of each vertex on the landmarks.
+
+    """
+    K_proj = np.empty(shape=(len(indexes), C[1].shape[0]))
+    for (i, idx) in enumerate(indexes):
+        K_proj[i, :] = flg_kernels(neighborhood_operator(A, U, idx, heta, gamma), C)
+    return K_proj
@@ -7,12 +7,15 @@ import warnings
 import numpy as np
 
 from scipy.sparse import csr_matrix
+from scipy.sparse import diags
+from scipy.sparse import hstack
 
 from sklearn.exceptions import NotFittedError
 from sklearn.utils.validation import check_is_fitted
 
 from grakel.kernels import Kernel
 from grakel.graph import Graph
+from grakel.graph import bounded_bfs
 
 from grakel.kernels._c_functions import APHash
 
@@ -50,9 +53,9 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
         The number of graphs upon transform.
 
     _fit_keys : dict
-        A dictionary with keys from `0` to `_d+1`, constructed upon fit
-        holding an enumeration of all the found (in the fit dataset)
-        tuples of two hashes and a radius in this certain level.
+        A dictionary with keys all the (radius, distance) levels, constructed
+        upon fit holding a sorted np.array of all the found (in the fit
+        dataset) hashes of pairs of neighborhoods in this certain level.
 
     _X_level_norm_factor : dict
         A dictionary with keys from `0` to `_d+1`, that holds the self
@@ -60,7 +63,7 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
 
     """
 
-    _graph_format = "dictionary"
+    _graph_format = "adjacency"
 
     def __init__(self,
                  n_jobs=None,
@@ -111,11 +114,11 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
         Returns
         -------
         M : dict
-            A dictionary with keys all the distances from 0 to self.d
-            and values the the np.arrays with rows corresponding to the
-            non-null input graphs and columns to the enumerations of tuples
-            consisting of pairs of hash values and radius, from all the given
-            graphs of the input (plus the fitted one's on transform).
+            A dictionary with keys all the (radius, distance) levels
+            and values the the csr_matrices with rows corresponding to the
+            non-null input graphs and columns to the enumerations of hashes
+            of pairs of neighborhoods, from all the given graphs of the input
+            (plus the fitted one's on transform).
 
         """
         if not isinstance(X, collections.Iterable):
@@ -124,11 +127,9 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
             # Hold the number of graphs
             ng = 0
 
-            # Holds all the data for combinations of r, d
-            data = collections.defaultdict(dict)
-
-            # Index all keys for combinations of r, d
-            all_keys = collections.defaultdict(dict)
+            # Holds the hashed pairs and their graph, for combinations of r, d
+            keys = collections.defaultdict(list)
+            rows = collections.defaultdict(list)
             for (idx, x) in enumerate(iter(X)):
                 is_iter = False
                 if isinstance(x, collections.Iterable):
@@ -140,7 +141,6 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
                         continue
                     else:
                         g = Graph(x[0], x[1], x[2])
-                        g.change_format("adjacency")
                 elif type(x) is Graph:
                     g = Graph(x.get_adjacency_matrix(),
                               x.get_labels(purpose="adjacency", label_type="vertex"),
@@ -155,86 +155,60 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
                 # Bring to the desired format
                 g.change_format(self._graph_format)
 
-                # Take the vertices
-                vertices = set(g.get_vertices(purpose=self._graph_format))
-
-                # Extract the dicitionary
-                ed = g.get_edge_dictionary()
-
-                # Convert edges to tuples
-                edges = {(j, k) for j in ed.keys() for k in ed[j].keys()}
+                # Produce all the neighborhoods up to the
+                # desired radius and maximum distance
+                A = g.get_adjacency_matrix()
+                neighborhoods = bounded_bfs(A, max(self.r, self.d))
 
-                # Extract labels for nodes
+                # Encode the labels of vertices and edges as integers
                 Lv = g.get_labels(purpose=self._graph_format)
-                # and for edges
                 Le = g.get_labels(purpose=self._graph_format, label_type="edge")
-
-                # Produce all the neighborhoods and the distance pairs
-                # up to the desired radius and maximum distance
-                N, D, D_pair = g.produce_neighborhoods(self.r, purpose="dictionary",
-                                                       with_distances=True, d=self.d)
+                ea, eb = np.nonzero(A)
+                lv = label_codes(Lv[i] for i in range(A.shape[0]))
+                le = label_codes(Le[e] for e in zip(ea.tolist(), eb.tolist()))
 
                 # Hash all the neighborhoods
-                H = self._hash_neighborhoods(vertices, edges, Lv, Le, N, D_pair)
-
-                if self._method_calling == 1:
-                    for d in filterfalse(lambda x: x not in D,
-                                         range(self.d+1)):
-                        for (A, B) in D[d]:
-                            for r in range(self.r+1):
-                                key = (H[r, A], H[r, B])
-                                keys = all_keys[r, d]
-                                idx = keys.get(key, None)
-                                if idx is None:
-                                    idx = len(keys)
-                                    keys[key] = idx
-                                data[r, d][ng, idx] = data[r, d].get((ng, idx), 0) + 1
-
-                elif self._method_calling == 3:
-                    for d in filterfalse(lambda x: x not in D,
-                                         range(self.d+1)):
-                        for (A, B) in D[d]:
-                            # Based on the edges of the bidirected graph
-                            for r in range(self.r+1):
-                                keys = all_keys[r, d]
-                                fit_keys = self._fit_keys[r, d]
-                                key = (H[r, A], H[r, B])
-                                idx = fit_keys.get(key, None)
-                                if idx is None:
-                                    idx = keys.get(key, None)
-                                    if idx is None:
-                                        idx = len(keys) + len(fit_keys)
-                                        keys[key] = idx
-                                data[r, d][ng, idx] = data[r, d].get((ng, idx), 0) + 1
+                H = hash_neighborhoods(neighborhoods, lv, ea, eb, le, self.r, self.d)
+
+                # Hash all pairs of neighborhoods in each distance
+                indptr, indices, distances = neighborhoods
+                roots = np.repeat(np.arange(A.shape[0]), np.diff(indptr))
+                for d in range(self.d+1):
+                    A_d, B_d = roots[distances == d], indices[distances == d]
+                    if A_d.shape[0] > 0:
+                        for r in range(self.r+1):
+                            keys[r, d].append(hash_ints(H[r][A_d], H[r][B_d]))
+                            rows[r, d].append(np.full(A_d.shape[0], ng, dtype=int))
                 ng += 1
             if ng == 0:
                 raise ValueError('parsed input is empty')
 
+            # A feature matrix for all levels
+            M = dict()
             if self._method_calling == 1:
-                # A feature matrix for all levels
-                M = dict()
-
-                for (key, d) in filterfalse(lambda a: len(a[1]) == 0,
-                                            iteritems(data)):
-                    indexes, data = zip(*iteritems(d))
-                    rows, cols = zip(*indexes)
-                    M[key] = csr_matrix((data, (rows, cols)), shape=(ng, len(all_keys[key])),
-                                        dtype=np.int64)
-                self._fit_keys = all_keys
-                self._ngx = ng
+                self._fit_keys = dict()
+            for key in keys.keys():
+                key_rows, key_hashes = np.concatenate(rows[key]), np.concatenate(keys[key])
+                if self._method_calling == 1:
+                    features, cols = np.unique(key_hashes, return_inverse=True)
+                    self._fit_keys[key] = features
+                    nf = features.shape[0]
+                elif self._method_calling == 3:
+                    # Index features found upon fit and enumerate the rest after them
+                    fit_keys = self._fit_keys.get(key, np.empty((0,), dtype=np.uint64))
+                    nf = fit_keys.shape[0]
+                    cols = np.searchsorted(fit_keys, key_hashes)
+                    found = (cols < nf)
+                    found[found] = (fit_keys[cols[found]] == key_hashes[found])
+                    new_features, new_cols = np.unique(key_hashes[~found], return_inverse=True)
+                    cols[~found] = nf + new_cols
+                    nf += new_features.shape[0]
+                M[key] = csr_matrix((np.ones(cols.shape[0], dtype=np.int64), (key_rows, cols)),
+                                    shape=(ng, nf), dtype=np.int64)
 
+            if self._method_calling == 1:
+                self._ngx = ng
             elif self._method_calling == 3:
-                # A feature matrix for all levels
-                M = dict()
-
-                for (key, d) in filterfalse(lambda a: len(a[1]) == 0,
-                                            iteritems(data)):
-                    indexes, data = zip(*iteritems(d))
-                    rows, cols = zip(*indexes)
-                    M[key] = csr_matrix((data, (rows, cols)),
-                                        shape=(ng, len(all_keys[key]) + len(self._fit_keys[key])),
-                                        dtype=np.int64)
-
                 self._ngy = ng
 
             return M
@@ -284,8 +258,9 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
                                      iteritems(Y)):
             M = self.X[key]
             K = M.dot(Mp.T[:M.shape[1]]).toarray().T
-            S += K / np.sqrt(np.outer(np.array(Mp.power(2).sum(-1)),
-                                      N[key]))
+            norm = np.sqrt(np.outer(np.array(Mp.power(2).sum(-1)), N[key]))
+            norm[norm == 0] = 1
+            S += K / norm
 
         self._Y = Y
         self._is_transformed = True
@@ -293,6 +268,56 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
             S /= np.sqrt(np.outer(*self.diagonal()))
         return S
 
+    def transform_features(self, X):
+        """Calculate the explicit feature vectors of the given graphs.
+
+        The features of each (radius, distance) level are scaled to unit
+        norm and concatenated, so that their inner product with those of the
+        fitted dataset equals the kernel matrix calculated from `transform`.
+
+        Parameters
+        ----------
+        X : iterable
+            Each element must be an iterable with at most three features and at
+            least one. The first that is obligatory is a valid graph structure
+            (adjacency matrix or edge_dictionary) while the second is
+            node_labels and the third edge_labels (that fitting the given graph
+            format).
+
+        Returns
+        -------
+        phi : scipy.sparse.csr_matrix, shape = [n_input_graphs, n_features]
+            The features of the input graphs, aligned to the features of the
+            fitted dataset (unseen features are discarded). If normalize is
+            set, they are divided by the square root of the number of levels.
+
+        """
+        self._method_calling = 3
+        # Check is fit had been called
+        check_is_fitted(self, ['X'])
+
+        # Input validation and parsing
+        if X is None:
+            raise ValueError('transform input cannot be None')
+        else:
+            Y = self.parse_input(X)
+
+        blocks = list()
+        for key in sorted(self.X.keys()):
+            nf = self.X[key].shape[1]
+            if key in Y:
+                Mp = Y[key]
+                norm = np.sqrt(np.array(Mp.power(2).sum(-1), dtype=float)).ravel()
+                norm[norm == 0] = 1
+                blocks.append(diags(1 / norm).dot(Mp[:, :nf]))
+            else:
+                blocks.append(csr_matrix((self._ngy, nf), dtype=float))
+
+        phi = hstack(blocks, format='csr')
+        if self.normalize:
+            phi = phi / np.sqrt(len(self.X))
+        return phi
+
     def fit_transform(self, X):
         """Fit and transform, on the same dataset.
 
@@ -321,7 +346,10 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
             K = M.dot(M.T).toarray()
             K_diag = K.diagonal()
             N[key] = K_diag
-            S += K / np.sqrt(np.outer(K_diag, K_diag))
+            # Graphs without any pair in a level, are orthogonal to all
+            norm = np.sqrt(np.outer(K_diag, K_diag))
+            norm[norm == 0] = 1
+            S += K / norm
 
         self._X_level_norm_factor = N
 
@@ -362,91 +390,193 @@ class NeighborhoodSubgraphPairwiseDistance(Kernel):
         except NotFittedError:
             return self._X_diag
 
-    def _hash_neighborhoods(self, vertices, edges, Lv, Le, N, D_pair):
-        """Hash all neighborhoods and all root nodes.
 
-        Parameters
-        ----------
-        vertices : set
-            The graph vertices.
+def label_codes(labels):
+    """Encode labels as integers, through hashing their string representation.
+
+    Parameters
+    ----------
+    labels : iterable
+        The labels.
 
-        edges : set
-            The set of edges
+    Returns
+    -------
+    codes : np.array, dtype=np.uint64
+        The integer codes of the labels.
 
-        N : dict
-            Neighborhoods that map levels (int) to dictionaries of root node
-            symbols (keys) to list of vertex symbols, which correspond to the
-            neighbors, that belong to this neighborhood.
+    """
+    codes = dict()
+    return np.array([codes[label] if label in codes
+                     else codes.setdefault(label, APHash(str(label)))
+                     for label in labels], dtype=np.uint64)
 
-        D_pairs : dict
-            A dictionary that maps edges (tuple pairs of vertex symbols) to
-            element distances (int - as produced from a BFS traversal).
 
-        Returns
-        -------
-        H : dict
-            The hashed neighborhoods as a 2-level dict from radious,
-            vertex to the hashed values.
+def mix(x):
+    """Mix the bits of unsigned 64-bit integers (the splitmix64 finalizer).
 
-        """
-        H, sel = dict(), sorted(list(edges))
-        for v in vertices:
-            re, lv, le = sel, Lv, Le
-            for radius in range(self.r, -1, -1):
-                sub_vertices = sorted(N[radius][v])
-                re = {(i, j) for (i, j) in re
-                      if i in sub_vertices and j in sub_vertices}
-                lv = {v: lv[v] for v in sub_vertices}
-                le = {e: le[e] for e in edges}
-                H[radius, v] = hash_graph(D_pair, sub_vertices, re, lv, le)
-        return H
+    Parameters
+    ----------
+    x : np.array, dtype=np.uint64
+        The input integers.
+
+    Returns
+    -------
+    h : np.array, dtype=np.uint64
+        A bijective scramble of the input.
 
+    """
+    h = x ^ (x >> np.uint64(30))
+    h *= np.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94d049bb133111eb)
+    h ^= h >> np.uint64(31)
+    return h
+
+
+def hash_ints(*columns):
+    """Hash tuples of integers, given column-wise.
+
+    Parameters
+    ----------
+    columns : np.array
+        Arrays of integers of broadcastable shapes. The i-th tuple consists
+        of the i-th elements of all columns, in the given order.
+
+    Returns
+    -------
+    h : np.array, dtype=np.uint64
+        The hash value of each tuple.
+
+    """
+    shape = np.broadcast(*columns).shape
+    h = np.full(shape, 0x9e3779b97f4a7c15, dtype=np.uint64)
+    for c in columns:
+        h = mix(h ^ np.asarray(c).astype(np.uint64))
+    return h
 
-def hash_graph(D, vertices, edges, glv, gle):
-    """Make labels for hashing according to the proposed method.
 
-    Produces the graph hash needed for fast comparison.
+def group_sums(values, groups, n):
+    """Add integers modulo :math:`2^{64}` in groups.
 
     Parameters
     ----------
-    D_pairs : dict
-        A dictionary that maps edges (tuple pairs of vertex symbols) to
-        element distances (int - as produced from a BFS traversal).
+    values : np.array, dtype=np.uint64
+        The values.
 
-    vertices : set
-        A set of vertices.
+    groups : np.array
+        The (sorted) group index of each value.
 
-    edges : set
-        A set of edges.
+    n : int
+        The number of groups.
 
-    glv : dict
-        Labels for vertices of the graph.
+    Returns
+    -------
+    sums : np.array, shape=(n,), dtype=np.uint64
+        The sum of each group.
+
+    """
+    sums = np.zeros(n, dtype=np.uint64)
+    if values.shape[0] > 0:
+        starts = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+        sums[groups[starts]] = np.add.reduceat(values, starts)
+    return sums
+
+
+def expand_ranges(starts, counts):
+    """Enumerate the positions of many ranges.
 
-    gle : dict
-        Labels for edges of the graph.
+    Parameters
+    ----------
+    starts, counts : np.array
+        The first position and the length of each range.
 
     Returns
     -------
-    hash : int.
-        The hash value for the given graph.
+    owners : np.array
+        The range of each position.
+
+    positions : np.array
+        All the positions of all ranges.
 
     """
-    encoding = ""
+    owners = np.repeat(np.arange(counts.shape[0]), counts)
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return owners, np.arange(owners.shape[0]) + offsets
 
-    # Make labels for vertices
-    Lv = dict()
-    for i in vertices:
-        label = "|".join(sorted([str(D[(i, j)]) + ',' + str(glv[j])
-                                 for j in vertices if (i, j) in D]))
-        encoding += label + "."
-        Lv[i] = label
 
-    encoding = encoding[:-1]+":"
+def hash_neighborhoods(neighborhoods, lv, ea, eb, le, r, d):
+    """Hash the neighborhoods of all vertices for all radiuses.
 
-    # Expand to labels for edges
-    for (i, j) in edges:
-        encoding += Lv[i] + ',' + Lv[j] + ',' + str(gle[(i, j)]) + "_"
+    A neighborhood is hashed through the multisets of its vertex and its
+    edge labels, added as integers modulo :math:`2^{64}`. The label of a
+    vertex is the multiset of its distances, up to `d`, and labels of all
+    vertices in the neighborhood, while the label of an edge is the tuple
+    of the labels of its ends and the edge label.
+
+    Parameters
+    ----------
+    neighborhoods : tuple
+        The neighborhoods of all vertices up to distance `max(r, d)`, as
+        produced from :func:`grakel.graph.bounded_bfs`.
 
-    # Arash Partov hashing, as in the original
-    # implementation of NSPK.
-    return APHash(encoding)
+    lv : np.array, shape=(n,), dtype=np.uint64
+        The vertex label codes.
+
+    ea, eb : np.array, shape=(m,)
+        The indexes of the ends of all edges, sorted by `ea`.
+
+    le : np.array, shape=(m,), dtype=np.uint64
+        The edge label codes.
+
+    r : int
+        The maximum radius.
+
+    d : int
+        The maximum distance.
+
+    Returns
+    -------
+    H : list
+        For each radius, an np.array of shape (n,) with the hash of the
+        neighborhood of each vertex.
+
+    """
+    indptr, indices, distances = neighborhoods
+    n = lv.shape[0]
+    if n == 0:
+        return [np.empty((0,), dtype=np.uint64) for _ in range(r + 1)]
+    roots = np.repeat(np.arange(n), np.diff(indptr))
+
+    # Distance, label pairs that label each vertex and the number of them
+    pairs = hash_ints(distances, lv[indices])
+    n_pairs = np.bincount(roots[distances <= d], minlength=n)
+
+    # The edges starting from each vertex
+    e_start, degree = np.searchsorted(ea, np.arange(n)), np.bincount(ea, minlength=n)
+
+    # The neighborhoods ordered by root and vertex index, so that they form sorted keys
+    by_index = np.lexsort((indices, roots))
+
+    H = list()
+    for radius in range(r + 1):
+        inside = by_index[distances[by_index] <= radius]
+        rv, ri = roots[inside], indices[inside]
+        keys = rv*n + ri
+
+        def find(query):
+            pos = np.minimum(np.searchsorted(keys, query), keys.shape[0] - 1)
+            return pos, (keys[pos] == query)
+
+        # The label of each vertex, from the pairs of vertices in the same neighborhood
+        owners, pos = expand_ranges(indptr[ri], n_pairs[ri])
+        _, found = find(rv[owners]*n + indices[pos])
+        L = hash_ints(group_sums(pairs[pos[found]], owners[found], rv.shape[0]))
+        hv = group_sums(L, rv, n)
+
+        # The edges with both ends in the same neighborhood
+        pa, edges = expand_ranges(e_start[ri], degree[ri])
+        pb, found = find(rv[pa]*n + eb[edges])
+        pa, pb, edges = pa[found], pb[found], edges[found]
+        he = group_sums(hash_ints(L[pa], L[pb], le[edges]), rv[pa], n)
+        H.append(hash_ints(hv, he))
+    return H
@@ -76,11 +76,13 @@ class Propagation(Kernel):
                                             else sum(x[k]*y[k] for k in x))),
                  M="TV",
                  t_max=5,
-                 w=0.01):
+                 w=0.01,
+                 memmap=None):
         """Initialise a propagation kernel."""
         super(Propagation, self).__init__(n_jobs=n_jobs,
                                           verbose=verbose,
-                                          normalize=normalize)
+                                          normalize=normalize,
+                                          memmap=memmap)
 
         self.random_seed = random_seed
         self.M = M
@@ -446,7 +448,8 @@ class PropagationAttr(Propagation):
                               else sum(x[k]*y[k] for k in x))),
                  M="L1",
                  t_max=5,
-                 w=4):
+                 w=4,
+                 memmap=None):
         """Initialise a propagation kernel."""
         super(PropagationAttr, self).__init__(n_jobs=n_jobs,
                                               verbose=verbose,
@@ -455,7 +458,8 @@ class PropagationAttr(Propagation):
                                               base_kernel=base_kernel,
                                               M=M,
                                               t_max=t_max,
-                                              w=w)
+                                              w=w,
+                                              memmap=memmap)
         # self.initialized_[]=
 
     def initialize_(self):
@@ -10,6 +10,10 @@ from itertools import chain
 
 from scipy.sparse import csr_matrix
 from scipy.sparse.linalg import eigs
+from scipy.sparse.linalg import eigsh
+from sklearn.externals import joblib
+from sklearn.exceptions import NotFittedError
+from sklearn.utils.validation import check_is_fitted
 
 from grakel.graph import Graph
 from grakel.kernels import Kernel
@@ -18,6 +22,16 @@ from grakel.kernels import Kernel
 from six import itervalues
 from six import iteritems
 
+# The number of kernel matrix elements calculated together, by a stripe of rows
+stripe_elements = 2**22
+
+# Graphs with at most that many vertices are embedded, through a dense eigendecomposition
+dense_embedding_vertices = 256
+
+# The minimum density of the histogram threshold indicators,
+# for their intersections to be calculated as dense matrices
+dense_intersection_density = 0.05
+
 
 class PyramidMatch(Kernel):
     """Pyramid match kernel class.
@@ -53,6 +67,16 @@ class PyramidMatch(Kernel):
     _labels : dict
         A dictionary of label enumeration, made from fitted data.
 
+    _embedding_cache : dict
+        The vertex embeddings of the fitted graphs,
+        indexed by their adjacency matrix.
+
+    _nx : int
+        The number of fitted graphs.
+
+    _ny : int
+        The number of transformed graphs.
+
     """
 
     _graph_format = "adjacency"
@@ -62,11 +86,13 @@ class PyramidMatch(Kernel):
                  verbose=False,
                  with_labels=True,
                  L=4,
-                 d=6):
+                 d=6,
+                 memmap=None):
         """Initialise a `pyramid_match` kernel."""
         super(PyramidMatch, self).__init__(n_jobs=n_jobs,
                                            normalize=normalize,
-                                           verbose=verbose)
+                                           verbose=verbose,
+                                           memmap=memmap)
 
         self.with_labels = with_labels
         self.L = L
@@ -92,8 +118,50 @@ class PyramidMatch(Kernel):
             if type(self.d) is not int or self.d < 1:
                 raise TypeError('d: hypercube dimension must be an '
                                 'integer bigger than 1')
+            self._embedding_cache = dict()
             self.initialized_["d"] = True
 
+    def _embeddings(self, As):
+        """Embed the vertices of each graph into the d-dimensional space.
+
+        The embeddings of the fitted graphs are cached, so that refitting
+        with different parameters (other than d) does not recompute them.
+
+        Parameters
+        ----------
+        As : list
+            The sparse adjacency matrices of the graphs.
+
+        Returns
+        -------
+        Us : list
+            The absolute values of the top d eigenvectors of each graph.
+
+        """
+        keys = [(A.shape[0], A.indptr.tobytes(), A.indices.tobytes(), A.data.tobytes())
+                for A in As]
+        missing = dict()
+        for (A, key) in zip(As, keys):
+            if key not in self._embedding_cache and key not in missing:
+                missing[key] = A
+
+        if len(missing):
+            missing_keys = list(missing.keys())
+            embeddings = spectral_embeddings([missing[key] for key in missing_keys],
+                                             self.d, self._parallel)
+            cache = dict(zip(missing_keys, embeddings))
+        else:
+            cache = dict()
+
+        if self._method_calling in [1, 2]:
+            # Keep only the embeddings of the fitted graphs
+            cache.update((key, self._embedding_cache[key]) for key in keys
+                         if key in self._embedding_cache)
+            self._embedding_cache = cache
+            return [cache[key] for key in keys]
+        else:
+            return [(cache[key] if key in cache else self._embedding_cache[key]) for key in keys]
+
     def parse_input(self, X):
         """Parse and create features for pyramid_match kernel.
 
@@ -110,14 +178,14 @@ class PyramidMatch(Kernel):
         Returns
         -------
         H : list
-            A list of lists of Histograms for all levels for each graph.
+            A list of the histograms of all graphs, for each level.
 
         """
         if not isinstance(X, collections.Iterable):
             raise TypeError('input must be an iterable\n')
         else:
             i = 0
-            Us = []
+            As = []
             if self.with_labels:
                 Ls = []
             for (idx, x) in enumerate(iter(X)):
@@ -136,36 +204,22 @@ class PyramidMatch(Kernel):
                 elif not type(x) is Graph:
                     raise TypeError('each element of X must be either a graph object or a list with '
                                     'at least a graph like object and node labels dict \n')
-                A = x.get_adjacency_matrix()
+                As.append(csr_matrix(x.get_adjacency_matrix(), dtype=float))
                 if self.with_labels:
-                    L = x.get_labels(purpose="adjacency")
+                    Ls.append(x.get_labels(purpose="adjacency"))
                 i += 1
-                if A.shape[0] == 0:
-                    Us.append(np.zeros((1, self.d)))
-                else:
-                    # Perform eigenvalue decomposition.
-                    # Rows of matrix U correspond to vertex representations
-                    # Embed vertices into the d-dimensional space
-                    if A.shape[0] > self.d+1:
-                        # If size of graph smaller than d, pad with zeros
-                        Lambda, U = eigs(csr_matrix(A, dtype=np.float),
-                                         k=self.d, ncv=10*self.d)
-                        idx = Lambda.argsort()[::-1]
-                        U = U[:, idx]
-                    else:
-                        Lambda, U = np.linalg.eig(A)
-                        idx = Lambda.argsort()[::-1]
-                        U = U[:, idx]
-                        U = U[:, :self.d]
-                    # Replace all components by their absolute values
-                    U = np.absolute(U)
-                    Us.append((A.shape[0], U))
-                if self.with_labels:
-                    Ls.append(L)
+
+            # Rows of matrix U correspond to vertex representations
+            Us = [(A.shape[0], U) for (A, U) in zip(As, self._embeddings(As))]
 
         if i == 0:
             raise ValueError('parsed input is empty')
 
+        if self._method_calling in [1, 2]:
+            self._nx = i
+        elif self._method_calling == 3:
+            self._ny = i
+
         if self.with_labels:
             # Map labels to values between 0 and |L|-1
             # where |L| is the number of distinct labels
@@ -209,91 +263,298 @@ class PyramidMatch(Kernel):
         Returns
         -------
         Hs : list
-            List of histograms for each graph.
+            A list holding for each level j, a sparse matrix of shape
+            (n_graphs, n_labels*d*2^j). Each row has for each label and
+            dimension, the number of vertices of the graph lying on each
+            of the 2^j cells of the dimension.
 
         """
-        Hs = list()
         if len(args) == 0:
-            for (i, (n, u)) in enumerate(Us):
-                du = list()
-                if n > 0:
-                    for j in range(self.L):
-                        # Number of cells along each dimension at level j
-                        k = 2**j
-                        # Determines the cells in which each vertex lies
-                        # along each dimension since nodes lie in the unit
-                        # hypercube in R^d
-                        D = np.zeros((self.d, k))
-                        T = np.floor(u*k)
-                        T[np.where(T == k)] = k-1
-                        for p in range(u.shape[0]):
-                            if p >= n:
-                                break
-                            for q in range(u.shape[1]):
-                                # Identify the cell into which the i-th
-                                # vertex lies and increase its value by 1
-                                D[q, int(T[p, q])] += 1
-                        du.append(D)
-                Hs.append(du)
-
-        elif len(args) > 0:
-            Ls = args[0]
+            num_labels = 1
+            Ls = [np.zeros(shape=(n,), dtype=int) for (n, _) in Us]
+        else:
             Labels = args[1]
             num_labels = len(Labels)
-            for (i, ((n, u), L)) in enumerate(zip(Us, Ls)):
-                du = list()
-                if n > 0:
-                    for j in range(self.L):
-                        # Number of cells along each dimension at level j
-                        k = 2**j
-                        # To store the number of vertices that are assigned
-                        # a specific label and lie in each of the 2^j cells
-                        # of each dimension at level j
-                        D = np.zeros((self.d*num_labels, k))
-                        T = np.floor(u*k)
-                        T[np.where(T == k)] = k-1
-                        for p in range(u.shape[0]):
-                            if p >= n:
-                                break
-                            for q in range(u.shape[1]):
-                                # Identify the cell into which the i-th
-                                # vertex lies and increase its value by 1
-                                D[Labels[L[p]]*self.d + q, int(T[p, q])] += 1
-                        du.append(D)
-                Hs.append(du)
+            Ls = [np.array([Labels[L[p]] for p in range(n)], dtype=int)
+                  for ((n, _), L) in zip(Us, args[0])]
+
+        # Flatten the embedding coordinates of all the vertices, holding
+        # the graph and the (label, dimension) pair they correspond to
+        values, graphs, rows = [np.zeros(shape=(0,))], [np.zeros(shape=(0,), dtype=int)], \
+            [np.zeros(shape=(0,), dtype=int)]
+        for (i, ((n, u), L)) in enumerate(zip(Us, Ls)):
+            values.append(u.ravel())
+            graphs.append(np.full(u.size, i, dtype=int))
+            rows.append((L[:, None]*self.d + np.arange(u.shape[1])[None, :]).ravel())
+        values, graphs, rows = np.concatenate(values), np.concatenate(graphs), np.concatenate(rows)
+
+        Hs = list()
+        for j in range(self.L):
+            # Number of cells along each dimension at level j
+            k = 2**j
+            # Determines the cells in which each vertex lies along each
+            # dimension since nodes lie in the unit hypercube in R^d
+            T = np.minimum(np.floor(values*k), k-1).astype(int)
+            Hs.append(csr_matrix((np.ones(values.shape[0]), (graphs, rows*k + T)),
+                                 shape=(len(Us), num_labels*self.d*k)))
         return Hs
 
-    def pairwise_operation(self, x, y):
-        """Calculate a pairwise kernel between two elements.
+    def _calculate_kernel_matrix(self, Y=None):
+        """Calculate the kernel matrix given a target_graph and a kernel.
+
+        The histogram intersections are calculated in stripes of rows,
+        for all the graphs at once.
+
+        Parameters
+        ----------
+        Y : list, default=None
+            The histograms of the target graphs, as produced by `parse_input`.
+            If None kernel is calculated between X and itself.
+
+        Returns
+        -------
+        K : numpy array or np.memmap, shape = [n_targets, n_inputs]
+            The kernel matrix: a calculation between all pairs of graphs
+            between targets and inputs. If Y is None targets and inputs
+            are the taken from self.X. Otherwise Y corresponds to targets
+            and self.X to inputs.
+
+        """
+        if Y is None:
+            Y, ny = self.X, self._nx
+        else:
+            ny = self._ny
+
+        shape = (ny, self._nx)
+        if self._memmap is None:
+            K = np.zeros(shape=shape)
+        else:
+            K = self._allocate_kernel_matrix(shape=shape)
+
+        weights = level_weights(self.L)
+        stripe = max(1, stripe_elements // max(self._nx, 1))
+        for r0 in range(0, ny, stripe):
+            r1 = min(r0 + stripe, ny)
+            for (w, hy, hx) in zip(weights, Y, self.X):
+                # Unseen labels of the targets lie after the fitted ones
+                K[r0:r1] += w*histogram_intersection(hy[r0:r1, :hx.shape[1]], hx)
+
+        if isinstance(K, np.memmap):
+            K.flush()
+        return K
+
+    def diagonal(self):
+        """Calculate the kernel matrix diagonal of the fit/transformed data.
 
         Parameters
         ----------
-        x, y : dict
-            Histograms as produced by `parse_input`.
+        None.
 
         Returns
         -------
-        kernel : number
-            The kernel value.
+        X_diag : np.array
+            The diagonal of the kernel matrix between the fitted data.
+            This consists of each element calculated with itself.
+
+        Y_diag : np.array
+            The diagonal of the kernel matrix, of the transform.
+            This consists of each element calculated with itself.
 
         """
-        k = 0
-        if len(x) != 0 and len(y) != 0:
-            intersec = np.zeros(self.L)
-            for (p, xp, yp) in zip(range(self.L), x, y):
-                # Calculate histogram intersection
-                # (eq. 6 in :cite:`nikolentzos2017matching`)
-                if xp.shape[0] < yp.shape[0]:
-                    xpp, ypp = xp, yp[:xp.shape[0], :]
-                elif yp.shape[0] < xp.shape[0]:
-                    xpp, ypp = xp[:yp.shape[0], :], yp
-                else:
-                    xpp, ypp = xp, yp
-                intersec[p] = np.sum(np.minimum(xpp, ypp))
-                k += intersec[self.L-1]
-                for p in range(self.L-1):
-                    # Computes the new matches that occur at level p.
-                    # These matches weight less than those that occur at
-                    # higher levels (e.g. p+1 level)
-                    k += (1.0/(2**(self.L-p-1)))*(intersec[p]-intersec[p+1])
-        return k
+        # Check is fit had been called
+        check_is_fitted(self, ['X'])
+        weights = level_weights(self.L)
+        try:
+            check_is_fitted(self, ['_X_diag'])
+        except NotFittedError:
+            # The intersection of a histogram with itself, is its sum
+            self._X_diag = np.zeros(shape=(self._nx,))
+            for (w, hx) in zip(weights, self.X):
+                self._X_diag += w*np.asarray(hx.sum(axis=1)).ravel()
+
+        try:
+            # If transform has happened return both diagonals
+            check_is_fitted(self, ['_Y'])
+            Y_diag = np.zeros(shape=(self._ny,))
+            for (w, hy) in zip(weights, self._Y):
+                Y_diag += w*np.asarray(hy.sum(axis=1)).ravel()
+            return self._X_diag, Y_diag
+        except NotFittedError:
+            # Else just return both X_diag
+            return self._X_diag
+
+
+def spectral_embeddings(As, d, parallel=None):
+    """Embed the vertices of graphs, with the top d eigenvectors of their adjacency matrix.
+
+    Graphs with at most `dense_embedding_vertices` vertices are decomposed
+    densely, in stacked calls for graphs of the same size. Larger graphs are
+    decomposed with ARPACK. The symmetric solvers are used for undirected
+    graphs.
+
+    Parameters
+    ----------
+    As : list
+        The sparse adjacency matrices of the graphs.
+
+    d : int
+        The dimension of the embeddings.
+
+    parallel : sklearn.external.joblib.Parallel or None, default=None
+        If given the large graphs are decomposed in parallel.
+
+    Returns
+    -------
+    Us : list
+        The absolute values of the eigenvectors of the d largest eigenvalues
+        of each graph, on its columns, sorted by decreasing eigenvalue.
+        For graphs with more than d+1 vertices, the eigenvalues largest in
+        magnitude are selected.
+
+    """
+    Us = [None]*len(As)
+    small, large = collections.defaultdict(list), list()
+    for (i, A) in enumerate(As):
+        if A.shape[0] == 0:
+            Us[i] = np.zeros((0, d))
+        elif A.shape[0] > dense_embedding_vertices:
+            large.append(i)
+        else:
+            small[(A.shape[0], (A != A.T).nnz == 0)].append(i)
+
+    for ((n, symmetric), idx) in iteritems(small):
+        S = np.stack([As[i].toarray() for i in idx])
+        Lambda, U = (np.linalg.eigh(S) if symmetric else np.linalg.eig(S))
+        for (j, i) in enumerate(idx):
+            if n > d+1:
+                # Select the eigenvalues largest in magnitude, as ARPACK
+                top = np.argsort(-np.absolute(Lambda[j]), kind='mergesort')[:d]
+                top = top[Lambda[j][top].argsort()[::-1]]
+            else:
+                top = Lambda[j].argsort()[::-1][:d]
+            Us[i] = np.absolute(U[j][:, top])
+
+    if parallel is None:
+        embeddings = (eigen_embedding(As[i], d) for i in large)
+    else:
+        embeddings = parallel(joblib.delayed(eigen_embedding)(As[i], d) for i in large)
+    for (i, U) in zip(large, embeddings):
+        Us[i] = U
+    return Us
+
+
+def eigen_embedding(A, d):
+    """Embed the vertices of a graph, with the top d eigenvectors of its sparse adjacency matrix.
+
+    Parameters
+    ----------
+    A : scipy.sparse.csr_matrix
+        The adjacency matrix, with more than d+1 vertices.
+
+    d : int
+        The dimension of the embedding.
+
+    Returns
+    -------
+    U : np.array, shape=(n_vertices, d)
+        The absolute values of the eigenvectors of the d largest magnitude
+        eigenvalues, sorted by decreasing eigenvalue.
+
+    """
+    n = A.shape[0]
+    # A fixed starting vector makes the embedding deterministic
+    v0 = np.random.RandomState(42).uniform(-1, 1, size=n)
+    if (A != A.T).nnz == 0:
+        Lambda, U = eigsh(A, k=d, ncv=min(n, 10*d), v0=v0)
+    else:
+        Lambda, U = eigs(A, k=d, ncv=min(n, 10*d), v0=v0)
+    return np.absolute(U[:, Lambda.argsort()[::-1]])
+
+
+def level_weights(L):
+    """Calculate the weights of the histogram intersections on each level.
+
+    The kernel is a weighted sum of the histogram intersections on each
+    level, where the matches occuring on lower levels weight less than
+    those on higher levels. These are not the weights of eq. 6 in
+    :cite:`nikolentzos2017matching`: the weight of each level p is
+    multiplied by L-p, as the kernel accumulated the levels up to each
+    level in earlier versions. This legacy weighting is kept on purpose,
+    so that the kernel values do not change.
+
+    Parameters
+    ----------
+    L : int
+        The number of levels.
+
+    Returns
+    -------
+    weights : np.array, shape=(L,)
+        The weight of the intersection on each level.
+
+    """
+    weights = np.zeros(shape=(L,))
+    for p in range(L):
+        # The legacy kernel accumulated the levels up to each level p
+        if p == L-1:
+            weights[p] += 1
+        else:
+            weights[p] += 1.0/(2**(L-p-1))
+        if p > 0:
+            weights[p] -= 1.0/(2**(L-p))
+        weights[p] *= L-p
+    return weights
+
+
+def histogram_intersection(Hy, Hx):
+    r"""Calculate the histogram intersection between all pairs of histograms.
+
+    As histograms hold counts, :math:`\min(a, b) = \sum_{t \geq 1} [a \geq t][b \geq t]`.
+    Expanding each count :math:`c` to the indicators of the thresholds
+    :math:`t \leq c`, the intersection becomes a single sparse product.
+
+    Parameters
+    ----------
+    Hy, Hx : scipy.sparse.csr_matrix
+        The histograms of the targets and the inputs on their rows.
+
+    Returns
+    -------
+    K : np.array, shape=(n_targets, n_inputs)
+        The sum of the element-wise minimum of each pair of histograms.
+
+    """
+    n_thresholds = int(max(Hy.max() if Hy.nnz else 0, Hx.max() if Hx.nnz else 0))
+    Iy, Ix = threshold_indicators(Hy, n_thresholds), threshold_indicators(Hx, n_thresholds)
+    if Ix.nnz >= dense_intersection_density*Ix.shape[0]*Ix.shape[1]:
+        # Dense indicators are multiplied faster
+        return Iy.dot(Ix.T.toarray())
+    else:
+        return Iy.dot(Ix.T).toarray()
+
+
+def threshold_indicators(H, n_thresholds):
+    r"""Expand a matrix of counts, to the indicators of the thresholds each count reaches.
+
+    Parameters
+    ----------
+    H : scipy.sparse.csr_matrix
+        A matrix of counts.
+
+    n_thresholds : int
+        The maximum count.
+
+    Returns
+    -------
+    I : scipy.sparse.csr_matrix, shape=(H.shape[0], H.shape[1]*n_thresholds)
+        For each element :math:`(i, j)` of H with count c, I has ones on
+        the columns :math:`j*n\_thresholds + t` for :math:`0 \leq t < c`.
+
+    """
+    H = H.tocoo()
+    counts = H.data.astype(int)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    thresholds = np.arange(starts.shape[0]) - starts
+    return csr_matrix((np.ones(starts.shape[0]),
+                       (np.repeat(H.row, counts), np.repeat(H.col*n_thresholds, counts) + thresholds)),
+                      shape=(H.shape[0], H.shape[1]*n_thresholds))
@@ -6,13 +6,13 @@ import warnings
 
 import numpy as np
 
-from itertools import product
-
 from numpy import ComplexWarning
 from numpy.linalg import inv
 from numpy.linalg import eig
-from numpy.linalg import multi_dot
 from scipy.linalg import expm
+from scipy.sparse import csr_matrix
+from scipy.sparse import issparse
+from scipy.sparse import kron
 from scipy.sparse.linalg import cg
 from scipy.sparse.linalg import LinearOperator
 
@@ -21,6 +21,16 @@ from grakel.graph import Graph
 
 # Python 2/3 cross-compatibility import
 from builtins import range
+from six import iteritems
+
+# The maximum number of eigenvalue products held in memory,
+# by a stripe of the kernel matrix.
+spectral_budget = 2**22
+
+# Factor graphs of an implicit product graph, with at least that many
+# vertices and at most that density, are kept as sparse matrices.
+sparse_factor_vertices = 64
+sparse_factor_density = 0.1
 
 
 class RandomWalk(Kernel):
@@ -74,11 +84,13 @@ class RandomWalk(Kernel):
     def __init__(self, n_jobs=None,
                  normalize=False, verbose=False,
                  lamda=0.1, method_type="fast",
-                 kernel_type="geometric", p=None):
+                 kernel_type="geometric", p=None,
+                 memmap=None):
         """Initialise a random_walk kernel."""
         # setup valid parameters and initialise from parent
         super(RandomWalk, self).__init__(
-            n_jobs=n_jobs, normalize=normalize, verbose=verbose)
+            n_jobs=n_jobs, normalize=normalize, verbose=verbose,
+            memmap=memmap)
 
         # Ignores ComplexWarning as it does not signify anything problematic
         warnings.filterwarnings('ignore', category=ComplexWarning)
@@ -97,13 +109,17 @@ class RandomWalk(Kernel):
 
         if not self.initialized_["method_type"]:
             # Setup method type and define operation.
-            if (self.method_type == "baseline" or
-                    (self.method_type == "fast"
-                     and self.p is None
-                     and self.kernel_type == "geometric")):
+            if self.method_type == "baseline":
                 def add_input(x):
                     return x
                 self._add_input = add_input
+                self._spectral = False
+
+            elif (self.method_type == "fast" and self.p is None
+                  and self.kernel_type == "geometric"):
+                # Keep large factor graphs sparse for the implicit product graph
+                self._add_input = product_factor
+                self._spectral = False
 
             elif self.method_type == "fast":
                 def invert(w, v):
@@ -114,6 +130,7 @@ class RandomWalk(Kernel):
                     return invert(*eig(x))
 
                 self._add_input = add_input
+                self._spectral = True
             else:
                 raise ValueError('unsupported method_type')
             self.initialized_["method_type"] = True
@@ -202,6 +219,55 @@ class RandomWalk(Kernel):
 
             return out
 
+    def _calculate_kernel_matrix(self, Y=None):
+        """Calculate the kernel matrix given a target_graph and a kernel.
+
+        For the "fast" spectral method the kernel matrix is calculated in
+        stripes of rows, from the stacked eigen factors of all the graphs.
+
+        Parameters
+        ----------
+        Y : list, default=None
+            A list of graph type objects. If None kernel is calculated between
+            X and itself.
+
+        Returns
+        -------
+        K : numpy array or np.memmap, shape = [n_targets, n_inputs]
+            The kernel matrix: a calculation between all pairs of graphs
+            between targets and inputs. If Y is None targets and inputs
+            are the taken from self.X. Otherwise Y corresponds to targets
+            and self.X to inputs.
+
+        """
+        if not self._spectral:
+            return super(RandomWalk, self)._calculate_kernel_matrix(Y)
+
+        cols = stack_spectral_factors(self.X)
+        rows = (cols if Y is None else stack_spectral_factors(Y))
+        shape = (rows[0].shape[0], cols[0].shape[0])
+        if self._memmap is None:
+            K = np.zeros(shape=shape)
+        else:
+            K = self._allocate_kernel_matrix(shape=shape)
+
+        # Bound the eigenvalue products held in memory, by each stripe
+        offsets = rows[0].indptr
+        budget = max(1, spectral_budget // max(cols[1].shape[0], 1))
+        r0 = 0
+        while r0 < shape[0]:
+            r1 = max(r0 + 1, np.searchsorted(offsets, offsets[r0] + budget, side='right') - 1)
+            r1 = min(r1, shape[0])
+            o0, o1 = offsets[r0], offsets[r1]
+            K[r0:r1] = spectral_kernel((rows[0][r0:r1, o0:o1], rows[1][o0:o1]), cols,
+                                       mu=(self._mu if self.p is not None else None),
+                                       lamda=self.lamda)
+            r0 = r1
+
+        if isinstance(K, np.memmap):
+            K.flush()
+        return K
+
     def pairwise_operation(self, X, Y):
         """Calculate the random walk kernel.
 
@@ -256,44 +322,15 @@ class RandomWalk(Kernel):
             # witout labels
 
             # calculate kernel
-            qi_Pi, wi = X
-            qj_Pj, wj = Y
-
-            # calculate flanking factor
-            ff = np.expand_dims(np.kron(qi_Pi, qj_Pj), axis=0)
-
-            # calculate D based on the method
-            Dij = np.kron(wi, wj)
-            if self.p is not None:
-                D = np.ones(shape=(Dij.shape[0],))
-                S = self._mu[0] * D
-                for k in self._mu[1:]:
-                    D *= Dij
-                    S += k*D
-
-                S = np.diagflat(S)
-            else:
-                # Exponential
-                S = np.diagflat(np.exp(self.lamda*Dij))
-            return ff.dot(S).dot(ff.T)
+            return spectral_kernel(stack_spectral_factors([X]),
+                                   stack_spectral_factors([Y]),
+                                   mu=(self._mu if self.p is not None else None),
+                                   lamda=self.lamda)[0, 0]
         else:
             # Random Walk
             # Conjugate Gradient Method as presented in
             # [Vishwanathan et al., 2006] p.12, s.4.2
-            Ax, Ay = X, Y
-            xs, ys = Ax.shape[0], Ay.shape[0]
-            mn = xs*ys
-
-            def lsf(x, lamda):
-                xm = x.reshape((xs, ys), order='F')
-                y = np.reshape(multi_dot((Ax, xm, Ay)), (mn,), order='F')
-                return x - self.lamda * y
-
-            # A*x=b
-            A = LinearOperator((mn, mn), matvec=lambda x: lsf(x, self.lamda))
-            b = np.ones(mn)
-            x_sol, _ = cg(A, b, tol=1.0e-6, maxiter=20)
-            return np.sum(x_sol)
+            return geometric_product_kernel([(X, Y)], X.shape[0], Y.shape[0], self.lamda)
 
 
 class RandomWalkLabeled(RandomWalk):
@@ -349,13 +386,20 @@ class RandomWalkLabeled(RandomWalk):
     def __init__(self, n_jobs=None,
                  normalize=False, verbose=False,
                  lamda=0.1, method_type="fast",
-                 kernel_type="geometric", p=None):
+                 kernel_type="geometric", p=None,
+                 memmap=None):
         """Initialise a labeled random_walk kernel."""
         # Initialise from parent
         super(RandomWalkLabeled, self).__init__(
             n_jobs=n_jobs, normalize=normalize, verbose=verbose,
             lamda=lamda, method_type=method_type, kernel_type=kernel_type,
-            p=p)
+            p=p, memmap=memmap)
+
+    def initialize_(self):
+        """Initialize all transformer arguments, needing initialization."""
+        super(RandomWalkLabeled, self).initialize_()
+        # The spectral decomposition does not apply on labeled graphs
+        self._spectral = False
 
     def parse_input(self, X):
         """Parse and create features for graphlet_sampling kernel.
@@ -405,13 +449,15 @@ class RandomWalkLabeled(RandomWalk):
 
             out = list()
             for Ax, Lx, s in proc:
+                # Split the edges by the labels of their endpoints, on sparse matrices
                 amss = dict()
-                labels = set(Lx)
-                Lx = np.array(Lx)
-                for t in product(labels, labels):
-                    selector = np.matmul(np.expand_dims(Lx == t[0], axis=1),
-                                         np.expand_dims(Lx == t[1], axis=0))
-                    amss[t] = Ax * selector
+                rows, cols = np.nonzero(Ax)
+                pairs = collections.defaultdict(list)
+                for (e, (u, v)) in enumerate(zip(rows, cols)):
+                    pairs[(Lx[u], Lx[v])].append(e)
+                for (t, edges) in iteritems(pairs):
+                    amss[t] = product_factor(csr_matrix(
+                        (Ax[rows[edges], cols[edges]], (rows[edges], cols[edges])), shape=(s, s)))
                 out.append((amss, s))
 
             if i == 0:
@@ -452,7 +498,7 @@ class RandomWalkLabeled(RandomWalk):
             # Claculate Kronecker product matrix
             XY = np.zeros(shape=(mn, mn))
             for k in ck:
-                XY += np.kron(X[k], Y[k])
+                XY += kron(X[k], Y[k]).toarray()
 
             # XY is a square matrix
             s = XY.shape[0]
@@ -475,21 +521,146 @@ class RandomWalkLabeled(RandomWalk):
         elif self.method_type == "fast" and self.kernel_type == "geometric":
             # Conjugate Gradient Method as presented in
             # [Vishwanathan et al., 2006] p.12, s.4.2
-            AxAy = [(X[k], Y[k]) for k in ck]
-
-            if len(ck):
-                def lsf(x, lamda):
-                    y = 0
-                    xm = x.reshape((xs, ys), order='F')
-                    for Ax, Ay in AxAy:
-                        y += np.reshape(multi_dot((Ax, xm, Ay)), (mn,), order='F')
-                    return x - self.lamda * y
-            else:
-                def lsf(x, lamda):
-                    return x - np.zeros(mn)
-
-            # A*x=b
-            A = LinearOperator((mn, mn), matvec=lambda x: lsf(x, self.lamda))
-            b = np.ones(mn)
-            x_sol, _ = cg(A, b, tol=1.0e-6, maxiter=20)
-            return np.sum(x_sol)
+            return geometric_product_kernel([(X[k], Y[k]) for k in ck], xs, ys, self.lamda)
+
+
+def stack_spectral_factors(factors):
+    """Stack the eigen factors of a list of graphs.
+
+    Parameters
+    ----------
+    factors : list
+        The flanking factors and the eigenvalues of each graph,
+        as produced from `parse_input`.
+
+    Returns
+    -------
+    S : scipy.sparse.csr_matrix, shape=(n_graphs, n_eigenvalues)
+        Holds on each row the squared flanking factors of a graph,
+        on the columns of its eigenvalues.
+
+    w : np.array, shape=(n_eigenvalues,)
+        The eigenvalues of all graphs.
+
+    """
+    sizes = [w.shape[0] for (_, w) in factors]
+    n = sum(sizes)
+    if n:
+        q = np.concatenate([q for (q, _) in factors])
+        w = np.concatenate([w for (_, w) in factors])
+    else:
+        q, w = np.zeros(shape=(0,)), np.zeros(shape=(0,))
+    indptr = np.concatenate(([0], np.cumsum(sizes))).astype(int)
+    S = csr_matrix((np.square(q), np.arange(n), indptr), shape=(len(factors), n))
+    return S, w
+
+
+def spectral_kernel(rows, cols, mu=None, lamda=0.1):
+    """Calculate the spectral random walk kernel between stacked graphs.
+
+    The kernel between two graphs is a weighted sum of a function of all
+    the products of their eigenvalues, with weights the products of their
+    squared flanking factors :cite:`vishwanathan2006fast`.
+    No Kronecker product is constructed.
+
+    Parameters
+    ----------
+    rows, cols : tuple
+        The stacked eigen factors, as produced from `stack_spectral_factors`.
+
+    mu : list or None, default=None
+        The coefficients of the eigenvalue product powers, for a kernel
+        of p steps. If None the exponential kernel is calculated.
+
+    lamda : float, default=0.1
+        A lambda factor concerning summation, of the exponential kernel.
+
+    Returns
+    -------
+    K : np.array, shape=(n_rows, n_cols)
+        The kernel matrix.
+
+    """
+    (Sr, wr), (Sc, wc) = rows, cols
+    if mu is not None:
+        # The sum of powers has rank len(mu) as a matrix of eigenvalue pairs
+        powers = np.arange(len(mu))
+        phi_r = Sr.dot(np.power(wr[:, None], powers))
+        phi_c = Sc.dot(np.power(wc[:, None], powers))
+        return np.einsum('ik,k,jk->ij', phi_r, np.asarray(mu, dtype=float), phi_c)
+    else:
+        E = np.exp(lamda*np.outer(wr, wc))
+        return np.asarray(Sr.dot(Sc.dot(E.T).T))
+
+
+def product_factor(A):
+    """Store the adjacency matrix of a factor graph, of an implicit product graph.
+
+    Parameters
+    ----------
+    A : np.array or scipy.sparse matrix
+        The adjacency matrix.
+
+    Returns
+    -------
+    A : np.array or scipy.sparse.csr_matrix
+        A sparse matrix if the graph is large and sparse enough,
+        for the matrix products to be cheaper than the dense ones.
+
+    """
+    nnz = (A.nnz if issparse(A) else np.count_nonzero(A))
+    if A.shape[0] >= sparse_factor_vertices and nnz <= sparse_factor_density*A.shape[0]**2:
+        return csr_matrix(A)
+    elif issparse(A):
+        return A.toarray()
+    else:
+        return A
+
+
+def geometric_product_kernel(factors, xs, ys, lamda, tol=1.0e-8, maxiter=20):
+    r"""Calculate the geometric random walk kernel on an implicit product graph.
+
+    Solves :math:`(I - \lambda W_{\times})x = \mathbf{1}` with the Conjugate
+    Gradient method as presented in :cite:`vishwanathan2006fast` p.12, s.4.2,
+    where :math:`W_{\times} = \sum_{k} A^{k}_{x} \otimes A^{k}_{y}` is
+    multiplied with a vector as :math:`\sum_{k} A^{k}_{x} X {A^{k}_{y}}^{T}`,
+    without ever constructing it.
+
+    Parameters
+    ----------
+    factors : list
+        Pairs of adjacency matrices (dense or sparse) of the two graphs,
+        whose Kronecker products sum to the product graph.
+
+    xs, ys : int
+        The number of vertices of each graph.
+
+    lamda : float
+        A lambda factor concerning summation.
+
+    tol : float, default=1.0e-8
+        The tolerance of the Conjugate Gradient method.
+
+    maxiter : int, default=20
+        The maximum iterations of the Conjugate Gradient method.
+
+    Returns
+    -------
+    kernel : number
+        The kernel value.
+
+    """
+    mn = xs*ys
+
+    def matvec(x):
+        xm = x.reshape((xs, ys), order='F')
+        y = np.zeros(shape=(xs, ys))
+        for (Ax, Ay) in factors:
+            y += Ay.dot(Ax.dot(xm).T).T
+        return x - lamda * np.reshape(y, (mn,), order='F')
+
+    # A*x=b, warm started from the first two terms of the geometric series
+    A = LinearOperator((mn, mn), matvec=matvec)
+    b = np.ones(mn)
+    x_sol, _ = cg(A, b, x0=2*b - matvec(b), tol=tol, maxiter=maxiter)
+    return np.sum(x_sol)
@@ -6,18 +6,47 @@ import warnings
 
 import numpy as np
 
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+
 from sklearn.exceptions import NotFittedError
 from sklearn.utils.validation import check_is_fitted
 
 from grakel.graph import Graph
+from grakel.graph import floyd_warshall
 from grakel.kernels import Kernel
+from grakel.kernels.vertex_histogram import squared_norms
+
+# The number of kernel matrix elements calculated together, by a stripe of rows
+stripe_elements = 2**22
+
+
+def inner_product(x, y):
+    """Calculate the inner product between two attributes.
+
+    The default attribute kernel of :class:`ShortestPathAttr`.
+
+    Parameters
+    ----------
+    x, y : array-like
+        The attributes.
+
+    Returns
+    -------
+    kernel : number
+        The inner product.
+
+    """
+    return np.dot(x, y)
 
 
 class ShortestPathAttr(Kernel):
     r"""The shortest path kernel for attributes.
 
     The Graph labels are considered as attributes.
-    The computational efficiency is decreased to :math:`O(|V|^4)`
+    The vertex pairs of each graph are grouped by the length of their shortest path,
+    so each pair of graphs costs :math:`O(d|V|^3)` for d distinct lengths, instead of
+    the :math:`O(|V|^4)` of comparing all pairs of paths.
     See :cite:`borgwardt2005shortest`.
 
     Parameters
@@ -30,7 +59,8 @@ class ShortestPathAttr(Kernel):
     attribute_kernel : function, default=:math:`f(x,y)=\sum_{i}x_{i}*y_{i}`,
         The kernel applied between attributes of the graph labels.
         The user must provide a kernel based on the format of the provided
-        labels (considered as attributes).
+        labels (considered as attributes). The default (:func:`inner_product`)
+        is calculated on explicit features of the graphs.
 
     Attributes
     ----------
@@ -38,16 +68,22 @@ class ShortestPathAttr(Kernel):
         A list of tuples, consisting of shortest path matrices
         and their feature vectors.
 
+    _phi_X : scipy.sparse.csr_matrix
+        The explicit features of the fitted graphs, for the default
+        attribute kernel.
+
     """
 
     def __init__(self, n_jobs=None,
                  normalize=False,
                  verbose=False,
                  algorithm_type="auto",
-                 attribute_kernel=lambda x, y: np.dot(x, y)):
+                 attribute_kernel=inner_product,
+                 memmap=None):
         """Initialise a `shortest_path_attr` kernel."""
         super(ShortestPathAttr, self).__init__(
-            n_jobs=n_jobs, normalize=normalize, verbose=verbose)
+            n_jobs=n_jobs, normalize=normalize, verbose=verbose,
+            memmap=memmap)
 
         self.algorithm_type = algorithm_type
         self.attribute_kernel = attribute_kernel
@@ -125,8 +161,58 @@ class ShortestPathAttr(Kernel):
             if ni == 0:
                 raise ValueError('parsed input is empty')
 
+            if self._method_calling in [1, 2] and self.attribute_kernel is inner_product:
+                # Keep the explicit features of the fitted graphs
+                self._lengths, self._n_features, self._phi_X = path_feature_matrix(sp_attr_tup)
             return sp_attr_tup
 
+    def _calculate_kernel_matrix(self, Y=None):
+        """Calculate the kernel matrix given a target_graph and a kernel.
+
+        For the default attribute kernel, the kernel matrix is the inner product
+        of explicit graph features (see :func:`path_feature_matrix`), calculated
+        in stripes of rows against the features kept on fit.
+
+        Parameters
+        ----------
+        Y : list, default=None
+            The shortest path matrices and attributes of the target graphs, as
+            produced by `parse_input`. If None kernel is calculated between X and itself.
+
+        Returns
+        -------
+        K : numpy array or np.memmap, shape = [n_targets, n_inputs]
+            The kernel matrix: a calculation between all pairs of graphs
+            between targets and inputs. If Y is None targets and inputs
+            are the taken from self.X. Otherwise Y corresponds to targets
+            and self.X to inputs.
+
+        """
+        if self.attribute_kernel is not inner_product:
+            return super(ShortestPathAttr, self)._calculate_kernel_matrix(Y)
+
+        if Y is None:
+            phi_y = self._phi_X
+        else:
+            # Paths with lengths that no fitted graph has, do not contribute
+            _, _, phi_y = path_feature_matrix(Y, self._lengths, self._n_features)
+
+        shape = (phi_y.shape[0], self._phi_X.shape[0])
+        if self._memmap is None:
+            K = np.zeros(shape=shape)
+        else:
+            K = self._allocate_kernel_matrix(shape=shape)
+
+        phi_x_T = self._phi_X.T.tocsc()
+        stripe = max(1, stripe_elements // max(shape[1], 1))
+        for r0 in range(0, shape[0], stripe):
+            r1 = min(r0 + stripe, shape[0])
+            K[r0:r1] = phi_y[r0:r1].dot(phi_x_T).toarray()
+
+        if isinstance(K, np.memmap):
+            K.flush()
+        return K
+
     def pairwise_operation(self, x, y):
         """Calculate shortests paths on attributes.
 
@@ -145,23 +231,14 @@ class ShortestPathAttr(Kernel):
         # Initialise
         Sx, phi_x = x
         Sy, phi_y = y
-        kernel = 0
         dimx = Sx.shape[0]
         dimy = Sy.shape[0]
-        for i in range(dimx):
-            for j in range(dimx):
-                if i == j:
-                    continue
-                for k in range(dimy):
-                    for m in range(dimy):
-                        if k == m:
-                            continue
-                        if (Sx[i, j] == Sy[k, m] and
-                                Sx[i, j] != float('Inf')):
-                            kernel += self.attribute_kernel(phi_x[i], phi_y[k]) *\
-                                self.attribute_kernel(phi_x[j], phi_y[m])
-
-        return kernel
+        if self.attribute_kernel is inner_product:
+            G = np.dot(attribute_matrix(phi_x, dimx), attribute_matrix(phi_y, dimy).T)
+        else:
+            G = np.array([[self.attribute_kernel(phi_x[i], phi_y[k]) for k in range(dimy)]
+                          for i in range(dimx)], dtype=float).reshape(dimx, dimy)
+        return attribute_path_kernel(Sx, Sy, G)
 
 
 class ShortestPath(Kernel):
@@ -174,28 +251,23 @@ class ShortestPath(Kernel):
     algorithm_type : str, default={"dijkstra", "floyd_warshall", "auto"}
         Apply the dijkstra or floyd_warshall algorithm for calculating
         shortest path, or chose automatically ("auto") based on the
-        current graph format ("auto").
+        current graph format ("auto"). The shortest paths of all graphs
+        are calculated together, so all choices produce the same distances.
 
     with_labels : bool, default=True, case_of_existence=(as_attributes==True)
         Calculate shortest path using graph labels.
 
     Attributes
     ----------
-    X : dict
-        A dictionary of pairs between each input graph and a bins where the
-        sampled graphlets have fallen.
+    X : scipy.sparse.csr_matrix, shape=(_nx, len(_enum))
+        The counts of each (label, label, shortest path length) triplet
+        (or shortest path length) for every input graph.
 
     _with_labels : bool
         Defines if the shortest path kernel considers also labels.
 
     _enum : dict
-        A dictionary of graph bins holding pynauty objects
-
-    _lt : str
-        A label type needed for build shortest path function.
-
-    _lhash : str
-        A function for hashing labels, shortest paths.
+        A dictionary between triplets (or lengths) and their feature index.
 
     _nx : int
         Holds the number of sampled X graphs.
@@ -203,14 +275,10 @@ class ShortestPath(Kernel):
     _ny : int
         Holds the number of sampled Y graphs.
 
-    _X_diag : np.array, shape=(_nx, 1)
+    _X_diag : np.array, shape=(_nx,)
         Holds the diagonal of X kernel matrix in a numpy array, if calculated
         (`fit_transform`).
 
-    _phi_X : np.array, shape=(_nx, len(_graph_bins))
-        Holds the features of X in a numpy array, if calculated.
-        (`fit_transform`).
-
     Complexity
     ----------
     :math:`O(n*N*|\cup_{i}L_{i}|^{2})`, where :math:`n` the number of graph,
@@ -219,8 +287,6 @@ class ShortestPath(Kernel):
 
     """
 
-    _graph_bins = dict()
-
     def __init__(self, n_jobs=None,
                  normalize=False,
                  verbose=False,
@@ -242,24 +308,14 @@ class ShortestPath(Kernel):
             self.initialized_["n_jobs"] = True
 
         if not self.initialized_["algorithm_type"]:
-            if self.algorithm_type == "auto":
-                self._graph_format = "auto"
-            elif self.algorithm_type == "floyd_warshall":
-                self._graph_format = "adjacency"
-            elif self.algorithm_type == "dijkstra":
-                self._graph_format = "dictionary"
-            else:
+            if self.algorithm_type not in ["auto", "floyd_warshall", "dijkstra"]:
                 raise ValueError('Unsupported "algorithm_type"')
+            self.initialized_["algorithm_type"] = True
 
         if not self.initialized_["with_labels"]:
-            if self.with_labels:
-                self._lt = "vertex"
-                self._lhash = lambda S, u, v, *args: (args[0][u], args[0][v], S[u, v])
-                self._decompose_input = lambda args: (args[0], args[1:])
-            else:
-                self._lt = "none"
-                self._lhash = lambda S, u, v, *args: S[u, v]
-                self._decompose_input = lambda a: (a, [])
+            if self.with_labels not in [True, False]:
+                raise TypeError('with_labels must be a boolean')
+            self.initialized_["with_labels"] = True
 
     def transform(self, X):
         """Calculate the kernel matrix, between given and fitted dataset.
@@ -291,25 +347,9 @@ class ShortestPath(Kernel):
         else:
             Y = self.parse_input(X)
 
-        # Transform - calculate kernel matrix
-        try:
-            check_is_fitted(self, ['phi_X'])
-            phi_x = self._phi_X
-        except NotFittedError:
-            phi_x = np.zeros(shape=(self._nx, len(self._enum)))
-            for i in self.X.keys():
-                for j in self.X[i].keys():
-                    phi_x[i, j] = self.X[i][j]
-            self.phi_X = phi_x
-
-        phi_y = np.zeros(shape=(self._ny, len(self._enum) + len(self._Y_enum)))
-        for i in Y.keys():
-            for j in Y[i].keys():
-                phi_y[i, j] = Y[i][j]
-
         # store _phi_Y for independent (of normalization arg diagonal-calls)
-        self._phi_Y = phi_y
-        km = np.dot(phi_y[:, :len(self._enum)], phi_x.T)
+        self._phi_Y = Y
+        km = Y[:, :len(self._enum)].dot(self.X.T).toarray()
         self._is_transformed = True
         if self.normalize:
             X_diag, Y_diag = self.diagonal()
@@ -317,6 +357,19 @@ class ShortestPath(Kernel):
         else:
             return km
 
+    def _transform_features(self, X):
+        """Calculate the shortest path histograms of the given graphs, on the fitted paths."""
+        self._method_calling = 3
+        # Check is fit had been called
+        check_is_fitted(self, ['X', '_nx', '_enum'])
+
+        # Input validation and parsing
+        if X is None:
+            raise ValueError('transform input cannot be None')
+        else:
+            Y = self.parse_input(X)
+        return Y[:, :len(self._enum)], squared_norms(Y)
+
     def diagonal(self):
         """Calculate the kernel matrix diagonal for fitted data.
 
@@ -338,19 +391,18 @@ class ShortestPath(Kernel):
             This consists of kernel calculation for each element with itself.
 
         """
-        # Check is fit and transform had been called
-        check_is_fitted(self, ['phi_X'])
+        # Check is fit had been called
+        check_is_fitted(self, ['X'])
         try:
-            check_is_fitted(self, ['X_diag'])
+            check_is_fitted(self, ['_X_diag'])
         except NotFittedError:
             # Calculate diagonal of X
-            self._X_diag = np.sum(np.square(self.phi_X), axis=1)
-            self._X_diag = np.reshape(self._X_diag, (self._X_diag.shape[0], 1))
+            self._X_diag = squared_norms(self.X)
 
         try:
             check_is_fitted(self, ['_phi_Y'])
             # Calculate diagonal of Y
-            Y_diag = np.sum(np.square(self._phi_Y), axis=1)
+            Y_diag = squared_norms(self._phi_Y)
             return self._X_diag, Y_diag
         except NotFittedError:
             return self._X_diag
@@ -380,16 +432,8 @@ class ShortestPath(Kernel):
         self._method_calling = 2
         self.fit(X)
 
-        # calculate feature matrices.
-        phi_x = np.zeros(shape=(self._nx, len(self._enum)))
-
-        for i in self.X.keys():
-            for j in self.X[i].keys():
-                phi_x[i, j] = self.X[i][j]
-
         # Transform - calculate kernel matrix
-        self._phi_X = phi_x
-        km = np.dot(phi_x, phi_x.T)
+        km = self.X.dot(self.X.T).toarray()
 
         self._X_diag = np.diagonal(km)
         if self.normalize:
@@ -400,6 +444,9 @@ class ShortestPath(Kernel):
     def parse_input(self, X):
         """Parse and create features for "shortest path" kernel.
 
+        The shortest paths of all graphs are calculated together and the
+        (label, label, length) triplets are counted with integer encodings.
+
         Parameters
         ----------
         X : iterable
@@ -412,21 +459,16 @@ class ShortestPath(Kernel):
 
         Returns
         -------
-        sp_counts : dict
-            A dictionary that for each vertex holds the counts of shortest path
-            tuples.
+        sp_counts : scipy.sparse.csr_matrix, shape=(n_graphs, n_features)
+            The counts of the shortest path triplets (or lengths) of each
+            graph. On transform, unseen features are indexed after the fitted.
 
         """
         if not isinstance(X, collections.Iterable):
             raise TypeError('input must be an iterable\n')
             # Not a dictionary
         else:
-            i = -1
-            sp_counts = dict()
-            if self._method_calling == 1:
-                self._enum = dict()
-            elif self._method_calling == 3:
-                self._Y_enum = dict()
+            adjacency_matrices, vertex_labels = list(), list()
             for (idx, x) in enumerate(iter(X)):
                 is_iter = isinstance(x, collections.Iterable)
                 if is_iter:
@@ -439,49 +481,318 @@ class ShortestPath(Kernel):
                                       + str(idx))
                         continue
                     elif len(x) == 1:
-                        spm_data = Graph(x[0], {}, {}, self._graph_format
-                                         ).build_shortest_path_matrix(self.algorithm_type,
-                                                                      labels=self._lt)
+                        x = Graph(x[0], {}, {}, "adjacency")
                     else:
-                        spm_data = Graph(x[0], x[1], {}, self._graph_format
-                                         ).build_shortest_path_matrix(self.algorithm_type,
-                                                                      labels=self._lt)
+                        x = Graph(x[0], x[1], {}, "adjacency")
                 elif type(x) is Graph:
-                    spm_data = x.build_shortest_path_matrix(self.algorithm_type, labels=self._lt)
+                    x.desired_format("adjacency")
                 else:
                     raise TypeError('each element of X must have at least' +
                                     ' one and at most 3 elements\n')
-                i += 1
-
-                S, L = self._decompose_input(spm_data)
-                sp_counts[i] = dict()
-                for u in range(S.shape[0]):
-                    for v in range(S.shape[1]):
-                        if u == v or S[u, v] == float("Inf"):
-                            continue
-                        label = self._lhash(S, u, v, *L)
-                        if label not in self._enum:
-                            if self._method_calling == 1:
-                                idx = len(self._enum)
-                                self._enum[label] = idx
-                            elif self._method_calling == 3:
-                                if label not in self._Y_enum:
-                                    idx = len(self._enum) + len(self._Y_enum)
-                                    self._Y_enum[label] = idx
-                                else:
-                                    idx = self._Y_enum[label]
-                        else:
-                            idx = self._enum[label]
-                        if idx in sp_counts[i]:
-                            sp_counts[i][idx] += 1
-                        else:
-                            sp_counts[i][idx] = 1
-
-            if i == -1:
+                adjacency_matrices.append(x.get_adjacency_matrix())
+                if self.with_labels:
+                    vertex_labels.append(x.get_labels(purpose="adjacency"))
+
+            ng = len(adjacency_matrices)
+            if ng == 0:
                 raise ValueError('parsed input is empty')
 
-            if self._method_calling == 1:
-                self._nx = i+1
+            graph_idx, u, v, dist = batch_shortest_paths(adjacency_matrices)
+
+            # Encode each feature as an integer
+            lengths, length_codes = np.unique(dist, return_inverse=True)
+            if self.with_labels:
+                label_enum, codes = dict(), list()
+                for (L, A) in zip(vertex_labels, adjacency_matrices):
+                    codes.extend(label_enum.setdefault(L[k], len(label_enum))
+                                 for k in range(A.shape[0]))
+                codes, labels = np.array(codes, dtype=np.int64), sorted(label_enum, key=label_enum.get)
+
+                offsets = np.cumsum([0] + [A.shape[0] for A in adjacency_matrices])
+                features = (codes[offsets[graph_idx] + u], codes[offsets[graph_idx] + v], length_codes)
+                dims = (len(labels), len(labels), lengths.shape[0])
+                try:
+                    feature_codes = np.ravel_multi_index(features, dims)
+                except ValueError:
+                    # too many features for a single integer
+                    feature_codes = np.unique(np.stack(features, axis=1), axis=0,
+                                              return_inverse=True)[1]
+            else:
+                features, feature_codes = (length_codes, ), length_codes
+
+            # Index the distinct features
+            _, first, inverse = np.unique(feature_codes, return_index=True, return_inverse=True)
+            if self.with_labels:
+                keys = [(labels[features[0][i]], labels[features[1][i]], dist[i]) for i in first]
+            else:
+                keys = [dist[i] for i in first]
+
+            if self._method_calling in [1, 2]:
+                # Drop what was cached for a previous fit
+                for attr in ['_X_diag', '_Y', '_phi_Y']:
+                    if hasattr(self, attr):
+                        delattr(self, attr)
+                self._enum = {key: i for (i, key) in enumerate(keys)}
+                columns, nf = np.arange(len(keys)), len(keys)
             elif self._method_calling == 3:
-                self._ny = i+1
+                self._Y_enum, columns = dict(), np.empty(len(keys), dtype=np.int64)
+                for (i, key) in enumerate(keys):
+                    idx = self._enum.get(key, None)
+                    if idx is None:
+                        idx = self._Y_enum.setdefault(key, len(self._enum) + len(self._Y_enum))
+                    columns[i] = idx
+                nf = len(self._enum) + len(self._Y_enum)
+
+            sp_counts = csr_matrix((np.ones(inverse.shape[0]), (graph_idx, columns[inverse])),
+                                   shape=(ng, nf))
+
+            if self._method_calling in [1, 2]:
+                self._nx = ng
+            elif self._method_calling == 3:
+                self._ny = ng
             return sp_counts
+
+
+def batch_shortest_paths(adjacency_matrices, max_block=256):
+    """Calculate the shortest paths of many graphs, on block diagonal matrices.
+
+    Parameters
+    ----------
+    adjacency_matrices : list
+        The adjacency matrices (np.array, square) of the graphs.
+
+    max_block : int, default=256
+        The maximum number of vertices, of the graphs that are packed in a
+        single block diagonal matrix (bigger graphs are calculated alone).
+
+    Returns
+    -------
+    graph_idx, u, v : np.array
+        The graph and its vertices (with u != v), for all finite shortest paths.
+
+    dist : np.array
+        The length of each shortest path.
+
+    """
+    graph_idx, us, vs, dists = list(), list(), list(), list()
+
+    def calculate_block(start, end):
+        sizes = [adjacency_matrices[i].shape[0] for i in range(start, end)]
+        offsets = np.cumsum([0] + sizes)
+
+        # Stack the edges of all graphs on a block diagonal matrix
+        rows, cols, data = list(), list(), list()
+        for (i, j) in enumerate(range(start, end)):
+            r, c = np.nonzero(adjacency_matrices[j])
+            rows.append(r + offsets[i])
+            cols.append(c + offsets[i])
+            data.append(adjacency_matrices[j][r, c])
+        rows, cols, data = np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+
+        # Self loops do not participate in shortest paths
+        edges = rows != cols
+        A = csr_matrix((data[edges].astype(float), (rows[edges], cols[edges])),
+                       shape=(offsets[-1], offsets[-1]))
+        if A.nnz == 0:
+            return
+        elif np.all(A.data == 1):
+            D = shortest_path(A, method="D", unweighted=True)
+        elif np.all(A.data > 0):
+            D = shortest_path(A, method="D")
+        else:
+            # Keep the floyd warshall semantics for negative weights
+            D = np.full(A.shape, float("Inf"))
+            for (i, j) in enumerate(range(start, end)):
+                D[offsets[i]:offsets[i + 1], offsets[i]:offsets[i + 1]] = \
+                    floyd_warshall(adjacency_matrices[j])
+
+        mask = np.isfinite(D)
+        np.fill_diagonal(mask, False)
+        row, col = np.nonzero(mask)
+        owner = np.searchsorted(offsets, row, side='right') - 1
+        graph_idx.append(owner + start)
+        us.append(row - offsets[owner])
+        vs.append(col - offsets[owner])
+        dists.append(D[row, col])
+
+    start, nv = 0, 0
+    for (i, A) in enumerate(adjacency_matrices):
+        if nv + A.shape[0] > max_block and i > start:
+            calculate_block(start, i)
+            start, nv = i, 0
+        nv += A.shape[0]
+    calculate_block(start, len(adjacency_matrices))
+
+    if len(graph_idx) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, np.empty(0, dtype=float)
+    return (np.concatenate(graph_idx), np.concatenate(us),
+            np.concatenate(vs), np.concatenate(dists))
+
+
+def attribute_matrix(L, n):
+    """Stack the attributes of the vertices of a graph.
+
+    Parameters
+    ----------
+    L : dict
+        The attributes of each vertex index.
+
+    n : int
+        The number of vertices.
+
+    Returns
+    -------
+    phi : np.array, shape=(n, n_attributes)
+        The attribute matrix.
+
+    """
+    try:
+        phi = np.array([L[i] for i in range(n)], dtype=float)
+    except (TypeError, ValueError):
+        raise TypeError('All attributes of a single graph should be numeric '
+                        'and have the same dimension.')
+    return phi.reshape(n, -1)
+
+
+def path_lengths(S):
+    """Group the vertex pairs of a graph, by the length of their shortest path.
+
+    Parameters
+    ----------
+    S : np.array, shape=(n, n)
+        The shortest path matrix.
+
+    Returns
+    -------
+    lengths : np.array
+        The distinct finite lengths of the paths between different vertices.
+
+    codes : np.array, shape=(n, n)
+        The index of the length of each vertex pair, or -1 if the
+        vertices coincide or are not connected.
+
+    """
+    off_diagonal = np.isfinite(S)
+    np.fill_diagonal(off_diagonal, False)
+    lengths = np.unique(S[off_diagonal])
+    codes = np.full(S.shape, -1, dtype=np.int64)
+    codes[off_diagonal] = np.searchsorted(lengths, S[off_diagonal])
+    return lengths, codes
+
+
+def attribute_path_kernel(Sx, Sy, G):
+    """Calculate the shortest path attribute kernel between two graphs.
+
+    All pairs of paths with equal length are compared through the attribute kernel
+    of their endpoints, i.e.
+    :math:`\\sum_{d} \\sum_{i, j, k, m} [S_{x}(i, j) = S_{y}(k, m) = d] G(i, k) G(j, m)`,
+    which is the sum of :math:`G \\odot (P^{x}_{d} G P^{y\\top}_{d})` for each shared length,
+    where :math:`P_{d}` the indicator matrix of the vertex pairs with distance d.
+
+    Parameters
+    ----------
+    Sx, Sy : np.array
+        The shortest path matrices of the two graphs.
+
+    G : np.array, shape=(Sx.shape[0], Sy.shape[0])
+        The attribute kernel between the vertices of the two graphs.
+
+    Returns
+    -------
+    kernel : number
+        The kernel value.
+
+    """
+    lx, cx = path_lengths(Sx)
+    ly, cy = path_lengths(Sy)
+    shared = np.intersect1d(lx, ly)
+    kernel = .0
+    for (i, j) in zip(np.searchsorted(lx, shared), np.searchsorted(ly, shared)):
+        Px, Py = (cx == i).astype(float), (cy == j).astype(float)
+        kernel += np.sum(G * Px.dot(G).dot(Py.T))
+    return kernel
+
+
+def path_feature_matrix(graphs, lengths=None, n_features=None):
+    """Align the explicit features of graphs, on the indexes of their path lengths.
+
+    Parameters
+    ----------
+    graphs : list
+        Tuples of shortest path matrices and their attributes.
+
+    lengths : np.array, default=None
+        The sorted path lengths the features are aligned on. The features
+        of all other lengths are discarded. If None, all the distinct path
+        lengths of the graphs are used.
+
+    n_features : int, default=None
+        The number of features of each length. If None, it is derived from
+        the attributes of the graphs.
+
+    Returns
+    -------
+    lengths : np.array
+        The sorted path lengths.
+
+    n_features : int
+        The number of features of each length.
+
+    phi : scipy.sparse.csr_matrix, shape=(len(graphs), len(lengths)*n_features)
+        The features of the graphs.
+
+    """
+    features = [attribute_path_features(S, attribute_matrix(L, S.shape[0])) for (S, L) in graphs]
+    dims = set(F.shape[1] for (_, F) in features)
+    if n_features is not None:
+        dims.add(n_features)
+    if len(dims) > 1:
+        raise ValueError('All attributes should have the same dimension.')
+    nf = dims.pop()
+
+    if lengths is None:
+        lengths = np.unique(np.concatenate([lens for (lens, _) in features]))
+    rows, cols, data = list(), list(), list()
+    for (i, (lens, F)) in enumerate(features):
+        idx = np.searchsorted(lengths, lens)
+        found = idx < lengths.shape[0]
+        found[found] = lengths[idx[found]] == lens[found]
+        columns = idx[found][:, np.newaxis]*nf + np.arange(nf)
+        rows.append(np.full(columns.size, i, dtype=np.int64))
+        cols.append(columns.ravel())
+        data.append(F[found].ravel())
+    phi = csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                     shape=(len(features), lengths.shape[0]*nf))
+    return lengths, nf, phi
+
+
+def attribute_path_features(S, phi):
+    """Calculate explicit features of a graph, for the inner product attribute kernel.
+
+    With the inner product as an attribute kernel, the shortest path
+    attribute kernel equals the inner product of the matrices
+    :math:`\\phi^{\\top} P_{d} \\phi` of all path lengths d.
+
+    Parameters
+    ----------
+    S : np.array, shape=(n, n)
+        The shortest path matrix.
+
+    phi : np.array, shape=(n, n_attributes)
+        The attribute matrix.
+
+    Returns
+    -------
+    lengths : np.array
+        The distinct finite lengths of the paths.
+
+    features : np.array, shape=(len(lengths), n_attributes*n_attributes)
+        The flattened feature matrix of each length.
+
+    """
+    lengths, codes = path_lengths(S)
+    features = np.empty(shape=(lengths.shape[0], phi.shape[1]**2))
+    for i in range(lengths.shape[0]):
+        features[i] = phi.T.dot((codes == i).dot(phi)).ravel()
+    return lengths, features
@@ -6,6 +6,7 @@ import warnings
 
 import numpy as np
 
+from functools import partial
 from numbers import Real
 
 from grakel.kernels import Kernel
@@ -19,6 +20,11 @@ def k_default(a, b):
     return int(a == b)
 
 
+def k_rbf(a, b, gamma=1.0):
+    """Calculate the rbf kernel between attribute vectors."""
+    return np.exp(-gamma*np.sum(np.square(np.subtract(a, b))))
+
+
 class SubgraphMatching(Kernel):
     r"""Calculate the subgraph matching kernel.
 
@@ -38,6 +44,8 @@ class SubgraphMatching(Kernel):
     default=:math:`k_{v}^{default}(l(a), l(b))= \delta(l(a), l(b))`
         The kernel function between two vertex_labels.
         If no function is provided, this is equivalent with not taking into account node labels.
+        The default, `np.dot` and `k_rbf` (or a `functools.partial` of it, setting gamma)
+        are calculated natively, for hashable labels and numeric attributes respectively.
 
     ke : function (`edge_label`, `edge_label` -> number),
     default=:math:`k_{e}^{default}(l(e), l(e'))= \delta(l(e), l(e'))`
@@ -58,16 +66,23 @@ class SubgraphMatching(Kernel):
     _lambdas : np.array, shape=(1, k+1)
         All the lambdas corresponding to all the valid sizes of subgraphs.
 
+    _kv_native, _ke_native : str, tuple or None
+        The natively calculated equivalent of kv and ke, if any.
+
+    _vertex_enum, _edge_enum : dict
+        The integer codes of the vertex and edge labels, for native dirac kernels.
+
     """
 
     _graph_format = "all"
 
     def __init__(self, n_jobs=None, verbose=False,
                  normalize=False, k=5, kv=k_default,
-                 ke=k_default, lw="uniform"):
+                 ke=k_default, lw="uniform", memmap=None):
         """Initialise a `subgraph_matching` kernel."""
         super(SubgraphMatching, self).__init__(
-            n_jobs=n_jobs, verbose=verbose, normalize=normalize)
+            n_jobs=n_jobs, verbose=verbose, normalize=normalize,
+            memmap=memmap)
 
         self.k = k
         self.kv = kv
@@ -86,11 +101,13 @@ class SubgraphMatching(Kernel):
         if not self.initialized_["kv"]:
             if not callable(self.kv) and self.kv is not None:
                 raise TypeError('kv must be callable or None')
+            self._kv_native = native_kernel(self.kv)
             self.initialized_["kv"] = True
 
         if not self.initialized_["ke"]:
             if not callable(self.ke) and self.ke is not None:
                 raise TypeError('ke must be callable or None')
+            self._ke_native = native_kernel(self.ke)
             self.initialized_["ke"] = True
 
         if not self.initialized_["lw"]:
@@ -138,8 +155,8 @@ class SubgraphMatching(Kernel):
         Parameters
         ----------
         x, y : tuples
-            *Vertex-set*, *edge-dictionary*, *node-label-dictionary*,
-            *edge-labels-dictionary* tuple.
+            *Number of vertices*, *edge-index-matrix*, *labels* and
+            *encoded-labels* tuple (see `parse_input`).
 
         Returns
         -------
@@ -147,7 +164,20 @@ class SubgraphMatching(Kernel):
             The kernel value.
 
         """
-        tv = sm_kernel(x, y, self.kv, self.ke, self.k)
+        nx, Ex, (Lx, Lex), (Cx, Cex) = x
+        ny, Ey, (Ly, Ley), (Cy, Cey) = y
+
+        # Use the native kernels, when labels of both graphs could be encoded
+        if Cx is not None and Cy is not None:
+            kv, Lx, Ly = self._kv_native, Cx, Cy
+        else:
+            kv = self.kv
+        if Cex is not None and Cey is not None:
+            ke, Lex, Ley = self._ke_native, Cex, Cey
+        else:
+            ke = self.ke
+
+        tv = sm_kernel((nx, Ex, Lx, Lex), (ny, Ey, Ly, Ley), kv, ke, self.k)
         return np.dot(self._lambdas, tv)
 
     def parse_input(self, X):
@@ -166,7 +196,9 @@ class SubgraphMatching(Kernel):
         Returns
         -------
         out : list
-            The extracted adjacency matrices for any given input.
+            For each graph, its number of vertices, its edge index matrix
+            (-1 for non edges), its vertex and edge labels (ordered by index)
+            and their encodings for the native kernels (or None).
 
         """
         if not isinstance(X, collections.Iterable):
@@ -174,6 +206,8 @@ class SubgraphMatching(Kernel):
         else:
             i = 0
             out = list()
+            if self._method_calling in [1, 2]:
+                self._vertex_enum, self._edge_enum = dict(), dict()
             for (idx, x) in enumerate(iter(X)):
                 is_iter = False
                 if isinstance(x, collections.Iterable):
@@ -205,17 +239,94 @@ class SubgraphMatching(Kernel):
                 L = g.get_labels(purpose="dictionary", return_none=(self.kv is None))
                 Le = g.get_labels(purpose="dictionary", label_type="edge",
                                   return_none=(self.ke is None))
-                Er = set((a, b) for a in E.keys()
-                         for b in E[a].keys() if a != b)
+                edges = sorted((a, b) for a in E.keys()
+                               for b in E[a].keys() if a != b)
+                Ei = np.full((n, n), -1, dtype=np.intc)
+                if len(edges):
+                    Ei[tuple(np.array(edges).T)] = np.arange(len(edges))
+
+                if L is not None:
+                    L = [L[j] for j in range(n)]
+                if Le is not None:
+                    try:
+                        Le = [Le[e] for e in edges]
+                    except KeyError as key_error:
+                        raise KeyError(str(key_error) + '\nEdge labels must exist for all edges.')
+                encoded = (encode_labels(L, self._kv_native, self._vertex_enum),
+                           encode_labels(Le, self._ke_native, self._edge_enum))
 
                 i += 1
-                out.append((n, Er, L, Le))
+                out.append((n, Ei, (L, Le), encoded))
 
             if i == 0:
                 raise ValueError('parsed input is empty')
             return out
 
 
+def native_kernel(kernel):
+    """Find the natively calculated equivalent of a label kernel.
+
+    Parameters
+    ----------
+    kernel : function or None
+        The label kernel.
+
+    Returns
+    -------
+    native : str, tuple or None
+        "dirac" for `k_default`, "dot" for `np.dot`, ("rbf", gamma) for `k_rbf`
+        or None if the kernel can only be called on each pair of labels.
+
+    """
+    if kernel is k_default:
+        return "dirac"
+    elif kernel is np.dot:
+        return "dot"
+    elif kernel is k_rbf:
+        return ("rbf", 1.0)
+    elif (isinstance(kernel, partial) and kernel.func is k_rbf and not len(kernel.args) and
+            set(kernel.keywords) <= {"gamma"}):
+        return ("rbf", kernel.keywords.get("gamma", 1.0))
+    else:
+        return None
+
+
+def encode_labels(labels, native, enum):
+    """Encode the labels of a graph, for a native kernel.
+
+    Parameters
+    ----------
+    labels : list or None
+        The labels.
+
+    native : str, tuple or None
+        The native kernel (see :func:`native_kernel`).
+
+    enum : dict
+        The integer codes of the labels seen so far, for a dirac kernel.
+
+    Returns
+    -------
+    encoded : np.array or None
+        Integer codes for a dirac kernel or an attribute matrix, or None if
+        the labels cannot be encoded (the kernel is then called on each pair).
+
+    """
+    if native is None or labels is None:
+        return None
+    elif native == "dirac":
+        try:
+            return np.array([enum.setdefault(label, len(enum)) for label in labels], dtype=np.int64)
+        except TypeError:
+            return None
+    else:
+        try:
+            attributes = np.array(labels, dtype=float)
+        except (TypeError, ValueError):
+            return None
+        return attributes.reshape(len(labels), (attributes[0].size if len(labels) else 1))
+
+
 if __name__ == "__main__":
     k = SubgraphMatching()
     print("fit")
@@ -56,12 +56,14 @@ class SvmTheta(Kernel):
     def __init__(self, n_jobs=None, normalize=False,
                  verbose=False, random_seed=42, n_samples=50,
                  subsets_size_range=(2, 8),
-                 base_kernel=lambda x, y: x.T.dot(y)):
+                 base_kernel=lambda x, y: x.T.dot(y),
+                 memmap=None):
         """Initialise a lovasz_theta kernel."""
         # setup valid parameters and initialise from parent
         super(SvmTheta, self).__init__(n_jobs=n_jobs,
                                        normalize=normalize,
-                                       verbose=verbose)
+                                       verbose=verbose,
+                                       memmap=memmap)
 
         self.n_samples = n_samples
         self.subsets_size_range = subsets_size_range
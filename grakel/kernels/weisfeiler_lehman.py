@@ -6,6 +6,9 @@ import warnings
 
 import numpy as np
 
+from scipy.sparse import hstack
+from scipy.sparse import issparse
+
 from sklearn.exceptions import NotFittedError
 from sklearn.utils.validation import check_is_fitted
 from sklearn.externals import joblib
@@ -50,6 +53,8 @@ class WeisfeilerLehman(Kernel):
 
     _inv_labels : dict
         An inverse dictionary, used for relabeling on each iteration.
+        After the first iteration, labels are indexed by the bytes of their
+        (label, sorted neighbor labels) integer signature.
 
     """
 
@@ -206,31 +211,23 @@ class WeisfeilerLehman(Kernel):
                 new_graphs.append((Gs_ed[j], new_labels) + extras[j])
             yield new_graphs
 
+            # Pack all graphs in a single adjacency, with an integer label array
+            nodes, offsets, indptr, indices = pack_graphs(Gs_ed, nx)
+            labels = np.array([L[j][v] for j in range(nx) for v in nodes[j]], dtype=np.int64)
             for i in range(1, self._niter):
-                label_set, WL_labels_inverse, L_temp = set(), dict(), dict()
-                for j in range(nx):
-                    # Find unique labels and sort
-                    # them for both graphs
-                    # Keep for each node the temporary
-                    L_temp[j] = dict()
-                    for v in Gs_ed[j].keys():
-                        credential = str(L[j][v]) + "," + \
-                            str(sorted([L[j][n] for n in Gs_ed[j][v].keys()]))
-                        L_temp[j][v] = credential
-                        label_set.add(credential)
-
-                label_list = sorted(list(label_set))
-                for dv in label_list:
-                    WL_labels_inverse[dv] = label_count
-                    label_count += 1
+                # Find the unique (label, sorted neighbor labels) signatures
+                inverse, signatures = neighborhood_signatures(labels, indptr, indices)
+
+                # Enumerate the new labels in the order of their signatures
+                WL_labels_inverse = {sg.tobytes(): idx for (idx, sg) in
+                                     enumerate(signatures, label_count)}
 
                 # Recalculate labels
+                labels = inverse + label_count
+                label_count += len(signatures)
                 new_graphs = list()
                 for j in range(nx):
-                    new_labels = dict()
-                    for k in L_temp[j].keys():
-                        new_labels[k] = WL_labels_inverse[L_temp[j][k]]
-                    L[j] = new_labels
+                    new_labels = dict(zip(nodes[j], labels[offsets[j]:offsets[j + 1]].tolist()))
                     # relabel
                     new_graphs.append((Gs_ed[j], new_labels) + extras[j])
                 self._inv_labels[i] = WL_labels_inverse
@@ -325,44 +322,105 @@ class WeisfeilerLehman(Kernel):
         if X is None:
             raise ValueError('transform input cannot be None')
         else:
-            if not isinstance(X, collections.Iterable):
-                raise ValueError('input must be an iterable\n')
-            else:
-                nx = 0
-                distinct_values = set()
-                Gs_ed, L = dict(), dict()
-                for (i, x) in enumerate(iter(X)):
-                    is_iter = isinstance(x, collections.Iterable)
-                    if is_iter:
-                        x = list(x)
-                    if is_iter and len(x) in [0, 2, 3]:
-                        if len(x) == 0:
-                            warnings.warn('Ignoring empty element on index: '
-                                          + str(i))
-                            continue
-
-                        elif len(x) in [2, 3]:
-                            x = Graph(x[0], x[1], {}, self._graph_format)
-                    elif type(x) is Graph:
-                        x.desired_format("dictionary")
-                    else:
-                        raise ValueError('each element of X must have at ' +
-                                         'least one and at most 3 elements\n')
-                    Gs_ed[nx] = x.get_edge_dictionary()
-                    L[nx] = x.get_labels(purpose="dictionary")
-
-                    # Hold all the distinct values
-                    distinct_values |= set(
-                        v for v in itervalues(L[nx])
-                        if v not in self._inv_labels[0])
-                    nx += 1
-                if nx == 0:
-                    raise ValueError('parsed input is empty')
+            graphs = self._relabel_graphs(X)
+
+        if self._parallel is None:
+            # Calculate the kernel matrix without parallelization
+            K = np.sum((self.X[i].transform(g) for (i, g)
+                       in enumerate(graphs)), axis=0)
+
+        else:
+            # Calculate the kernel marix with parallelization
+            K = np.sum(self._parallel(joblib.delayed(etransform)(self.X[i], g) for (i, g)
+                       in enumerate(graphs)), axis=0)
+
+        self._is_transformed = True
+        if self.normalize:
+            X_diag, Y_diag = self.diagonal()
+            old_settings = np.seterr(divide='ignore')
+            K = np.nan_to_num(np.divide(K, np.sqrt(np.outer(Y_diag, X_diag))))
+            np.seterr(**old_settings)
+
+        return K
+
+    def _transform_features(self, X):
+        """Concatenate the features of the base kernel on each iteration, for the given graphs.
+
+        The squared norms are summed over all iterations, as the diagonal of `transform`.
+
+        """
+        self._method_calling = 3
+        # Check is fit had been called
+        check_is_fitted(self, ['X', '_nx', '_inv_labels'])
+
+        # Input validation and parsing
+        if X is None:
+            raise ValueError('transform input cannot be None')
+        else:
+            graphs = self._relabel_graphs(X)
+
+        phi, norms = zip(*[self.X[i]._transform_features(g) for (i, g) in enumerate(graphs)])
+        if any(issparse(p) for p in phi):
+            phi = hstack(phi, format='csr')
+        else:
+            phi = np.hstack(phi)
+        return phi, np.sum(norms, axis=0)
+
+    def _relabel_graphs(self, X):
+        """Relabel the given graphs with the fitted labels for all iterations.
+
+        Parameters
+        ----------
+        X : iterable
+            The graphs to be relabeled, as given to `transform`.
+
+        Returns
+        -------
+        graphs : generator
+            Yields for each iteration a list of the relabeled graphs, in the
+            format of the base kernel input.
+
+        """
+        if not isinstance(X, collections.Iterable):
+            raise ValueError('input must be an iterable\n')
+        else:
+            nx = 0
+            distinct_values = set()
+            Gs_ed, L = dict(), dict()
+            for (i, x) in enumerate(iter(X)):
+                is_iter = isinstance(x, collections.Iterable)
+                if is_iter:
+                    x = list(x)
+                if is_iter and len(x) in [0, 2, 3]:
+                    if len(x) == 0:
+                        warnings.warn('Ignoring empty element on index: '
+                                      + str(i))
+                        continue
+
+                    elif len(x) in [2, 3]:
+                        x = Graph(x[0], x[1], {}, self._graph_format)
+                elif type(x) is Graph:
+                    x.desired_format("dictionary")
+                else:
+                    raise ValueError('each element of X must have at ' +
+                                     'least one and at most 3 elements\n')
+                Gs_ed[nx] = x.get_edge_dictionary()
+                L[nx] = x.get_labels(purpose="dictionary")
+
+                # Hold all the distinct values
+                distinct_values |= set(
+                    v for v in itervalues(L[nx])
+                    if v not in self._inv_labels[0])
+                nx += 1
+            if nx == 0:
+                raise ValueError('parsed input is empty')
+
+        # Fitted labels are enumerated across all iterations, so unseen ones
+        # must be indexed after all of them to avoid collisions.
+        n_fitted_labels = sum(len(self._inv_labels[i]) for i in range(self._niter))
 
-        WL_labels_inverse = dict()
-        nl = len(self._inv_labels[0])
         WL_labels_inverse = {dv: idx for (idx, dv) in
-                             enumerate(sorted(list(distinct_values)), nl)}
+                             enumerate(sorted(list(distinct_values)), n_fitted_labels)}
 
         def generate_graphs(WL_labels_inverse):
             # calculate the kernel matrix for the 0 iteration
@@ -379,60 +437,34 @@ class WeisfeilerLehman(Kernel):
                 new_graphs.append([Gs_ed[j], new_labels])
             yield new_graphs
 
+            # Pack all graphs in a single adjacency, with an integer label array
+            nodes, offsets, indptr, indices = pack_graphs(Gs_ed, nx)
+            labels = np.array([L[j][v] for j in range(nx) for v in nodes[j]], dtype=np.int64)
             for i in range(1, self._niter):
-                new_graphs = list()
-                L_temp, label_set = dict(), set()
-                nl = len(self._inv_labels[i])
-                for j in range(nx):
-                    # Find unique labels and sort them for both graphs
-                    # Keep for each node the temporary
-                    L_temp[j] = dict()
-                    for v in Gs_ed[j].keys():
-                        credential = str(L[j][v]) + "," + \
-                            str(sorted([L[j][n] for n in Gs_ed[j][v].keys()]))
-                        L_temp[j][v] = credential
-                        if credential not in self._inv_labels[i]:
-                            label_set.add(credential)
-
-                # Calculate the new label_set
-                WL_labels_inverse = dict()
-                if len(label_set) > 0:
-                    for dv in sorted(list(label_set)):
-                        idx = len(WL_labels_inverse) + nl
-                        WL_labels_inverse[dv] = idx
+                # Find the unique (label, sorted neighbor labels) signatures
+                inverse, signatures = neighborhood_signatures(labels, indptr, indices)
+
+                # A signature containing an unseen label cannot be in the
+                # vocabulary and is directly discarded to the unseen labels.
+                new_ids = np.full(len(signatures), -1, dtype=np.int64)
+                for (idx, sg) in enumerate(signatures):
+                    if sg.max() < n_fitted_labels:
+                        new_ids[idx] = self._inv_labels[i].get(sg.tobytes(), -1)
+
+                # Index unseen signatures after all the fitted labels
+                unseen = new_ids < 0
+                new_ids[unseen] = np.arange(n_fitted_labels, n_fitted_labels + np.count_nonzero(unseen))
 
                 # Recalculate labels
+                labels = new_ids[inverse]
                 new_graphs = list()
                 for j in range(nx):
-                    new_labels = dict()
-                    for (k, v) in iteritems(L_temp[j]):
-                        if v in self._inv_labels[i]:
-                            new_labels[k] = self._inv_labels[i][v]
-                        else:
-                            new_labels[k] = WL_labels_inverse[v]
-                    L[j] = new_labels
+                    new_labels = dict(zip(nodes[j], labels[offsets[j]:offsets[j + 1]].tolist()))
                     # Create the new graphs with the new labels.
                     new_graphs.append([Gs_ed[j], new_labels])
                 yield new_graphs
 
-        if self._parallel is None:
-            # Calculate the kernel matrix without parallelization
-            K = np.sum((self.X[i].transform(g) for (i, g)
-                       in enumerate(generate_graphs(WL_labels_inverse))), axis=0)
-
-        else:
-            # Calculate the kernel marix with parallelization
-            K = np.sum(self._parallel(joblib.delayed(etransform)(self.X[i], g) for (i, g)
-                       in enumerate(generate_graphs(WL_labels_inverse))), axis=0)
-
-        self._is_transformed = True
-        if self.normalize:
-            X_diag, Y_diag = self.diagonal()
-            old_settings = np.seterr(divide='ignore')
-            K = np.nan_to_num(np.divide(K, np.sqrt(np.outer(Y_diag, X_diag))))
-            np.seterr(**old_settings)
-
-        return K
+        return generate_graphs(WL_labels_inverse)
 
     def diagonal(self):
         """Calculate the kernel matrix diagonal for fitted data.
@@ -503,3 +535,89 @@ def efit_transform(object, data):
 def etransform(object, data):
     """Transform an object on data."""
     return object.transform(data)
+
+
+def pack_graphs(Gs_ed, ng):
+    """Pack the edge dictionaries of a collection of graphs, in a single CSR adjacency.
+
+    Parameters
+    ----------
+    Gs_ed : dict
+        The edge dictionaries of the graphs, indexed from 0 to ng-1.
+
+    ng : int
+        The number of graphs.
+
+    Returns
+    -------
+    nodes : list
+        The vertices of each graph, in the order they appear in the packed adjacency.
+
+    offsets : np.array, shape=(ng + 1,)
+        The index of the first vertex of each graph in the packed adjacency.
+
+    indptr, indices : np.array
+        The row pointers and column indices of the packed adjacency (in CSR format).
+
+    """
+    nodes, offsets, indptr, indices = list(), [0], [0], list()
+    for j in range(ng):
+        vertices = list(Gs_ed[j].keys())
+        index = {v: offsets[-1] + k for (k, v) in enumerate(vertices)}
+        for v in vertices:
+            indices.extend(index[n] for n in Gs_ed[j][v].keys())
+            indptr.append(len(indices))
+        nodes.append(vertices)
+        offsets.append(offsets[-1] + len(vertices))
+
+    return (nodes, np.array(offsets, dtype=np.int64),
+            np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64))
+
+
+def neighborhood_signatures(labels, indptr, indices):
+    """Compress the (label, sorted neighbor labels) signature of each vertex.
+
+    Parameters
+    ----------
+    labels : np.array, shape=(n_vertices,)
+        The integer label of each vertex.
+
+    indptr, indices : np.array
+        The row pointers and column indices of the adjacency (in CSR format).
+
+    Returns
+    -------
+    inverse : np.array, shape=(n_vertices,)
+        The index of the signature of each vertex.
+
+    signatures : list
+        The unique signatures, as integer arrays starting with the label
+        of the vertex, followed by the sorted labels of its neighbors.
+
+    """
+    degrees = np.diff(indptr)
+
+    # Sort the labels of the neighbors inside each row
+    rows = np.repeat(np.arange(labels.shape[0], dtype=np.int64), degrees)
+    neighbor_labels = labels[indices]
+    if neighbor_labels.shape[0] > 0:
+        base = int(neighbor_labels.max()) + 1
+        if base * labels.shape[0] < np.iinfo(np.int64).max:
+            # sort a single key, as rows are already in ascending order
+            neighbor_labels = np.sort(rows * base + neighbor_labels) - rows * base
+        else:
+            neighbor_labels = neighbor_labels[np.lexsort((neighbor_labels, rows))]
+
+    inverse, signatures = np.empty(labels.shape[0], dtype=np.int64), list()
+    for d in np.unique(degrees):
+        # Signatures of vertices with the same degree have equal length
+        idx = np.flatnonzero(degrees == d)
+        block = np.empty(shape=(idx.shape[0], d + 1), dtype=np.int64)
+        block[:, 0] = labels[idx]
+        block[:, 1:] = neighbor_labels[indptr[idx, np.newaxis] + np.arange(d)]
+
+        unique, block_inverse = np.unique(block, axis=0, return_inverse=True)
+        inverse[idx] = block_inverse + len(signatures)
+        signatures.extend(unique)
+
+    return inverse, signatures
@@ -4,7 +4,37 @@
 import warnings
 import numpy as np
 
+from collections import Counter
+from functools import partial
+from itertools import permutations
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from numpy.testing import assert_allclose
+from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
+from scipy.sparse import csr_matrix
+from scipy.sparse import issparse
+from sklearn.externals.joblib import parallel_backend
+
 from grakel.datasets import generate_dataset
+from grakel.graph import Graph
+from grakel.kernels.graph_hopper import bridge_kernel
+from grakel.kernels.graph_hopper import gaussian_kernel
+from grakel.kernels.graph_hopper import hopper_weights
+from grakel.kernels.graph_hopper import linear_kernel
+from grakel.kernels.graph_hopper import shortest_path_dags
+from grakel.kernels.graphlet_sampling import canonical_form
+from grakel.kernels.multiscale_laplacian import flg_kernels
+from grakel.kernels.multiscale_laplacian import flg_operator
+from grakel.kernels.multiscale_laplacian import stack_operators
+from grakel.kernels.pyramid_match import eigen_embedding
+from grakel.kernels.pyramid_match import histogram_intersection
+from grakel.kernels.pyramid_match import level_weights
+from grakel.kernels.pyramid_match import spectral_embeddings
+import grakel.kernels.shortest_path as shortest_path_module
+from grakel.kernels.subgraph_matching import k_default
+from grakel.kernels.subgraph_matching import k_rbf
 
 from grakel import GraphKernel
 from grakel.kernels import GraphletSampling
@@ -510,6 +540,49 @@ def test_subgraph_matching_pd():
         assert False, exception
 
 
+def test_subgraph_matching_native():
+    """Test the natively calculated Subgraph Matching label kernels against python callbacks."""
+    for (features, kv, ke) in [(('nl', 3, 'el', 4), k_default, k_default),
+                               (('nl', 3, 'el', 4), None, k_default),
+                               (('na', 4, 'ea', 3), np.dot, partial(k_rbf, gamma=0.5)),
+                               (('na', 4, 'el', 3), k_rbf, None)]:
+        train, test = generate_dataset(n_graphs=15,
+                                       r_vertices=(4, 9),
+                                       r_connectivity=(0.3, 0.7),
+                                       r_weight_edges=(1, 1),
+                                       n_graphs_test=5,
+                                       random_seed=rs,
+                                       features=features)
+
+        K = list()
+        for callback in [False, True]:
+            sm_kernel = SubgraphMatching(
+                verbose=verbose, normalize=normalize, k=3,
+                kv=(kv if kv is None or not callback else lambda a, b: kv(a, b)),
+                ke=(ke if ke is None or not callback else lambda a, b: ke(a, b)))
+            K.append((sm_kernel.fit_transform(train), sm_kernel.transform(test)))
+        assert_allclose(K[0][0], K[1][0])
+        assert_allclose(K[0][1], K[1][1])
+
+
+def test_subgraph_matching_threads():
+    """Test that the Subgraph Matching kernel is equal when calculated by many threads."""
+    train, test = generate_dataset(n_graphs=20,
+                                   r_vertices=(6, 12),
+                                   r_connectivity=(0.3, 0.7),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=8,
+                                   random_seed=rs,
+                                   features=('nl', 3, 'el', 4))
+
+    K = list()
+    for n_jobs in [None, 4]:
+        sm_kernel = SubgraphMatching(verbose=verbose, normalize=normalize, k=4, n_jobs=n_jobs)
+        K.append((sm_kernel.fit_transform(train), sm_kernel.transform(test)))
+    assert_allclose(K[0][0], K[1][0])
+    assert_allclose(K[0][1], K[1][1])
+
+
 def test_neighborhood_subgraph_pairwise_distance():
     """Random input test for the Neighborhood Subgraph Pairwise Distance kernel [+ decorator]."""
     train, test = generate_dataset(n_graphs=100,
@@ -535,6 +608,68 @@ def test_neighborhood_subgraph_pairwise_distance():
         assert False, exception
 
 
+def test_neighborhood_subgraph_pairwise_distance_hashing():
+    """Test the NSPD kernel against explicit encodings of all neighborhoods."""
+    train, test = generate_dataset(n_graphs=20,
+                                   r_vertices=(6, 12),
+                                   r_connectivity=(0.25, 0.5),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=6,
+                                   random_seed=rs,
+                                   features=('nl', 3, 'el', 2))
+    r, d = 2, 2
+
+    def features(x):
+        g = Graph(x[0], x[1], x[2])
+        A = g.get_adjacency_matrix()
+        Lv = g.get_labels(purpose="adjacency")
+        Le = g.get_labels(purpose="adjacency", label_type="edge")
+        n = A.shape[0]
+
+        # BFS distances
+        D = dict()
+        for s in range(n):
+            D[s, s], frontier = 0, [s]
+            while len(frontier):
+                next_frontier = list()
+                for u in frontier:
+                    for w in np.flatnonzero(A[u]).tolist():
+                        if (s, w) not in D:
+                            D[s, w] = D[s, u] + 1
+                            next_frontier.append(w)
+                frontier = next_frontier
+
+        # Encode neighborhoods as sorted vertex and edge labels
+        encoding = dict()
+        for radius in range(r + 1):
+            for v in range(n):
+                S = [j for j in range(n) if D.get((v, j), radius + 1) <= radius]
+                lab = {i: tuple(sorted((D[i, j], Lv[j]) for j in S if D.get((i, j), d + 1) <= d))
+                       for i in S}
+                encoding[radius, v] = str((sorted(lab[i] for i in S),
+                                           sorted((lab[i], lab[j], Le[i, j])
+                                                  for i in S for j in S if A[i, j] != 0)))
+        return {(radius, dist): Counter((encoding[radius, a], encoding[radius, b])
+                                        for (a, b) in D if D[a, b] == dist)
+                for radius in range(r + 1) for dist in range(d + 1)}
+
+    def kernel(Fx, Fy):
+        K = np.zeros(shape=(len(Fx), len(Fy)))
+        for level in Fx[0].keys():
+            if any(len(f[level]) for f in Fx) and any(len(f[level]) for f in Fy):
+                G, nx, ny = [np.array([[sum(a[level][key]*b[level][key] for key in a[level])
+                                        for b in Y] for a in X]) for (X, Y) in
+                             [(Fx, Fy), (Fx, Fx), (Fy, Fy)]]
+                norm = np.sqrt(np.outer(nx.diagonal(), ny.diagonal()))
+                K += G / np.where(norm == 0, 1, norm)
+        return K
+
+    nspd_kernel = NeighborhoodSubgraphPairwiseDistance(verbose=verbose, normalize=False, r=r, d=d)
+    Fx, Fy = [features(x) for x in train], [features(x) for x in test]
+    assert_allclose(nspd_kernel.fit_transform(train), kernel(Fx, Fx))
+    assert_allclose(nspd_kernel.transform(test), kernel(Fy, Fx))
+
+
 if cvxopt:
     def test_lovasz_theta():
         """Random input test for the Lovasz-theta distance kernel."""
@@ -846,6 +981,66 @@ def test_multiscale_laplacian_fast_pd():
         assert False, exception
 
 
+def test_multiscale_laplacian_fast_operators():
+    """Test the factorized FLG operators of the Fast Multiscale Laplacian kernel."""
+    rs_ml = np.random.RandomState(0)
+    operators, matrices = list(), list()
+    for n in [4, 7, 12]:
+        A = np.triu((rs_ml.rand(n, n) < 0.5).astype(float), 1)
+        L = np.diag((A + A.T).sum(axis=0)) - A - A.T + 0.01*np.eye(n)
+        U = rs_ml.rand(n, 3)
+        S = U.T.dot(np.linalg.inv(L)).dot(U) + 0.01*np.eye(3)
+        S_inv, log_det = flg_operator(L, U, 0.01)
+        assert_allclose(S_inv, np.linalg.inv(S), rtol=1e-6)
+        assert_allclose(log_det, np.linalg.slogdet(S)[1])
+        operators.append((S_inv, log_det))
+        matrices.append(S)
+
+    # the stacked evaluation equals the explicit FLG kernel
+    kernels = flg_kernels(operators[0], stack_operators(operators))
+    for (S, k) in zip(matrices, kernels):
+        logr = (-np.linalg.slogdet(np.linalg.inv(matrices[0]) + np.linalg.inv(S))[1]
+                - 0.5*(np.linalg.slogdet(matrices[0])[1] + np.linalg.slogdet(S)[1]))/2.0
+        assert_allclose(k, (np.exp(logr) if logr >= -30 else .0))
+
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 12),
+                                   r_connectivity=(0.4, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=10,
+                                   random_seed=rs,
+                                   features=('na', 5))
+
+    # parallel vertex evaluation does not change the kernel
+    K = [(k.fit_transform(train), k.transform(test)) for k in
+         [MultiscaleLaplacianFast(n_jobs=n_jobs, N=20) for n_jobs in [None, 2]]]
+    assert_allclose(K[0][0], K[1][0])
+    assert_allclose(K[0][1], K[1][1])
+
+
+def test_multiscale_laplacian_radius():
+    """Test that level l of the Multiscale Laplacian kernels uses the neighborhoods of radius l."""
+    graphs = list()
+    for n in range(7, 13):
+        # path graphs, where each level adds two vertices to inner neighborhoods
+        A = np.eye(n, k=1) + np.eye(n, k=-1)
+        graphs.append([A, {i: rs.rand(3).tolist() for i in range(n)}])
+
+    ml_kernel = MultiscaleLaplacian(verbose=verbose, L=4)
+    ml_kernel.fit(graphs)
+    for ((A, _, _, Q, _), (_, labels)) in zip(ml_kernel.X, graphs):
+        n = A.shape[0]
+        for level in range(1, 5):
+            for i in range(n):
+                assert_array_equal(np.sort(Q[level][i]["n"]),
+                                   np.arange(max(0, i - level), min(n, i + level + 1)))
+
+        N = Graph(A, labels, {}).produce_neighborhoods(r=4)
+        for level in range(1, 5):
+            for i in range(n):
+                assert_array_equal(N[level][i], np.arange(max(0, i - level), min(n, i + level + 1)))
+
+
 def test_vertex_histogram():
     """Random input test for the Vertex Histogram Kernel [+ decorator]."""
     train, test = generate_dataset(n_graphs=100,
@@ -935,6 +1130,54 @@ def test_graph_hopper_pd():
         assert False, exception
 
 
+def test_graph_hopper_weights():
+    """Test the Graph Hopper M matrices against an enumeration of all shortest paths."""
+    rs_gh = np.random.RandomState(0)
+    for n in [1, 2, 5, 6]:
+        A = np.triu((rs_gh.rand(n, n) < 0.5).astype(float), 1)
+        A = A + A.T
+        dag, occ = shortest_path_dags(A)
+
+        # enumerate the simple paths that are shortest paths
+        D = Graph(A, {}, {}, "adjacency").build_shortest_path_matrix(labels="none")
+        M = np.zeros(shape=(n, n + 1, n + 1))
+        for k in range(1, n + 1):
+            for path in permutations(range(n), k):
+                if (all(A[u, v] > 0 for (u, v) in zip(path[:-1], path[1:])) and
+                        D[path[0], path[-1]] == k - 1):
+                    for (a, v) in enumerate(path):
+                        M[v, a, k - 1] += 1
+
+        assert len(occ) == int(np.max(D[D < float("Inf")])) + 1
+        assert_array_almost_equal(hopper_weights(dag, occ, n, n + 1), M)
+
+
+def test_graph_hopper_blocks():
+    """Test the blocked Graph Hopper kernel matrix against the pairwise kernels."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 15),
+                                   r_connectivity=(0.2, 0.6),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=10,
+                                   random_seed=rs,
+                                   features=('na', 4))
+
+    def gaussian_pairwise(x, y):
+        return gaussian_kernel(x + (np.sum(x[1] ** 2, axis=1),),
+                               y + (np.sum(y[1] ** 2, axis=1),), 0.5)
+
+    for (kernel_type, pairwise) in [("linear", linear_kernel),
+                                    (("gaussian", 0.5), gaussian_pairwise),
+                                    ("bridge", bridge_kernel)]:
+        K = list()
+        for (kt, n_jobs) in [(kernel_type, None), (kernel_type, 2), (pairwise, None)]:
+            gh_kernel = GraphHopper(kernel_type=kt, n_jobs=n_jobs, normalize=normalize)
+            K.append((gh_kernel.fit_transform(train), gh_kernel.transform(test)))
+        for (K_train, K_test) in K[:2]:
+            assert_allclose(K_train, K[2][0])
+            assert_allclose(K_test, K[2][1])
+
+
 def test_core_framework():
     """Random input test for the Core kernel Framework [+ decorator]."""
     train, test = generate_dataset(n_graphs=100,
@@ -960,6 +1203,436 @@ def test_core_framework():
         assert False, exception
 
 
+def test_kernel_parallel_blocks():
+    """Test that the blocked parallel kernel matrix matches the serial one."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 10),
+                                   r_connectivity=(0.4, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=11,
+                                   random_seed=rs,
+                                   features=None)
+
+    serial = RandomWalk(verbose=verbose, normalize=normalize)
+    K_fit, K_transform = serial.fit_transform(train), serial.transform(test)
+
+    parallel = RandomWalk(verbose=verbose, normalize=normalize, n_jobs=3)
+    assert_array_almost_equal(K_fit, parallel.fit_transform(train))
+    assert_array_almost_equal(K_transform, parallel.transform(test))
+
+    # Process based workers write on the shared kernel matrix
+    with parallel_backend("loky"):
+        parallel = RandomWalk(verbose=verbose, normalize=normalize, n_jobs=3)
+        assert_array_almost_equal(K_fit, parallel.fit_transform(train))
+        assert_array_almost_equal(K_transform, parallel.transform(test))
+
+
+def test_kernel_memmap():
+    """Test that a memory mapped kernel matrix matches the in memory one."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 10),
+                                   r_connectivity=(0.4, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=11,
+                                   random_seed=rs,
+                                   features=('na', 4))
+
+    sp_kernel = ShortestPathAttr(verbose=verbose, normalize=True)
+    K_fit, K_transform = sp_kernel.fit_transform(train), sp_kernel.transform(test)
+
+    directory = mkdtemp()
+    try:
+        for n_jobs in [None, 2]:
+            gk = GraphKernel(kernel={"name": "shortest_path", "as_attributes": True}, verbose=verbose,
+                             normalize=True, n_jobs=n_jobs, memmap=(directory, np.float32))
+            K_fit_mm, K_transform_mm = gk.fit_transform(train), gk.transform(test)
+            assert isinstance(K_fit_mm, np.memmap) and K_fit_mm.dtype == np.float32
+            assert isinstance(K_transform_mm, np.memmap)
+            assert_array_almost_equal(K_fit, K_fit_mm, decimal=5)
+            assert_array_almost_equal(K_transform, K_transform_mm, decimal=5)
+            del K_fit_mm, K_transform_mm
+    finally:
+        rmtree(directory, ignore_errors=True)
+
+
+def test_transform_iter():
+    """Test that the batched transform matches the whole transform."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 10),
+                                   r_connectivity=(0.4, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=11,
+                                   random_seed=rs,
+                                   features=('nl', 3))
+
+    for kernel in [ShortestPath(verbose=verbose, normalize=True),
+                   WeisfeilerLehman(verbose=verbose, normalize=True, base_kernel=VertexHistogram),
+                   VertexHistogram(verbose=verbose, normalize=True),
+                   RandomWalkLabeled(verbose=verbose, normalize=True)]:
+        kernel.fit(train)
+        K_transform = kernel.transform(test)
+        batches = list(kernel.transform_iter(iter(test), batch_size=4))
+        assert [b.shape[0] for b in batches] == [4, 4, 3]
+        assert_array_almost_equal(K_transform, np.vstack(batches))
+
+    gk = GraphKernel(kernel={"name": "shortest_path"}, verbose=verbose, normalize=True)
+    gk.fit(train)
+    assert_array_almost_equal(gk.transform(test),
+                              np.vstack(list(gk.transform_iter(test, batch_size=5))))
+
+
+def test_histogram_sparse():
+    """Test that the sparse histogram kernels match the dense ones."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 10),
+                                   r_connectivity=(0.4, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=11,
+                                   random_seed=rs,
+                                   features=('nl', 3))
+    train_el, test_el = generate_dataset(n_graphs=30,
+                                         r_vertices=(5, 10),
+                                         r_connectivity=(0.4, 0.8),
+                                         r_weight_edges=(1, 1),
+                                         n_graphs_test=11,
+                                         random_seed=rs,
+                                         features=('el', 4))
+
+    for (kernel, params, tr, te) in [(VertexHistogram, dict(), train, test),
+                                     (EdgeHistogram, dict(), train_el, test_el)]:
+        dense = kernel(verbose=verbose, normalize=True, **params)
+        sparse = kernel(verbose=verbose, normalize=True, sparse=True, **params)
+        assert_array_almost_equal(dense.fit_transform(tr), sparse.fit_transform(tr))
+        assert_array_almost_equal(dense.transform(te), sparse.transform(te))
+
+    dense = WeisfeilerLehman(verbose=verbose, normalize=True, base_kernel=VertexHistogram)
+    sparse = WeisfeilerLehman(verbose=verbose, normalize=True,
+                              base_kernel=(VertexHistogram, {"sparse": True}))
+    assert_array_almost_equal(dense.fit_transform(train), sparse.fit_transform(train))
+    assert_array_almost_equal(dense.transform(test), sparse.transform(test))
+
+
+def test_transform_features():
+    """Test that the explicit features reproduce the kernel matrix."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 10),
+                                   r_connectivity=(0.4, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=11,
+                                   random_seed=rs,
+                                   features=('nl', 3, 'el', 4))
+
+    # test graphs with labels unseen in fit
+    _, unseen = generate_dataset(n_graphs=12,
+                                 r_vertices=(5, 10),
+                                 r_connectivity=(0.4, 0.8),
+                                 r_weight_edges=(1, 1),
+                                 n_graphs_test=11,
+                                 random_seed=rs,
+                                 features=('nl', 6, 'el', 8))
+
+    for normalize in [False, True]:
+        for kernel in [VertexHistogram(verbose=verbose, normalize=normalize),
+                       VertexHistogram(verbose=verbose, normalize=normalize, sparse=True),
+                       EdgeHistogram(verbose=verbose, normalize=normalize),
+                       ShortestPath(verbose=verbose, normalize=normalize),
+                       GraphletSampling(verbose=verbose, normalize=normalize, k=4, sampling=None),
+                       NeighborhoodSubgraphPairwiseDistance(verbose=verbose, normalize=normalize,
+                                                            r=2, d=2),
+                       WeisfeilerLehman(verbose=verbose, normalize=normalize,
+                                        base_kernel=(VertexHistogram, {"sparse": True}))]:
+            K_fit = kernel.fit_transform(train)
+            phi_train = kernel.transform_features(train)
+            for (graphs, K_true) in [(train, K_fit), (test, None), (unseen, None)]:
+                if K_true is None:
+                    K_true = kernel.transform(graphs)
+                phi = kernel.transform_features(graphs)
+                assert phi.shape[1] == phi_train.shape[1]
+                K_phi = phi.dot(phi_train.T)
+                if issparse(K_phi):
+                    K_phi = K_phi.toarray()
+                assert_array_almost_equal(K_true, K_phi)
+
+
+def test_weisfeiler_lehman_relabel():
+    """Test that the WL relabelling is invariant to vertex permutations."""
+    train, _ = generate_dataset(n_graphs=20,
+                                r_vertices=(5, 15),
+                                r_connectivity=(0.2, 0.8),
+                                r_weight_edges=(1, 1),
+                                n_graphs_test=1,
+                                random_seed=rs,
+                                features=('nl', 3))
+
+    permuted = list()
+    for (A, labels) in train:
+        p = rs.permutation(A.shape[0])
+        permuted.append([A[np.ix_(p, p)], {i: labels[p[i]] for i in range(A.shape[0])}])
+
+    wl_kernel = WeisfeilerLehman(verbose=verbose, niter=4, base_kernel=VertexHistogram)
+    K = wl_kernel.fit_transform(train)
+    vocabulary_size = [len(wl_kernel._inv_labels[i]) for i in range(5)]
+    assert_array_almost_equal(K, wl_kernel.transform(permuted))
+
+    # Unseen labels must not change the fitted vocabulary
+    unseen = [[A, {v: 'unseen' for v in labels}] for (A, labels) in permuted]
+    assert_array_almost_equal(wl_kernel.transform(unseen), np.zeros(K.shape))
+    assert vocabulary_size == [len(wl_kernel._inv_labels[i]) for i in range(5)]
+
+
+def test_shortest_path_batch():
+    """Test the batched shortest path features against each graph's shortest paths."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(2, 12),
+                                   r_connectivity=(0.1, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=11,
+                                   random_seed=rs,
+                                   features=('nl', 3))
+
+    def triplets(G):
+        S, L = Graph(G[0], G[1], {}, "adjacency").build_shortest_path_matrix()
+        return Counter((L[u], L[v], S[u, v]) for u in range(S.shape[0])
+                       for v in range(S.shape[0]) if u != v and S[u, v] != float("Inf"))
+
+    def kernel(Gx, Gy):
+        cx, cy = triplets(Gx), triplets(Gy)
+        return sum(cx[t]*cy[t] for t in cx)
+
+    sp_kernel = ShortestPath(verbose=verbose)
+    K_fit, K_transform = sp_kernel.fit_transform(train), sp_kernel.transform(test)
+    assert_array_almost_equal(K_fit, [[kernel(x, y) for y in train] for x in train])
+    assert_array_almost_equal(K_transform, [[kernel(x, y) for y in train] for x in test])
+
+
+def test_shortest_path_refit():
+    """Test that a refitted Shortest Path kernel transforms as a newly fitted one."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 10),
+                                   r_connectivity=(0.3, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=10,
+                                   random_seed=rs,
+                                   features=('nl', 3))
+
+    sp_kernel = ShortestPath(verbose=verbose, normalize=True)
+    sp_kernel.fit_transform(train[:10])
+    sp_kernel.transform(test)
+    K_transform = sp_kernel.fit(train).transform(test)
+    assert_array_almost_equal(K_transform, ShortestPath(normalize=True).fit(train).transform(test))
+
+
+def test_shortest_path_attr_lengths():
+    """Test the grouped shortest path attribute kernel against comparing all pairs of paths."""
+    train, test = generate_dataset(n_graphs=12,
+                                   r_vertices=(1, 8),
+                                   r_connectivity=(0.2, 0.8),
+                                   r_weight_edges=(1, 3),
+                                   n_graphs_test=5,
+                                   random_seed=rs,
+                                   features=('na', 3))
+
+    def gaussian(x, y):
+        return np.exp(-np.sum((np.array(x) - np.array(y)) ** 2))
+
+    def kernel(Gx, Gy, attribute_kernel):
+        Sx, Lx = Graph(Gx[0], Gx[1], {}, "adjacency").build_shortest_path_matrix()
+        Sy, Ly = Graph(Gy[0], Gy[1], {}, "adjacency").build_shortest_path_matrix()
+        return sum(attribute_kernel(Lx[i], Ly[k])*attribute_kernel(Lx[j], Ly[m])
+                   for i in range(Sx.shape[0]) for j in range(Sx.shape[0])
+                   for k in range(Sy.shape[0]) for m in range(Sy.shape[0])
+                   if i != j and k != m and Sx[i, j] == Sy[k, m] != float("Inf"))
+
+    for attribute_kernel in [None, gaussian]:
+        if attribute_kernel is None:
+            sp_kernel, attribute_kernel = ShortestPathAttr(verbose=verbose), np.dot
+        else:
+            sp_kernel = ShortestPathAttr(verbose=verbose, attribute_kernel=attribute_kernel)
+        K_fit, K_transform = sp_kernel.fit_transform(train), sp_kernel.transform(test)
+        assert_allclose(K_fit, [[kernel(x, y, attribute_kernel) for y in train] for x in train])
+        assert_allclose(K_transform, [[kernel(x, y, attribute_kernel) for y in train]
+                                      for x in test])
+
+    # Refit on memory mapped kernel matrices, calculated in stripes of single rows
+    stripe_elements, directory = shortest_path_module.stripe_elements, mkdtemp()
+    try:
+        shortest_path_module.stripe_elements = 1
+        sp_kernel = ShortestPathAttr(verbose=verbose, memmap=(directory, np.float64))
+        sp_kernel.fit(test)
+        K_fit, K_transform = sp_kernel.fit_transform(train), sp_kernel.transform(test)
+        assert isinstance(K_fit, np.memmap) and isinstance(K_transform, np.memmap)
+        assert_allclose(K_fit, [[kernel(x, y, np.dot) for y in train] for x in train])
+        assert_allclose(K_transform, [[kernel(x, y, np.dot) for y in train] for x in test])
+        del K_fit, K_transform
+    finally:
+        shortest_path_module.stripe_elements = stripe_elements
+        rmtree(directory, ignore_errors=True)
+
+
+def test_graphlet_sampling_canonical():
+    """Test that the graphlet canonical forms separate isomorphism classes."""
+    # the number of non-isomorphic undirected graphs of 3, 4 and 5 vertices
+    for (n, n_classes) in [(3, 4), (4, 11), (5, 34)]:
+        triu = np.triu_indices(n, 1)
+        classes, cache = set(), dict()
+        for bits in range(2**len(triu[0])):
+            A = np.zeros(shape=(n, n), dtype=int)
+            A[triu] = [(bits >> i) & 1 for i in range(len(triu[0]))]
+            A = A + A.T
+            key = canonical_form(A, cache)
+            p = rs.permutation(n)
+            assert canonical_form(A[p, :][:, p]) == key
+            classes.add(key)
+        assert len(classes) == n_classes
+
+    train, _ = generate_dataset(n_graphs=20,
+                                r_vertices=(5, 10),
+                                r_connectivity=(0.3, 0.8),
+                                r_weight_edges=(1, 1),
+                                n_graphs_test=1,
+                                random_seed=rs,
+                                features=None)
+
+    gs_kernel = GraphletSampling(verbose=verbose, k=4)
+    K_fit = gs_kernel.fit_transform(train)
+
+    # at most 6 connected undirected graphlets of size 4 exist
+    assert len(gs_kernel._graph_bins) <= 6
+    assert_array_almost_equal(K_fit, gs_kernel.transform(train))
+    assert len(gs_kernel._Y_graph_bins) == 0
+
+
+def test_graphlet_sampling_seed():
+    """Test that the sampled graphlets depend on the random seed and not on n_jobs."""
+    train, test = generate_dataset(n_graphs=30,
+                                   r_vertices=(5, 15),
+                                   r_connectivity=(0.3, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=10,
+                                   random_seed=rs,
+                                   features=None)
+
+    K = list()
+    for n_jobs in [None, 2, None]:
+        gs_kernel = GraphletSampling(verbose=verbose, n_jobs=n_jobs, random_seed=7,
+                                     sampling=dict(n_samples=100))
+        K.append((gs_kernel.fit_transform(train), gs_kernel.transform(test)))
+    for (K_fit, K_transform) in K[1:]:
+        assert_array_almost_equal(K_fit, K[0][0])
+        assert_array_almost_equal(K_transform, K[0][1])
+
+    # each graph contributes all of its samples
+    n_samples = Counter()
+    for ((i, _), v) in gs_kernel.X.items():
+        n_samples[i] += v
+    assert all(n_samples[i] == 100 for i in range(len(train)))
+
+    # a refitted kernel transforms as a newly fitted one
+    gs_kernel = GraphletSampling(verbose=verbose, normalize=True, random_seed=7,
+                                 sampling=dict(n_samples=100))
+    gs_kernel.fit(test)
+    gs_kernel.transform(train)
+    K_transform = gs_kernel.fit(train).transform(test)
+    assert_array_almost_equal(K_transform, GraphletSampling(normalize=True, random_seed=7,
+                                                            sampling=dict(n_samples=100)
+                                                            ).fit(train).transform(test))
+
+
+def test_random_walk_spectral():
+    """Test the batched spectral random walk kernel against the Kronecker product."""
+    train, test = generate_dataset(n_graphs=20,
+                                   r_vertices=(3, 12),
+                                   r_connectivity=(0.2, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=10,
+                                   random_seed=rs,
+                                   features=None)
+
+    def kernel(Gx, Gy, mu, lamda):
+        Ax = Graph(Gx[0], {}, {}, "adjacency").get_adjacency_matrix()
+        Ay = Graph(Gy[0], {}, {}, "adjacency").get_adjacency_matrix()
+        wx, vx = np.linalg.eigh(Ax)
+        wy, vy = np.linalg.eigh(Ay)
+        f = np.kron(np.sum(vx, axis=0), np.sum(vy, axis=0))
+        D = np.kron(wx, wy)
+        if mu is None:
+            return np.sum(np.square(f)*np.exp(lamda*D))
+        else:
+            return np.sum(np.square(f)*sum(m*np.power(D, k) for (k, m) in enumerate(mu)))
+
+    for params in [dict(kernel_type="exponential"), dict(p=3)]:
+        rw_kernel = RandomWalk(verbose=verbose, lamda=0.1, **params)
+        K_fit, K_transform = rw_kernel.fit_transform(train), rw_kernel.transform(test)
+        mu = (rw_kernel._mu if "p" in params else None)
+        assert_allclose(K_fit, [[kernel(x, y, mu, 0.1) for y in train] for x in train])
+        assert_allclose(K_transform, [[kernel(x, y, mu, 0.1) for y in train] for x in test])
+
+
+def test_random_walk_product_graph():
+    """Test the implicit product graph random walk against the explicit one."""
+    train, test = generate_dataset(n_graphs=15,
+                                   r_vertices=(5, 15),
+                                   r_connectivity=(0.1, 0.5),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=5,
+                                   random_seed=rs,
+                                   features=('nl', 3))
+
+    for kernel in [RandomWalk, RandomWalkLabeled]:
+        baseline = kernel(verbose=verbose, lamda=0.01, method_type="baseline")
+        fast = kernel(verbose=verbose, lamda=0.01, method_type="fast")
+        assert_allclose(fast.fit_transform(train), baseline.fit_transform(train), rtol=1e-5)
+        assert_allclose(fast.transform(test), baseline.transform(test), rtol=1e-5)
+
+
+def test_pyramid_match_intersection():
+    """Test the vectorized histogram intersection of the pyramid match kernel."""
+    Hx = rs.randint(0, 4, size=(12, 30))*(rs.rand(12, 30) < 0.3)
+    Hy = rs.randint(0, 4, size=(7, 30))*(rs.rand(7, 30) < 0.3)
+    K = histogram_intersection(csr_matrix(Hy, dtype=float), csr_matrix(Hx, dtype=float))
+    assert_array_almost_equal(K, np.minimum(Hy[:, None, :], Hx[None, :, :]).sum(axis=2))
+
+    # The kernel of a graph with itself is the (weighted) number of its
+    # vertices times the dimension of the hypercube, on each level
+    train, test = generate_dataset(n_graphs=20,
+                                   r_vertices=(10, 20),
+                                   r_connectivity=(0.4, 0.8),
+                                   r_weight_edges=(1, 1),
+                                   n_graphs_test=5,
+                                   random_seed=rs,
+                                   features=('nl', 3))
+    pm_kernel = PyramidMatch(verbose=verbose, L=3, d=4)
+    K = pm_kernel.fit_transform(train)
+    n = np.array([len(G[1]) for G in train])
+    assert_array_almost_equal(np.diagonal(K), np.sum(level_weights(3))*4*n)
+    assert_array_almost_equal(pm_kernel.diagonal(), np.diagonal(K))
+
+
+def test_pyramid_match_embeddings():
+    """Test the eigensolvers and the embedding cache of the pyramid match kernel."""
+    A = np.triu(rs.rand(40, 40) < 0.3, 1).astype(float)
+    A = csr_matrix(A + A.T)
+    U_dense, = spectral_embeddings([A], 6)
+    assert_array_almost_equal(U_dense, eigen_embedding(A, 6))
+
+    train, _ = generate_dataset(n_graphs=20,
+                                r_vertices=(5, 20),
+                                r_connectivity=(0.4, 0.8),
+                                r_weight_edges=(1, 1),
+                                n_graphs_test=1,
+                                random_seed=rs,
+                                features=('nl', 3))
+    pm_kernel = PyramidMatch(verbose=verbose, L=4)
+    pm_kernel.fit(train)
+    embeddings = set(id(U) for U in pm_kernel._embedding_cache.values())
+
+    # A refit with a different number of levels, reuses the embeddings
+    pm_kernel.set_params(L=2)
+    K = pm_kernel.fit_transform(train)
+    assert set(id(U) for U in pm_kernel._embedding_cache.values()) == embeddings
+    assert_array_almost_equal(K, PyramidMatch(verbose=verbose, L=2).fit_transform(train))
+
+
 if __name__ == "__main__":
     warnings.filterwarnings("once")
     verbose = True
@@ -979,7 +1652,10 @@ if __name__ == "__main__":
     test_neighborhood_hash_pd()
     test_subgraph_matching()
     test_subgraph_matching_pd()
+    test_subgraph_matching_native()
+    test_subgraph_matching_threads()
     test_neighborhood_subgraph_pairwise_distance()
+    test_neighborhood_subgraph_pairwise_distance_hashing()
     if cvxopt:
         test_lovasz_theta()
         test_lovasz_theta_pd()
@@ -994,8 +1670,27 @@ if __name__ == "__main__":
     test_multiscale_laplacian_pd()
     test_multiscale_laplacian_fast()
     test_multiscale_laplacian_fast_pd()
+    test_multiscale_laplacian_fast_operators()
+    test_multiscale_laplacian_radius()
     test_vertex_histogram()
     test_edge_histogram()
     test_graph_hopper()
     test_graph_hopper_pd()
+    test_graph_hopper_weights()
+    test_graph_hopper_blocks()
     test_core_framework()
+    test_kernel_parallel_blocks()
+    test_kernel_memmap()
+    test_transform_iter()
+    test_histogram_sparse()
+    test_transform_features()
+    test_weisfeiler_lehman_relabel()
+    test_shortest_path_batch()
+    test_shortest_path_refit()
+    test_shortest_path_attr_lengths()
+    test_graphlet_sampling_canonical()
+    test_graphlet_sampling_seed()
+    test_random_walk_spectral()
+    test_random_walk_product_graph()
+    test_pyramid_match_intersection()
+    test_pyramid_match_embeddings()
@@ -5,6 +5,10 @@ import numpy as np
 import numpy.testing as npt
 
 from grakel.graph import Graph
+from grakel.graph import all_pairs_shortest_path
+from grakel.graph import bounded_bfs
+from grakel.graph import floyd_warshall
+from grakel.graph import get_neighborhood
 
 global verbose
 
@@ -46,6 +50,7 @@ def test_graph_adjacency():
     g["dict"] = Graph(X, labels, {}, "dictionary")
     g["adjc"] = Graph(X, labels, {}, "adjacency")
     g["all"] = Graph(X, labels, {}, "all")
+    g["csr"] = Graph(X, labels, {}, "csr")
 
     # Desired output label group
     desired_output_label_group = {'cherry': [1, 3], 'banana': [0, 2]}
@@ -90,6 +95,7 @@ def test_graph_edge_dictionary():
     g["dict"] = Graph(X, labels, {}, "dictionary")
     g["adjc"] = Graph(X, labels, {}, "adjacency")
     g["all"] = Graph(X, labels, {}, "all")
+    g["csr"] = Graph(X, labels, {}, "csr")
 
     # Desired output label group
     desired_output_label_group = {'cherry': set(['d', 'b']),
@@ -133,6 +139,116 @@ def test_graph_edge_dictionary():
             npt.assert_equal(spl, desired_labels)
 
 
+def test_all_pairs_shortest_path():
+    """Testing that all shortest path algorithms agree."""
+    rs = np.random.RandomState(42)
+    for i in range(40):
+        n = rs.randint(1, 30)
+        A = (rs.rand(n, n) < rs.rand()).astype(float)
+        if i % 3 == 1:
+            A *= rs.randint(1, 5, size=(n, n))
+        elif i % 3 == 2:
+            A = np.triu(A) + np.triu(A).T
+        # A self loop must not affect the distances
+        A[0, 0] = 2.
+
+        g = Graph(A, {j: 0 for j in range(n)}, {}, "all")
+        spm_dijkstra, _ = g.build_shortest_path_matrix(algorithm_type="dijkstra")
+        spm_fw = floyd_warshall(A)
+        if verbose:
+            print(A)
+            print(spm_fw, '\n')
+        else:
+            npt.assert_array_equal(spm_fw, spm_dijkstra)
+            npt.assert_array_equal(all_pairs_shortest_path(A), spm_fw)
+
+
+def test_bounded_bfs():
+    """Testing the neighborhoods of the truncated BFS against the shortest path matrix."""
+    rs = np.random.RandomState(42)
+    for i in range(40):
+        n = rs.randint(1, 30)
+        A = (rs.rand(n, n) < 0.3*rs.rand()).astype(float)
+        if i % 2 == 1:
+            A = np.triu(A) + np.triu(A).T
+        spm = floyd_warshall(A)
+
+        for depth in range(4):
+            neighborhoods = bounded_bfs(A, depth)
+            for j in range(n):
+                for radius in range(depth + 1):
+                    npt.assert_array_equal(np.sort(get_neighborhood(neighborhoods, j, radius)),
+                                           np.flatnonzero(spm[j] <= radius))
+
+        # The neighborhoods and distances of the graph
+        g = Graph(A, {j: 0 for j in range(n)}, {})
+        N, D, Dist_pair = g.produce_neighborhoods(r=2, with_distances=True, d=3)
+        npt.assert_equal(sorted(N.keys()), [0, 1, 2])
+        for level in range(1, 3):
+            for j in range(n):
+                npt.assert_array_equal(N[level][j], np.flatnonzero(spm[j] <= level))
+        for level in range(4):
+            npt.assert_equal(D[level], set(zip(*np.nonzero(spm == level))))
+        npt.assert_equal(Dist_pair, {(j, k): int(spm[j, k]) for j in range(n) for k in range(n)
+                                     if spm[j, k] <= 3})
+
+
+def test_csr_storage():
+    """Testing the reads of the "csr" format against the other formats."""
+    rs = np.random.RandomState(42)
+    for i in range(20):
+        n = rs.randint(1, 20)
+        A = (rs.rand(n, n) < 0.3).astype(float)*rs.randint(1, 3, size=(n, n))
+        node_labels = {j: 'abc'[rs.randint(3)] for j in range(n)}
+        edge_labels = {(j, k): rs.randint(2) for (j, k) in zip(*np.nonzero(A))}
+        ga = Graph(A, node_labels, edge_labels, "adjacency")
+        gc = Graph(A, node_labels, edge_labels, "csr")
+
+        # Reads do not build the other formats
+        for j in range(n):
+            npt.assert_equal(gc.neighbors(j, with_weights=True),
+                             ga.get_edge_dictionary()[j])
+        npt.assert_equal(gc.get_edges(with_weights=True), ga.get_edges(with_weights=True))
+        npt.assert_equal(list(gc.get_vertices()), list(ga.get_vertices()))
+        npt.assert_equal(gc.build_shortest_path_matrix(labels="none"),
+                         ga.build_shortest_path_matrix(labels="none"))
+        npt.assert_equal(gc.get_labels(), node_labels)
+        npt.assert_equal(gc.get_labels("edge", return_none=True) or {}, edge_labels)
+        vertices = sorted(rs.choice(n, rs.randint(1, n + 1), replace=False).tolist())
+        sa, sc = ga.get_subgraph(vertices), gc.get_subgraph(vertices)
+        npt.assert_equal(sc.get_adjacency_matrix(), sa.get_adjacency_matrix())
+        npt.assert_equal(sc.get_labels(), sa.get_labels())
+        npt.assert_equal(sc.get_labels("edge", return_none=True) or {}, sa.index_edge_labels)
+        npt.assert_equal(gc.adjacency_matrix, None)
+        npt.assert_equal(gc.edge_dictionary, None)
+
+        # Views are built when asked
+        npt.assert_array_equal(gc.get_adjacency_matrix(), A)
+        npt.assert_equal(gc.get_edge_dictionary(), ga.get_edge_dictionary())
+        gc.desired_format("adjacency")
+        npt.assert_array_equal(gc.adjacency_matrix, A)
+        npt.assert_equal(gc.edge_dictionary, None)
+
+    # Symbols of an edge dictionary
+    X = {'a': {'b': 1, 'd': 3}, 'b': {'a': 1}, 'c': {'a': 2, 'b': 3}, 'd': {}}
+    labels = {'a': 'banana', 'b': 'cherry', 'c': 'banana', 'd': 'cherry'}
+    g = Graph(X, labels, {('c', 'a'): 1}, "csr")
+    npt.assert_equal(g.neighbors('c', purpose="dictionary", with_weights=True), X['c'])
+    npt.assert_equal(g.get_vertices(purpose="dictionary"), set(X.keys()))
+    npt.assert_equal(g.get_labels(purpose="dictionary"), labels)
+    npt.assert_equal(g.get_labels("edge", purpose="dictionary"), {('c', 'a'): 1})
+    npt.assert_equal(g.get_subgraph(['a', 'c']).get_edges("dictionary", with_weights=True),
+                     [(('c', 'a'), 2.)])
+    g.change_format("dictionary")
+    npt.assert_equal(g.edge_dictionary, X)
+    g.change_format("csr")
+    npt.assert_equal(g.csr_storage.symbols, ['a', 'b', 'c', 'd'])
+    npt.assert_equal(g.get_labels("edge"), {(2, 0): 1})
+
+
 if __name__ == '__main__':
     test_graph_adjacency()
     test_graph_edge_dictionary()
+    test_all_pairs_shortest_path()
+    test_bounded_bfs()
+    test_csr_storage()